@@ -0,0 +1,395 @@
+"""
+server side analytics computed with mongo aggregation pipelines
+
+run ``python -m app.analytics`` to store diagnosis keys on patients and
+next due doses on immunization cards recorded before they existed.
+"""
+import asyncio
+from datetime import date, datetime, timedelta
+from typing import Optional
+
+from fastapi import Query
+from pymongo import UpdateOne
+
+from app.cache import TTLCache
+from app.conditional import bump_version, collection_version
+from app.models import Clinic, Immunization, Patient, Vaccine, normalize_diagnosis
+from app.pagination import Page, as_datetime, decode_cursor, encode_cursor, to_json_row
+from app.readpref import reader
+from app.schedule import next_due
+from app.settings import settings
+
+# (immunizations version, from, to, clinic) -> coverage report. Keyed by
+# the shared version, so a write through any worker retires the reports
+# cached by all of them; the writing worker also clears its own at once.
+COVERAGE_CACHE = TTLCache(maxsize=256, ttl=settings.ANALYTICS_CACHE_TTL)
+
+# dose pairs whose dropout rate programme managers track
+DROPOUT_PAIRS = {
+    "penta1_penta3": (Vaccine.PENTA1, Vaccine.PENTA3),
+    "measles1_measles2": (Vaccine.MEASLES1, Vaccine.MEASLES2),
+}
+
+
+class CoverageParams:
+    """query parameters of the coverage report"""
+
+    def __init__(
+        self,
+        date_from: Optional[date] = Query(None, alias="from"),
+        date_to: Optional[date] = Query(None, alias="to"),
+        clinic: Optional[Clinic] = None,
+    ):
+        self.date_from = date_from
+        self.date_to = date_to
+        self.clinic = clinic
+
+    def key(self) -> tuple:
+        return (self.date_from, self.date_to, self.clinic)
+
+
+def invalidate_coverage() -> None:
+    """drops this worker's cached coverage reports after an immunization write"""
+
+    COVERAGE_CACHE.clear()
+
+
+def _vaccine_name(value: str) -> str:
+    try:
+        return Vaccine(value).name
+    except ValueError:
+        return value
+
+
+def dropout_rates(rows: list[dict]) -> dict:
+    """dropout between first and last dose of each tracked pair"""
+
+    totals: dict[str, int] = {}
+    for row in rows:
+        totals[row["vaccine"]] = totals.get(row["vaccine"], 0) + row["count"]
+
+    rates = {}
+    for name, (first, last) in DROPOUT_PAIRS.items():
+        started = totals.get(first.name, 0)
+        finished = totals.get(last.name, 0)
+        rates[name] = {
+            "first": started,
+            "last": finished,
+            "rate": (started - finished) / started if started else None,
+        }
+    return rates
+
+
+async def immunization_coverage(params: CoverageParams) -> dict:
+    """
+    doses given per vaccine, clinic, month and gender
+
+    :return: the grouped counts and the dropout rates over the same range
+    """
+
+    key = (await collection_version("immunizations"), *params.key())
+    cached = COVERAGE_CACHE.get(key)
+    if cached is not None:
+        return cached
+
+    match: dict = {}
+    if params.clinic:
+        match["clinic"] = params.clinic.value
+    date_range = {}
+    if params.date_from:
+        date_range["$gte"] = as_datetime(params.date_from)
+    if params.date_to:
+        date_range["$lte"] = as_datetime(params.date_to, end=True)
+    if date_range:
+        match["date_of_vaccination"] = date_range
+
+    pipeline = [
+        {"$match": match},
+        {"$project": {
+            "_id": 0,
+            "vaccine_given": 1,
+            "clinic": 1,
+            "gender": 1,
+            "date_of_vaccination": 1,
+        }},
+        {"$unwind": "$vaccine_given"},
+        {
+            "$group": {
+                "_id": {
+                    "vaccine": "$vaccine_given",
+                    "clinic": "$clinic",
+                    "month": {
+                        "$dateToString": {
+                            "format": "%Y-%m",
+                            "date": "$date_of_vaccination",
+                        }
+                    },
+                    "gender": "$gender",
+                },
+                "count": {"$sum": 1},
+            }
+        },
+        {"$sort": {"_id.month": 1, "_id.clinic": 1, "_id.vaccine": 1}},
+    ]
+    groups = await reader(Immunization).aggregate(
+        pipeline
+    ).to_list(length=None)
+
+    rows = [
+        {
+            "vaccine": _vaccine_name(group["_id"]["vaccine"]),
+            "clinic": group["_id"].get("clinic"),
+            "month": group["_id"]["month"],
+            "gender": group["_id"].get("gender"),
+            "count": group["count"],
+        }
+        for group in groups
+    ]
+    report = {"rows": rows, "dropout": dropout_rates(rows)}
+    COVERAGE_CACHE.set(key, report)
+    return report
+
+
+WEEK_MS = 7 * 24 * 60 * 60 * 1000
+
+
+class SurveillanceParams:
+    """query parameters of the surveillance report"""
+
+    def __init__(
+        self,
+        as_of: Optional[date] = None,
+        weeks: int = Query(4, ge=2, le=52),
+        clinic: Optional[Clinic] = None,
+        diagnosis: Optional[str] = None,
+    ):
+        self.as_of = as_of or date.today()
+        self.weeks = weeks
+        self.clinic = clinic
+        self.diagnosis = diagnosis
+
+
+async def diagnosis_surveillance(params: SurveillanceParams) -> list[dict]:
+    """
+    weekly visit counts per clinic and diagnosis over a rolling window
+
+    week 0 is the seven days ending on as_of, week 1 the seven before it
+    and so on.
+
+    :return: one row per clinic and diagnosis with the weekly counts and
+        the week over week change
+    """
+
+    window_end = as_datetime(params.as_of, end=True)
+    window_start = as_datetime(params.as_of - timedelta(weeks=params.weeks) + timedelta(days=1))
+
+    match: dict = {"date_of_visit": {"$gte": window_start, "$lte": window_end}}
+    if params.clinic:
+        match["clinic"] = params.clinic.value
+    if params.diagnosis:
+        match["diagnosis_key"] = normalize_diagnosis(params.diagnosis)
+
+    pipeline = [
+        {"$match": match},
+        {"$project": {"_id": 0, "clinic": 1, "diagnosis_key": 1, "date_of_visit": 1}},
+        {"$unwind": "$clinic"},
+        {
+            "$group": {
+                "_id": {
+                    "clinic": "$clinic",
+                    "diagnosis": "$diagnosis_key",
+                    "week": {
+                        "$floor": {
+                            "$divide": [
+                                {"$subtract": [window_end, "$date_of_visit"]},
+                                WEEK_MS,
+                            ]
+                        }
+                    },
+                },
+                "count": {"$sum": 1},
+            }
+        },
+    ]
+    if params.clinic:
+        # other clinics of multi-clinic visits survive the $unwind
+        pipeline.insert(3, {"$match": {"clinic": params.clinic.value}})
+
+    groups = await reader(Patient).aggregate(
+        pipeline
+    ).to_list(length=None)
+
+    series: dict[tuple, list[int]] = {}
+    for group in groups:
+        key = (group["_id"]["clinic"], group["_id"]["diagnosis"])
+        week = int(group["_id"]["week"])
+        counts = series.setdefault(key, [0] * params.weeks)
+        if 0 <= week < params.weeks:
+            counts[week] += group["count"]
+
+    rows = []
+    for (clinic, diagnosis), counts in series.items():
+        current, previous = counts[0], counts[1]
+        rows.append({
+            "clinic": clinic,
+            "diagnosis": diagnosis,
+            "weekly_counts": counts,
+            "current_week": current,
+            "previous_week": previous,
+            "delta": current - previous,
+            "change": (current - previous) / previous if previous else None,
+        })
+    rows.sort(key=lambda row: (-row["delta"], row["clinic"], row["diagnosis"] or ""))
+    return rows
+
+
+DEFAULTER_FIELDS = (
+    "card_no", "name", "caregivers_name", "contact_no", "address", "clinic",
+    "DOB", "date_of_vaccination", "next_vaccine", "next_due_date",
+)
+
+
+class DefaultersParams:
+    """query parameters of the defaulter list"""
+
+    def __init__(
+        self,
+        clinic: Optional[Clinic] = None,
+        as_of: Optional[date] = None,
+        grace_days: int = Query(0, ge=0, le=365),
+        cursor: Optional[str] = None,
+        limit: int = Query(500, ge=1, le=5000),
+    ):
+        self.clinic = clinic
+        self.as_of = as_of or date.today()
+        self.grace_days = grace_days
+        self.cursor = cursor
+        self.limit = limit
+
+
+async def immunization_defaulters(params: DefaultersParams) -> Page:
+    """
+    children whose next dose fell due before as_of, most overdue first
+
+    a range scan over the stored next_due_date, paged on (next_due_date, _id)
+    """
+
+    cutoff = as_datetime(params.as_of - timedelta(days=params.grace_days))
+    query: dict = {"next_due_date": {"$lt": cutoff}}
+    if params.clinic:
+        query["clinic"] = params.clinic.value
+    if params.cursor:
+        due, _id = decode_cursor(params.cursor)
+        query = {
+            "$and": [
+                query,
+                {"$or": [
+                    {"next_due_date": {"$gt": due}},
+                    {"next_due_date": due, "_id": {"$gt": _id}},
+                ]},
+            ]
+        }
+
+    rows = (
+        await reader(Immunization)
+        .find(query, {field: 1 for field in DEFAULTER_FIELDS})
+        .sort([("next_due_date", 1), ("_id", 1)])
+        .limit(params.limit + 1)
+        .to_list(length=params.limit + 1)
+    )
+    next_cursor = None
+    if len(rows) > params.limit:
+        rows = rows[: params.limit]
+        next_cursor = encode_cursor(rows[-1]["next_due_date"], rows[-1]["_id"])
+
+    as_of = as_datetime(params.as_of)
+    for row in rows:
+        row["days_overdue"] = (as_of - row["next_due_date"]).days
+        to_json_row(row, Immunization)
+        row["next_vaccine"] = _vaccine_name(row["next_vaccine"])
+    return Page.model_construct(items=rows, next_cursor=next_cursor, limit=params.limit)
+
+
+async def backfill_diagnosis_keys(batch_size: int = 1000) -> int:
+    """
+    stores diagnosis_key on every patient missing one
+
+    updated_at moves too, since synced clients see the key.
+
+    :return: the number of patients updated
+    """
+
+    now = datetime.utcnow()
+    collection = Patient.get_motor_collection()
+    cursor = collection.find(
+        {"diagnosis_key": {"$exists": False}},
+        {"provisional_diagnosis": 1},
+        batch_size=batch_size,
+    )
+    updated = 0
+    batch = []
+    async for row in cursor:
+        key = normalize_diagnosis(row.get("provisional_diagnosis") or "")
+        batch.append(UpdateOne(
+            {"_id": row["_id"]}, {"$set": {"diagnosis_key": key, "updated_at": now}}
+        ))
+        if len(batch) >= batch_size:
+            updated += (await collection.bulk_write(batch, ordered=False)).modified_count
+            batch = []
+    if batch:
+        updated += (await collection.bulk_write(batch, ordered=False)).modified_count
+    if updated:
+        await bump_version("patients")
+    return updated
+
+
+async def backfill_next_due(batch_size: int = 1000) -> int:
+    """
+    stores the next due dose on every immunization card missing one
+
+    updated_at moves too, since synced clients see the dose.
+
+    :return: the number of cards updated
+    """
+
+    now = datetime.utcnow()
+    collection = Immunization.get_motor_collection()
+    cursor = collection.find(
+        {"next_due_date": {"$exists": False}},
+        {"DOB": 1, "vaccine_given": 1, "date_of_vaccination": 1},
+        batch_size=batch_size,
+    )
+    updated = 0
+    batch = []
+    async for row in cursor:
+        last_visit = row.get("date_of_vaccination")
+        vaccine, due = next_due(
+            row.get("DOB"),
+            [_vaccine_name(v) for v in row.get("vaccine_given") or []],
+            last_visit.date() if last_visit else None,
+        )
+        batch.append(UpdateOne({"_id": row["_id"]}, {"$set": {
+            "next_vaccine": Vaccine[vaccine].value if vaccine else None,
+            "next_due_date": as_datetime(due) if due else None,
+            "updated_at": now,
+        }}))
+        if len(batch) >= batch_size:
+            updated += (await collection.bulk_write(batch, ordered=False)).modified_count
+            batch = []
+    if batch:
+        updated += (await collection.bulk_write(batch, ordered=False)).modified_count
+    if updated:
+        await bump_version("immunizations")
+    return updated
+
+
+async def main() -> None:
+    from app.database import init_db
+
+    await init_db(settings.DATABASE_URL)
+    print(f"stored diagnosis keys on {await backfill_diagnosis_keys()} patients")
+    print(f"stored next due doses on {await backfill_next_due()} immunization cards")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
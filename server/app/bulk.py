@@ -0,0 +1,188 @@
+"""
+bulk insert of offline collected records and batch lookups by key
+"""
+from typing import Awaitable, Callable, Literal, Type
+
+from beanie import Document
+from fastapi import HTTPException
+from pydantic import BaseModel, ValidationError
+from pymongo.errors import BulkWriteError
+
+from app.pagination import build_projection, to_json_row
+
+MAX_BULK_SIZE = 1000
+MAX_BATCH_GET_SIZE = 5000
+DUPLICATE_KEY_ERROR = 11000
+
+
+class BulkRowResult(BaseModel):
+    """the outcome of one row of a bulk upload"""
+
+    index: int
+    status: Literal["created", "duplicate", "invalid"]
+    key: str | None = None
+    detail: str | list | None = None
+
+
+class BulkResult(BaseModel):
+    """the outcome of a bulk upload"""
+
+    created: int
+    duplicates: int
+    invalid: int
+    results: list[BulkRowResult]
+
+
+async def bulk_insert(
+    document: Type[Document],
+    create_model: Type[BaseModel],
+    rows: list[dict],
+    key_field: str,
+    entered_by: str,
+    on_created: Callable[[list[Document]], Awaitable[None]] | None = None,
+) -> BulkResult:
+    """
+    validates a batch and writes it with one unordered insert_many
+
+    rows repeating a key of an earlier row are reported without being
+    sent; duplicates of stored records are detected by the unique index on
+    key_field, so the batch costs a single round trip whatever its size.
+
+    :param document: the document class to insert into
+    :param create_model: the schema each row must satisfy
+    :param rows: the raw rows from the client
+    :param key_field: the uniquely indexed natural key of the document
+    :param entered_by: the username recorded on every row
+    :param on_created: called with the documents that were inserted
+    :return: a per row result, in request order
+    """
+
+    if len(rows) > MAX_BULK_SIZE:
+        raise HTTPException(
+            status_code=413,
+            detail=f"At most {MAX_BULK_SIZE} records per batch",
+        )
+
+    results: list[BulkRowResult] = []
+    documents = []
+    positions = []  # request index of each entry in documents
+    first_rows: dict[str, int] = {}  # key -> the request index first using it
+    for index, row in enumerate(rows):
+        key = row.get(key_field) if isinstance(row, dict) else None
+        try:
+            data = create_model.model_validate(row)
+        except ValidationError as exc:
+            results.append(
+                BulkRowResult(
+                    index=index,
+                    status="invalid",
+                    key=key if isinstance(key, str) else None,
+                    detail=exc.errors(include_url=False, include_context=False),
+                )
+            )
+            continue
+        key = getattr(data, key_field)
+        if key in first_rows:
+            # caught here rather than by the index, to name the row it repeats
+            results.append(
+                BulkRowResult(
+                    index=index,
+                    status="duplicate",
+                    key=key,
+                    detail=f"{key_field} repeats row {first_rows[key]}",
+                )
+            )
+            continue
+        first_rows[key] = index
+        documents.append(document(**data.model_dump(), entered_by=entered_by))
+        positions.append(index)
+        results.append(
+            BulkRowResult(index=index, status="created", key=key)
+        )
+
+    if documents:
+        try:
+            await document.insert_many(documents, ordered=False)
+        except BulkWriteError as exc:
+            for error in exc.details.get("writeErrors", []):
+                row = results[positions[error["index"]]]
+                if error.get("code") == DUPLICATE_KEY_ERROR:
+                    row.status = "duplicate"
+                    row.detail = f"{key_field} already exists"
+                else:
+                    row.status = "invalid"
+                    row.detail = error.get("errmsg")
+
+    if on_created is not None:
+        created = [
+            doc for doc, index in zip(documents, positions)
+            if results[index].status == "created"
+        ]
+        if created:
+            await on_created(created)
+
+    statuses = [row.status for row in results]
+    return BulkResult(
+        created=statuses.count("created"),
+        duplicates=statuses.count("duplicate"),
+        invalid=statuses.count("invalid"),
+        results=results,
+    )
+
+
+class BatchGetRequest(BaseModel):
+    """the keys to resolve, and optionally the fields to return"""
+
+    keys: list[str]
+    fields: str | None = None
+
+
+class BatchGetItem(BaseModel):
+    """one requested key and its record, if it exists"""
+
+    key: str
+    found: bool
+    record: dict | None = None
+
+
+class BatchGetResult(BaseModel):
+    """the records of a batch get, in request order"""
+
+    items: list[BatchGetItem]
+    missing: list[str]
+
+
+async def batch_get(
+    document: Type[Document], key_field: str, request: BatchGetRequest
+) -> BatchGetResult:
+    """
+    resolves many natural keys with a single $in query
+
+    :param document: the document class to read
+    :param key_field: the uniquely indexed natural key of the document
+    :param request: the keys and the optional field list
+    :return: one item per requested key, in request order, with missing
+        keys flagged rather than dropped
+    """
+
+    if len(request.keys) > MAX_BATCH_GET_SIZE:
+        raise HTTPException(
+            status_code=413,
+            detail=f"At most {MAX_BATCH_GET_SIZE} keys per batch",
+        )
+    unique = list(dict.fromkeys(request.keys))
+    projection = build_projection(document, request.fields)
+    if request.fields:
+        projection[key_field] = 1
+    rows = await document.get_motor_collection().find(
+        {key_field: {"$in": unique}}, projection
+    ).to_list(length=None)
+    by_key = {row[key_field]: to_json_row(row, document) for row in rows}
+
+    # plain dicts, as the rows are sent by rows_response without a pydantic pass
+    items = [
+        {"key": key, "found": key in by_key, "record": by_key.get(key)}
+        for key in request.keys
+    ]
+    missing = [key for key in unique if key not in by_key]
+    return BatchGetResult.model_construct(items=items, missing=missing)
@@ -0,0 +1,106 @@
+"""
+in-process caches
+"""
+from collections import OrderedDict
+import time
+from typing import Any, Callable, Hashable
+
+from app.settings import settings
+
+
+class TTLCache:
+    """
+    a size bounded LRU cache whose entries expire after ttl seconds
+    """
+
+    def __init__(
+        self,
+        maxsize: int,
+        ttl: float,
+        timer: Callable[[], float] = time.monotonic,
+    ):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.timer = timer
+        self.hits = 0
+        self.misses = 0
+        self._data: OrderedDict[Hashable, tuple[float, Any]] = OrderedDict()
+
+    def get(self, key: Hashable, default: Any = None) -> Any:
+        """returns the cached value, counting the hit or miss"""
+
+        entry = self._data.get(key)
+        if entry is None:
+            self.misses += 1
+            return default
+        expires_at, value = entry
+        if expires_at <= self.timer():
+            del self._data[key]
+            self.misses += 1
+            return default
+        self._data.move_to_end(key)
+        self.hits += 1
+        return value
+
+    def set(self, key: Hashable, value: Any, ttl: float | None = None) -> None:
+        """stores a value, evicting the least recently used entry if full"""
+
+        self._data[key] = (self.timer() + (ttl or self.ttl), value)
+        self._data.move_to_end(key)
+        while len(self._data) > self.maxsize:
+            self._data.popitem(last=False)
+
+    def pop(self, key: Hashable) -> Any:
+        """removes a key, returning its value if present"""
+
+        entry = self._data.pop(key, None)
+        return entry[1] if entry else None
+
+    def discard_where(self, predicate: Callable[[Any], bool]) -> int:
+        """removes every entry whose value matches predicate"""
+
+        stale = [k for k, (_, v) in self._data.items() if predicate(v)]
+        for key in stale:
+            del self._data[key]
+        return len(stale)
+
+    def values(self) -> list[Any]:
+        """the values of the entries that haven't expired"""
+
+        now = self.timer()
+        return [value for expires_at, value in self._data.values() if expires_at > now]
+
+    def clear(self) -> None:
+        self._data.clear()
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+    def stats(self) -> dict:
+        """hit/miss counters for monitoring"""
+
+        lookups = self.hits + self.misses
+        return {
+            "size": len(self._data),
+            "maxsize": self.maxsize,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_ratio": self.hits / lookups if lookups else 0.0,
+        }
+
+
+# access token -> (User, revocation key), so authenticated requests skip the db
+USER_CACHE = TTLCache(
+    maxsize=settings.USER_CACHE_SIZE, ttl=settings.USER_CACHE_TTL
+)
+
+
+def invalidate_user(username: str) -> int:
+    """
+    drops every cached session of a user, e.g. after a role change
+
+    only in this worker; the others notice the change on their next
+    revalidation (app.middlewares.authware.revalidate_cached_users)
+    """
+
+    return USER_CACHE.discard_where(lambda entry: entry[0].username == username)
@@ -0,0 +1,153 @@
+"""
+optimistic concurrency for record writes
+
+every record carries a revision that each update increments. Reads return
+it, with the record's _id, as the ETag and writes may send it back in
+If-Match; a write whose revision no longer matches is rejected instead of
+silently overwriting a concurrent edit. The _id tells a record deleted and
+recreated under the same key from the one the client saw, though both
+start at revision 0.
+"""
+from typing import Callable, NamedTuple, Type
+
+from beanie import Document, UpdateResponse
+from beanie.odm.utils.encoder import Encoder
+from bson import ObjectId
+from bson.errors import InvalidId
+from fastapi import HTTPException, Response
+
+# attempts of a derived write that keeps losing its revision to other writers
+DERIVED_WRITE_ATTEMPTS = 3
+
+
+class Precondition(NamedTuple):
+    """the record and revision an If-Match names"""
+
+    record_id: ObjectId | None  # None for ETags issued before they had one
+    revision: int
+
+
+def etag(record_id: ObjectId | str | None, revision: int | None) -> str:
+    """the ETag header value of a record's revision"""
+
+    return f'"{record_id}-{revision or 0}"'
+
+
+def set_etag(response: Response, document: Document) -> None:
+    """exposes a document's revision to the client"""
+
+    response.headers["ETag"] = etag(document.id, getattr(document, "revision", 0))
+
+
+def parse_if_match(if_match: str | None) -> Precondition | None:
+    """
+    the record and revision a client expects, or None if it sent no
+    precondition
+
+    :param if_match: the raw If-Match header, e.g. '"<_id>-3"' or
+        'W/"<_id>-3"' or '*'; a bare '"3"' only names a revision
+    """
+
+    if if_match is None or if_match.strip() == "*":
+        return None
+    value = if_match.strip().removeprefix("W/").strip('"')
+    record_id, _, revision = value.rpartition("-")
+    try:
+        return Precondition(ObjectId(record_id) if record_id else None, int(revision))
+    except (InvalidId, ValueError):
+        raise HTTPException(status_code=400, detail="Invalid If-Match header")
+
+
+def with_revision(query: dict, if_match: str | None) -> dict:
+    """adds the If-Match precondition, if any, to a write filter"""
+
+    expected = parse_if_match(if_match)
+    if expected is None:
+        return query
+    if expected.record_id is not None:
+        query = {**query, "_id": expected.record_id}
+    if expected.revision == 0:
+        # records written before revisions existed have none stored
+        return {**query, "revision": {"$in": [0, None]}}
+    return {**query, "revision": expected.revision}
+
+
+async def raise_missing_or_conflict(
+    document: Type[Document], query: dict, detail: str, status_code: int = 412
+) -> None:
+    """
+    explains why a conditional write matched nothing
+
+    only runs on the failure path, so successful writes stay one round trip.
+
+    :param status_code: the status of a record that exists but didn't
+        match, 412 when the client's If-Match failed
+    """
+
+    if await document.get_motor_collection().count_documents(query, limit=1):
+        raise HTTPException(
+            status_code=status_code,
+            detail="Record was modified by someone else, reload and retry",
+        )
+    raise HTTPException(status_code=404, detail=detail)
+
+
+async def update_derived(
+    document: Type[Document],
+    query: dict,
+    if_match: str | None,
+    changes: dict,
+    derive: Callable[[dict], dict],
+    inputs: set[str],
+    detail: str,
+) -> Document:
+    """
+    applies an update whose changes feed fields derived from the record
+
+    derive computes the derived fields from the record's inputs with the
+    changes applied, and both go into a single $set, so the stored
+    derived fields always match the stored inputs. When the changes carry
+    every input that is the only round trip. Otherwise the stored inputs
+    are read first and the write only lands while the revision read is
+    still current; without If-Match a write that lost that race is
+    recomputed and retried, and one that keeps losing is a 409.
+
+    :param changes: the encoded fields to $set
+    :param derive: maps the raw inputs to the derived fields
+    :param inputs: the fields derive reads
+    :return: the updated document
+    """
+
+    update = {"$inc": {"revision": 1}}
+    if inputs <= changes.keys():
+        # Encoder keeps None, which clears a derived field
+        derived = Encoder().encode(derive(changes))
+        updated = await document.find_one(with_revision(query, if_match)).update(
+            {"$set": {**changes, **derived}, **update},
+            response_type=UpdateResponse.NEW_DOCUMENT,
+        )
+        if updated is None:
+            await raise_missing_or_conflict(document, query, detail)
+        return updated
+
+    projection = {name: 1 for name in inputs} | {"revision": 1}
+    for _ in range(DERIVED_WRITE_ATTEMPTS):
+        current = await document.get_motor_collection().find_one(
+            with_revision(query, if_match), projection
+        )
+        if current is None:
+            await raise_missing_or_conflict(document, query, detail)
+        derived = Encoder().encode(derive({**current, **changes}))
+        updated = await document.find_one(
+            with_revision(query, etag(current["_id"], current.get("revision")))
+        ).update(
+            {"$set": {**changes, **derived}, **update},
+            response_type=UpdateResponse.NEW_DOCUMENT,
+        )
+        if updated is not None:
+            return updated
+        if if_match is not None:
+            # the revision the client sent is gone
+            await raise_missing_or_conflict(document, query, detail)
+    # no precondition failed, other writers just kept winning
+    await raise_missing_or_conflict(document, query, detail, status_code=409)
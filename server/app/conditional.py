@@ -0,0 +1,141 @@
+"""
+conditional GET: ETag / Last-Modified validators and 304 responses
+
+a record's validators are its _id and revision (the same ETag If-Match
+checks) and its updated_at; a list's are its collection's version counter, bumped by
+every write, and the query string. Either is read with a projection or a
+single small document, so an unchanged resource is answered with 304
+before the full documents are loaded.
+"""
+import hashlib
+from datetime import datetime, timezone
+from email.utils import format_datetime, parsedate_to_datetime
+from typing import Type
+
+from beanie import Document
+from fastapi import Request, Response
+from motor.motor_asyncio import AsyncIOMotorClientSession
+
+from app.concurrency import etag
+from app.models import CollectionVersion
+
+
+class Validators:
+    """the ETag and Last-Modified of a resource"""
+
+    def __init__(self, etag: str, last_modified: datetime | None):
+        self.etag = etag
+        self.last_modified = last_modified
+
+    def headers(self) -> dict[str, str]:
+        headers = {"ETag": self.etag, "Cache-Control": "private, no-cache"}
+        if self.last_modified is not None:
+            headers["Last-Modified"] = http_date(self.last_modified)
+        return headers
+
+    def apply(self, response: Response) -> None:
+        response.headers.update(self.headers())
+
+
+def http_date(value: datetime) -> str:
+    """an HTTP date of a naive utc datetime as stored by mongo"""
+
+    return format_datetime(value.replace(tzinfo=timezone.utc), usegmt=True)
+
+
+def is_conditional(request: Request) -> bool:
+    return "if-none-match" in request.headers or "if-modified-since" in request.headers
+
+
+def _opaque(tag: str) -> str:
+    return tag.strip().removeprefix("W/")
+
+
+def not_modified(request: Request, validators: Validators) -> bool:
+    """
+    whether the client's cached copy is still current
+
+    If-None-Match wins over If-Modified-Since when both are sent, and is
+    compared weakly since compression changes the bytes but not the data.
+    """
+
+    if_none_match = request.headers.get("if-none-match")
+    if if_none_match is not None:
+        if if_none_match.strip() == "*":
+            return True
+        current = _opaque(validators.etag)
+        return any(_opaque(tag) == current for tag in if_none_match.split(","))
+
+    if_modified_since = request.headers.get("if-modified-since")
+    if if_modified_since and validators.last_modified is not None:
+        try:
+            since = parsedate_to_datetime(if_modified_since)
+        except (TypeError, ValueError):
+            return False
+        if since.tzinfo is None:
+            since = since.replace(tzinfo=timezone.utc)
+        # http dates have whole seconds
+        modified = validators.last_modified.replace(microsecond=0, tzinfo=timezone.utc)
+        return modified <= since
+    return False
+
+
+def not_modified_response(validators: Validators) -> Response:
+    return Response(status_code=304, headers=validators.headers())
+
+
+async def record_validators(document: Type[Document], query: dict) -> Validators | None:
+    """
+    a record's validators, read without loading the record
+
+    :return: None if no record matches
+    """
+
+    head = await document.get_motor_collection().find_one(
+        query, {"_id": 1, "revision": 1, "updated_at": 1}
+    )
+    if head is None:
+        return None
+    return Validators(etag(head["_id"], head.get("revision")), head.get("updated_at"))
+
+
+def document_validators(document: Document) -> Validators:
+    return Validators(etag(document.id, getattr(document, "revision", 0)), document.updated_at)
+
+
+async def bump_version(collection: str) -> None:
+    """marks a collection as changed, invalidating its cached lists"""
+
+    await CollectionVersion.get_motor_collection().update_one(
+        {"collection": collection},
+        {"$inc": {"version": 1}, "$set": {"updated_at": datetime.utcnow()}},
+        upsert=True,
+    )
+
+
+async def collection_version(collection: str) -> int:
+    """the collection's current version, shared by every worker"""
+
+    row = await CollectionVersion.get_motor_collection().find_one(
+        {"collection": collection}, {"_id": 0, "version": 1}
+    )
+    return (row or {}).get("version", 0)
+
+
+async def list_validators(
+    collection: str, request: Request, session: AsyncIOMotorClientSession | None = None
+) -> Validators:
+    """
+    the validators of one list query over a collection
+
+    the version is read from the primary; rows read later in the same
+    session are at least as new as it.
+    """
+
+    row = await CollectionVersion.get_motor_collection().find_one(
+        {"collection": collection},
+        {"_id": 0, "version": 1, "updated_at": 1},
+        session=session,
+    ) or {}
+    query = hashlib.sha1(request.url.query.encode()).hexdigest()[:12]
+    return Validators(f'W/"{row.get("version", 0)}-{query}"', row.get("updated_at"))
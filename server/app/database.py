@@ -1,6 +1,8 @@
 """
 Defines the storage engine.
 """
+import asyncio
+import importlib.util
 
 from motor.motor_asyncio import AsyncIOMotorClient
 from beanie import init_beanie
@@ -10,10 +12,23 @@ from app.models import (
     User,
     Patient,
     Immunization,
-    Finance
+    Finance,
+    FinanceDailyRollup,
+    Tombstone,
+    DuplicateCandidate,
+    CollectionVersion,
+    Lease,
+    OutboxEmail,
 )
 
 from app.settings import settings
+from app.metrics import MongoCommandListener, MongoPoolListener
+
+# the client made by init_db; close_db closes it at shutdown
+CLIENT: AsyncIOMotorClient | None = None
+
+# the module pymongo needs for each wire compressor
+COMPRESSOR_MODULES = {"zstd": "zstandard", "snappy": "snappy", "zlib": "zlib"}
 
 
 # def get_mongo_uri() -> str:
@@ -26,6 +41,44 @@ from app.settings import settings
 
 #     return f"{settings.DATABASE_URL}"  # mongodb://{settings.DB_HOST}:{settings.DB_PORT}/" f"{settings.DB_NAME}"
 
+def available_compressors(names: str) -> list[str]:
+    """the configured compressors that are installed, in order of preference"""
+
+    return [
+        name
+        for name in (name.strip() for name in names.split(","))
+        if name in COMPRESSOR_MODULES
+        and importlib.util.find_spec(COMPRESSOR_MODULES[name]) is not None
+    ]
+
+
+def client_options() -> dict:
+    """the motor client's pool, timeout, compression and write concern options"""
+
+    options = {
+        "maxPoolSize": settings.DB_MAX_POOL_SIZE,
+        "minPoolSize": settings.DB_MIN_POOL_SIZE,
+        "maxIdleTimeMS": settings.DB_MAX_IDLE_TIME_MS,
+        "maxConnecting": settings.DB_MAX_CONNECTING,
+        "connectTimeoutMS": settings.DB_CONNECT_TIMEOUT_MS,
+        "socketTimeoutMS": settings.DB_SOCKET_TIMEOUT_MS,
+        "serverSelectionTimeoutMS": settings.DB_SERVER_SELECTION_TIMEOUT_MS,
+        "appname": settings.DB_APP_NAME,
+        "event_listeners": [MongoCommandListener(), MongoPoolListener()],
+    }
+    if compressors := available_compressors(settings.DB_COMPRESSORS):
+        options["compressors"] = compressors
+    if settings.DB_TIMEOUT_MS:
+        options["timeoutMS"] = settings.DB_TIMEOUT_MS
+    if write_concern := settings.DB_WRITE_CONCERN:
+        options["w"] = int(write_concern) if write_concern.isdigit() else write_concern
+    if settings.DB_WRITE_TIMEOUT_MS:
+        options["wTimeoutMS"] = settings.DB_WRITE_TIMEOUT_MS
+    if settings.DB_JOURNAL is not None:
+        options["journal"] = settings.DB_JOURNAL
+    return options
+
+
 async def init_db(uri: str) -> None:
     """
     initializes the db
@@ -33,8 +86,8 @@ async def init_db(uri: str) -> None:
     :param uri: the db uri
     """
 
-    client = AsyncIOMotorClient(uri)
-    #print(client.address)
+    global CLIENT
+    CLIENT = client = AsyncIOMotorClient(uri, **client_options())
     await init_beanie(
         database=client[settings.DB_NAME],
         document_models=[
@@ -42,6 +95,41 @@ async def init_db(uri: str) -> None:
             Patient,
             Immunization,
             Finance,
+            FinanceDailyRollup,
             InvalidatedToken,
-        ]
-    )
\ No newline at end of file
+            Tombstone,
+            DuplicateCandidate,
+            CollectionVersion,
+            Lease,
+            OutboxEmail,
+        ],
+        # off by default: an index missing from a document's declaration
+        # is left alone rather than dropped by whichever instance starts
+        # first. Legacy indexes go through migrations (app.migrate_indexes).
+        allow_index_dropping=settings.DB_ALLOW_INDEX_DROPPING,
+    )
+
+
+async def warm_up_db() -> None:
+    """
+    opens the pool's connections before the first requests need them
+
+    one ping per DB_MIN_POOL_SIZE connection, sent together so each takes
+    its own connection; the driver keeps that many open from then on.
+    """
+
+    if CLIENT is None:
+        return
+    database = CLIENT[settings.DB_NAME]
+    await asyncio.gather(
+        *(database.command("ping") for _ in range(max(settings.DB_MIN_POOL_SIZE, 1)))
+    )
+
+
+def close_db() -> None:
+    """closes the client's connections and stops its monitor threads"""
+
+    global CLIENT
+    if CLIENT is not None:
+        CLIENT.close()
+        CLIENT = None
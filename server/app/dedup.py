@@ -0,0 +1,296 @@
+"""
+fuzzy duplicate detection for patients and immunization cards
+
+records are blocked by a phonetic key of their first and last name plus
+gender (dedup_block, indexed with age), so a check only compares a record
+with the handful sharing its block and a similar age, never the whole
+collection. Candidates are scored with Jaro-Winkler similarity.
+
+run ``python -m app.dedup`` to key records written before deduplication
+existed and check every record once.
+"""
+import asyncio
+import logging
+import os
+import socket
+from datetime import datetime, timedelta
+from typing import Type
+from uuid import uuid4
+
+from beanie import Document
+from pymongo import ReturnDocument, UpdateOne
+from pymongo.errors import DuplicateKeyError
+
+from app.models import DuplicateCandidate, Immunization, Lease, Patient
+from app.text import dedup_block, tokenize
+
+logger = logging.getLogger(__name__)
+
+# similarity at or above which two records are reported
+THRESHOLD = 0.9
+# ages further apart than this are never the same person
+AGE_WINDOW = 3
+MAX_CANDIDATES = 50
+# the lease only one worker's background sweep holds at a time
+SWEEP_LEASE = "dedup-sweep"
+
+# kind -> (document, natural key)
+DEDUPED: dict[str, tuple[Type[Document], str]] = {
+    "patient": (Patient, "hospital_no"),
+    "immunization": (Immunization, "card_no"),
+}
+
+
+def jaro_winkler(a: str, b: str) -> float:
+    """jaro-winkler similarity of two strings, 1.0 meaning identical"""
+
+    if a == b:
+        return 1.0
+    if not a or not b:
+        return 0.0
+    window = max(max(len(a), len(b)) // 2 - 1, 0)
+    a_matched = [False] * len(a)
+    b_matched = [False] * len(b)
+    matches = 0
+    for i, char in enumerate(a):
+        for j in range(max(0, i - window), min(len(b), i + window + 1)):
+            if not b_matched[j] and b[j] == char:
+                a_matched[i] = b_matched[j] = True
+                matches += 1
+                break
+    if not matches:
+        return 0.0
+    a_chars = [c for c, m in zip(a, a_matched) if m]
+    b_chars = [c for c, m in zip(b, b_matched) if m]
+    transpositions = sum(x != y for x, y in zip(a_chars, b_chars)) / 2
+    jaro = (
+        matches / len(a) + matches / len(b) + (matches - transpositions) / matches
+    ) / 3
+    prefix = 0
+    for x, y in zip(a[:4], b[:4]):
+        if x != y:
+            break
+        prefix += 1
+    return jaro + prefix * 0.1 * (1 - jaro)
+
+
+def name_similarity(a: str | None, b: str | None) -> float:
+    """similarity of two names, ignoring word order"""
+
+    a_words, b_words = sorted(tokenize(a)), sorted(tokenize(b))
+    return jaro_winkler(" ".join(a_words), " ".join(b_words))
+
+
+def similarity(kind: str, a: dict, b: dict) -> float:
+    """how likely two records of the same block are the same person"""
+
+    score = name_similarity(a.get("name"), b.get("name"))
+    if kind == "immunization":
+        caregiver = name_similarity(a.get("caregivers_name"), b.get("caregivers_name"))
+        score = 0.7 * score + 0.3 * caregiver
+        if a.get("DOB") and a.get("DOB") == b.get("DOB"):
+            score = min(1.0, score + 0.05)
+    age_gap = abs((a.get("age") or 0) - (b.get("age") or 0))
+    return score - 0.02 * age_gap
+
+
+async def block_candidates(kind: str, record: dict, limit: int = MAX_CANDIDATES) -> list[dict]:
+    """the other records sharing a record's block and a similar age"""
+
+    document, key = DEDUPED[kind]
+    block = dedup_block(record.get("name"), record.get("gender"))
+    if block is None:
+        return []
+    age = record.get("age") or 0
+    query = {
+        "dedup_block": block,
+        "age": {"$gte": age - AGE_WINDOW, "$lte": age + AGE_WINDOW},
+    }
+    if record.get(key):
+        query[key] = {"$ne": record[key]}
+    projection = {"_id": 0, key: 1, "name": 1, "age": 1, "gender": 1,
+                  "caregivers_name": 1, "DOB": 1}
+    return await document.get_motor_collection().find(
+        query, projection
+    ).limit(limit).to_list(length=limit)
+
+
+async def find_duplicates(kind: str, record: dict) -> list[dict]:
+    """
+    scores a record against its block, without writing anything, so it can
+    run before the record itself is stored
+
+    :return: the suspected duplicates, best match first
+    """
+
+    _, key = DEDUPED[kind]
+    suspects = []
+    for candidate in await block_candidates(kind, record):
+        score = similarity(kind, record, candidate)
+        if score >= THRESHOLD:
+            suspects.append({"key": candidate[key], "name": candidate.get("name"), "score": round(score, 3)})
+    suspects.sort(key=lambda s: -s["score"])
+    return suspects
+
+
+async def record_pairs(kind: str, key: str, suspects: list[dict]) -> None:
+    """stores a record's suspected pairs in one write, leaving reviewed pairs alone"""
+
+    if not suspects:
+        return
+    now = datetime.utcnow()
+    writes = []
+    for suspect in suspects:
+        key_a, key_b = sorted((key, suspect["key"]))
+        writes.append(UpdateOne(
+            {"kind": kind, "key_a": key_a, "key_b": key_b},
+            {
+                "$set": {"score": suspect["score"]},
+                "$setOnInsert": {"status": "open", "detected_at": now},
+            },
+            upsert=True,
+        ))
+    await DuplicateCandidate.get_motor_collection().bulk_write(writes, ordered=False)
+
+
+async def check_record(kind: str, record: dict) -> list[dict]:
+    """
+    scores a stored record against its block and records any suspected pairs
+
+    :return: the suspected duplicates, best match first
+    """
+
+    _, key = DEDUPED[kind]
+    suspects = await find_duplicates(kind, record)
+    if record.get(key):
+        await record_pairs(kind, record[key], suspects)
+    return suspects
+
+
+def duplicates_header(suspects: list[dict]) -> str:
+    """the X-Possible-Duplicates value: the suspects' keys, best match first"""
+
+    return ",".join(str(suspect["key"]) for suspect in suspects)
+
+
+async def acquire_lease(name: str, holder: str, ttl: timedelta) -> dict | None:
+    """
+    takes or renews a lease that is free, expired or already held by holder
+
+    :return: the lease, or None while another holder has it
+    """
+
+    now = datetime.utcnow()
+    try:
+        return await Lease.get_motor_collection().find_one_and_update(
+            {"name": name, "$or": [{"holder": holder}, {"expires_at": {"$lte": now}}]},
+            {"$set": {"holder": holder, "expires_at": now + ttl}},
+            upsert=True,
+            return_document=ReturnDocument.AFTER,
+        )
+    except DuplicateKeyError:
+        # held by someone else: the upsert collided with their lease
+        return None
+
+
+class DedupEngine:
+    """
+    background sweep that re-checks every record written since the last
+    sweep against its block
+
+    every worker runs one, but only the holder of the sweep lease sweeps;
+    the lease outlives two intervals, so another worker takes over within
+    that long if the holder dies. The last sweep's start is kept on the
+    lease, so a new holder carries on where the old one stopped.
+    """
+
+    def __init__(self):
+        self.holder = f"{socket.gethostname()}:{os.getpid()}:{uuid4().hex[:8]}"
+        self.checked = 0
+
+    async def sweep(self, since: datetime | None) -> int:
+        """
+        :param since: check records updated from then on, or all when None
+        :return: the number of records checked
+        """
+
+        query = {"updated_at": {"$gte": since}} if since else {}
+        checked = 0
+        for kind, (document, _) in DEDUPED.items():
+            async for record in document.get_motor_collection().find(
+                query, batch_size=500
+            ):
+                await check_record(kind, record)
+                checked += 1
+        self.checked += checked
+        return checked
+
+    async def sweep_if_leader(self, interval: float) -> int | None:
+        """
+        :return: the number of records checked, or None when another
+            worker holds the sweep lease
+        """
+
+        started = datetime.utcnow()
+        lease = await acquire_lease(SWEEP_LEASE, self.holder, timedelta(seconds=2 * interval))
+        if lease is None:
+            return None
+        # a full sweep is the job of ``python -m app.dedup``, not of the
+        # first lease ever taken
+        checked = await self.sweep(lease.get("last_run") or started)
+        await Lease.get_motor_collection().update_one(
+            {"name": SWEEP_LEASE, "holder": self.holder}, {"$set": {"last_run": started}}
+        )
+        return checked
+
+    async def run_forever(self, interval: float) -> None:
+        while True:
+            try:
+                await self.sweep_if_leader(interval)
+            except Exception:
+                logger.exception("duplicate sweep failed, retrying next tick")
+            await asyncio.sleep(interval)
+
+
+DEDUP_ENGINE = DedupEngine()
+
+
+async def backfill_blocks(batch_size: int = 1000) -> int:
+    """
+    stores dedup_block on records written before it existed
+
+    updated_at is left alone: sync rows don't carry the block, so clients
+    have nothing new to fetch.
+    """
+
+    updated = 0
+    for document, _ in DEDUPED.values():
+        collection = document.get_motor_collection()
+        cursor = collection.find(
+            {"dedup_block": {"$exists": False}},
+            {"name": 1, "gender": 1},
+            batch_size=batch_size,
+        )
+        batch = []
+        async for row in cursor:
+            block = dedup_block(row.get("name"), row.get("gender"))
+            batch.append(UpdateOne({"_id": row["_id"]}, {"$set": {"dedup_block": block}}))
+            if len(batch) >= batch_size:
+                updated += (await collection.bulk_write(batch, ordered=False)).modified_count
+                batch = []
+        if batch:
+            updated += (await collection.bulk_write(batch, ordered=False)).modified_count
+    return updated
+
+
+async def main() -> None:
+    from app.database import init_db
+    from app.settings import settings
+
+    await init_db(settings.DATABASE_URL)
+    print(f"keyed {await backfill_blocks()} records")
+    print(f"checked {await DedupEngine().sweep(None)} records for duplicates")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
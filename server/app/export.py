@@ -0,0 +1,182 @@
+"""
+streaming NDJSON/CSV export of whole collections
+
+exports compress themselves, so the compression middleware leaves these
+routes alone: gzip=true downloads a .gz file, otherwise the stream is
+gzip content encoded when the client accepts it.
+"""
+import csv
+import io
+import json
+import zlib
+from datetime import date, datetime
+from enum import Enum
+from typing import AsyncIterator, Optional, Type
+
+from beanie import Document
+from bson import ObjectId
+from fastapi import Header, Query
+from fastapi.responses import StreamingResponse
+
+from app.middlewares.compression import accepts_encoding
+from app.models import INTERNAL_FIELDS, Clinic
+from app.pagination import date_fields
+from app.readpref import reader
+
+EXPORT_BATCH_SIZE = 1000
+# bookkeeping fields that aren't part of an exported record
+EXCLUDED_FIELDS = (*INTERNAL_FIELDS, "revision")
+
+
+class ExportFormat(Enum):
+    NDJSON = "ndjson"
+    CSV = "csv"
+
+
+MEDIA_TYPES = {
+    ExportFormat.NDJSON: "application/x-ndjson",
+    ExportFormat.CSV: "text/csv",
+}
+
+
+class ExportParams:
+    """the list filters plus the output format of an export"""
+
+    def __init__(
+        self,
+        format: ExportFormat = ExportFormat.NDJSON,
+        gzip: bool = False,
+        clinic: Optional[Clinic] = None,
+        date_from: Optional[date] = Query(None, alias="from"),
+        date_to: Optional[date] = Query(None, alias="to"),
+        entered_by: Optional[str] = None,
+        accept_encoding: Optional[str] = Header(None, include_in_schema=False),
+    ):
+        self.format = format
+        self.gzip = gzip
+        self.clinic = clinic
+        self.date_from = date_from
+        self.date_to = date_to
+        self.entered_by = entered_by
+        self.accept_encoding = accept_encoding or ""
+
+
+def encode_value(value):
+    """converts bson values into plain json values"""
+
+    if isinstance(value, ObjectId):
+        return str(value)
+    if isinstance(value, (datetime, date)):
+        return value.isoformat()
+    if isinstance(value, Enum):
+        return value.value
+    return value
+
+
+def export_columns(document: Type[Document]) -> list[str]:
+    """the csv header for a document class"""
+
+    return ["_id"] + [
+        name
+        for name in document.model_fields
+        if name != "id" and name not in EXCLUDED_FIELDS
+    ]
+
+
+async def iter_rows(
+    document: Type[Document], query: dict, batch_size: int = EXPORT_BATCH_SIZE
+) -> AsyncIterator[dict]:
+    """
+    yields raw rows from a motor cursor, batch_size at a time
+
+    :param document: the document class to export
+    :param query: the mongo filter
+    :param batch_size: how many rows each getMore fetches
+    """
+
+    cursor = reader(document).find(
+        query, {name: 0 for name in EXCLUDED_FIELDS}, batch_size=batch_size
+    )
+    dates = date_fields(document)
+    try:
+        async for row in cursor:
+            for name in dates:
+                if isinstance(row.get(name), datetime):
+                    row[name] = row[name].date()
+            yield row
+    finally:
+        await cursor.close()
+
+
+async def iter_ndjson(rows: AsyncIterator[dict]) -> AsyncIterator[bytes]:
+    """encodes rows as newline delimited json"""
+
+    async for row in rows:
+        yield (json.dumps(row, default=encode_value) + "\n").encode()
+
+
+async def iter_csv(
+    rows: AsyncIterator[dict], columns: list[str]
+) -> AsyncIterator[bytes]:
+    """encodes rows as csv, list values joined by ';'"""
+
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(columns)
+    async for row in rows:
+        values = []
+        for column in columns:
+            value = row.get(column)
+            if isinstance(value, list):
+                value = ";".join(str(encode_value(v)) for v in value)
+            values.append(encode_value(value))
+        writer.writerow(values)
+        yield buffer.getvalue().encode()
+        buffer.seek(0)
+        buffer.truncate()
+    if buffer.tell():
+        yield buffer.getvalue().encode()
+
+
+async def iter_gzip(chunks: AsyncIterator[bytes]) -> AsyncIterator[bytes]:
+    """gzips a byte stream incrementally"""
+
+    compressor = zlib.compressobj(wbits=31)
+    async for chunk in chunks:
+        compressed = compressor.compress(chunk)
+        if compressed:
+            yield compressed
+    yield compressor.flush()
+
+
+def export_response(
+    document: Type[Document], query: dict, params: ExportParams, name: str
+) -> StreamingResponse:
+    """
+    streams a filtered collection as ndjson or csv
+
+    :param document: the document class to export
+    :param query: the mongo filter
+    :param params: the export parameters
+    :param name: the base name of the downloaded file
+    """
+
+    rows = iter_rows(document, query)
+    if params.format == ExportFormat.CSV:
+        body = iter_csv(rows, export_columns(document))
+    else:
+        body = iter_ndjson(rows)
+
+    filename = f"{name}.{params.format.value}"
+    media_type = MEDIA_TYPES[params.format]
+    headers = {"Vary": "Accept-Encoding"}
+    if params.gzip:
+        body = iter_gzip(body)
+        filename += ".gz"
+        media_type = "application/gzip"
+    elif accepts_encoding(params.accept_encoding, "gzip"):
+        body = iter_gzip(body)
+        headers["Content-Encoding"] = "gzip"
+    headers["Content-Disposition"] = f'attachment; filename="{filename}"'
+
+    return StreamingResponse(body, media_type=media_type, headers=headers)
@@ -0,0 +1,267 @@
+"""
+index audit: explains every query shape the routers issue
+
+usage: python -m app.index_audit
+exits non zero if any shape's winning plan contains a COLLSCAN.
+Unfiltered exports read the whole collection by design and aren't listed.
+"""
+import asyncio
+from datetime import datetime, timedelta
+from typing import NamedTuple, Type
+
+from beanie import Document
+from bson import ObjectId
+import pymongo
+
+from app.models import (
+    Clinic,
+    DuplicateCandidate,
+    Finance,
+    FinanceDailyRollup,
+    Immunization,
+    InvalidatedToken,
+    Patient,
+    Tombstone,
+    User,
+)
+
+NEWEST_FIRST = [("created_at", pymongo.DESCENDING), ("_id", pymongo.DESCENDING)]
+OLDEST_CHANGE_FIRST = [("updated_at", pymongo.ASCENDING), ("_id", pymongo.ASCENDING)]
+
+
+class QueryShape(NamedTuple):
+    name: str
+    document: Type[Document]
+    filter: dict
+    sort: list | None = None
+    pipeline: list | None = None
+
+
+def _shapes() -> list[QueryShape]:
+    now = datetime.utcnow()
+    week_ago = now - timedelta(days=7)
+    oid = ObjectId()
+    after_cursor = {
+        "$or": [
+            {"created_at": {"$lt": now}},
+            {"created_at": now, "_id": {"$lt": oid}},
+        ]
+    }
+    after_watermark = {
+        "$or": [
+            {"updated_at": {"$gt": week_ago}},
+            {"updated_at": week_ago, "_id": {"$gt": oid}},
+        ]
+    }
+
+    shapes = []
+    for document, key, date_field in (
+        (Patient, "hospital_no", "date_of_visit"),
+        (Immunization, "card_no", "date_of_vaccination"),
+        (Finance, "record_id", "record_date"),
+    ):
+        name = document.__name__.lower()
+        shapes += [
+            QueryShape(f"{name}: get by {key}", document, {key: "x"}),
+            QueryShape(f"{name}: list", document, {}, NEWEST_FIRST),
+            QueryShape(f"{name}: list next page", document, after_cursor, NEWEST_FIRST),
+            QueryShape(
+                f"{name}: list by entered_by", document, {"entered_by": "x"}, NEWEST_FIRST
+            ),
+            QueryShape(
+                f"{name}: list by date range",
+                document,
+                {date_field: {"$gte": week_ago, "$lte": now}},
+                NEWEST_FIRST,
+            ),
+            QueryShape(f"{name}: export by entered_by", document, {"entered_by": "x"}),
+            QueryShape(f"{name}: sync", document, after_watermark, OLDEST_CHANGE_FIRST),
+        ]
+
+    for document, key in ((Patient, "hospital_no"), (Immunization, "card_no")):
+        name = document.__name__.lower()
+        shapes += [
+            QueryShape(
+                f"{name}: list by clinic", document, {"clinic": Clinic.Okeila_CHC.value}, NEWEST_FIRST
+            ),
+            QueryShape(
+                f"{name}: search whole words", document, {"search_keys": {"$all": ["ada$", "obi$"]}}
+            ),
+            QueryShape(
+                f"{name}: search prefixes",
+                document,
+                {"search_keys": {"$all": ["ada", "ob"]}, key: {"$nin": ["x"]}},
+            ),
+            QueryShape(
+                f"{name}: duplicate block",
+                document,
+                {"dedup_block": "A100-O420:F", "age": {"$gte": 20, "$lte": 26}},
+            ),
+        ]
+
+    shapes += [
+        QueryShape(
+            "patient: surveillance",
+            Patient,
+            {},
+            pipeline=[
+                {"$match": {"date_of_visit": {"$gte": week_ago, "$lte": now}}},
+                {"$unwind": "$clinic"},
+            ],
+        ),
+        QueryShape(
+            "patient: surveillance by clinic",
+            Patient,
+            {},
+            pipeline=[
+                {"$match": {
+                    "clinic": Clinic.Okeila_CHC.value,
+                    "date_of_visit": {"$gte": week_ago, "$lte": now},
+                }},
+            ],
+        ),
+        QueryShape(
+            "immunization: coverage",
+            Immunization,
+            {},
+            pipeline=[
+                {"$match": {"date_of_vaccination": {"$gte": week_ago, "$lte": now}}},
+                {"$unwind": "$vaccine_given"},
+            ],
+        ),
+        QueryShape(
+            "immunization: coverage by clinic",
+            Immunization,
+            {},
+            pipeline=[{"$match": {"clinic": Clinic.Okeila_CHC.value}}],
+        ),
+        QueryShape(
+            "immunization: defaulters",
+            Immunization,
+            {"next_due_date": {"$lt": now}},
+            [("next_due_date", pymongo.ASCENDING), ("_id", pymongo.ASCENDING)],
+        ),
+        QueryShape(
+            "immunization: defaulters by clinic",
+            Immunization,
+            {"clinic": Clinic.Okeila_CHC.value, "next_due_date": {"$lt": now}},
+            [("next_due_date", pymongo.ASCENDING), ("_id", pymongo.ASCENDING)],
+        ),
+        QueryShape(
+            "finance rollup: upsert",
+            FinanceDailyRollup,
+            {"clinic": "x", "day": now, "source": "DRF"},
+        ),
+        QueryShape(
+            "finance rollup: summary",
+            FinanceDailyRollup,
+            {},
+            pipeline=[{"$match": {"count": {"$gt": 0}, "day": {"$gte": week_ago}}}],
+        ),
+        QueryShape(
+            "finance rollup: clinic summary",
+            FinanceDailyRollup,
+            {},
+            pipeline=[{"$match": {"count": {"$gt": 0}, "clinic": "x"}}],
+        ),
+        QueryShape(
+            "duplicates: open pairs",
+            DuplicateCandidate,
+            {"status": "open", "kind": {"$in": ["patient"]}},
+            [("score", pymongo.DESCENDING)],
+        ),
+        QueryShape("user: by username", User, {"username": "x"}),
+        QueryShape("user: by email", User, {"email": "x@example.com"}),
+        QueryShape(
+            "user: login", User, {"$or": [{"email": "x"}, {"username": "x"}]}
+        ),
+        QueryShape("revoked tokens: load", InvalidatedToken, {"expires_at": {"$gt": now}}),
+        QueryShape(
+            "revoked tokens: refresh", InvalidatedToken, {"invalidated_at": {"$gt": now}}
+        ),
+        QueryShape(
+            "tombstones: sync",
+            Tombstone,
+            {**after_watermark, "collection": {"$in": ["patients"]}},
+            OLDEST_CHANGE_FIRST,
+        ),
+    ]
+    return shapes
+
+
+def _has_collscan(plan) -> bool:
+    if isinstance(plan, dict):
+        if plan.get("stage") == "COLLSCAN":
+            return True
+        return any(_has_collscan(v) for v in plan.values())
+    if isinstance(plan, list):
+        return any(_has_collscan(v) for v in plan)
+    return False
+
+
+def _winning_plans(explain) -> list:
+    """every winningPlan in an explain output, including nested $cursor stages"""
+
+    found = []
+    if isinstance(explain, dict):
+        for key, value in explain.items():
+            if key == "winningPlan":
+                found.append(value)
+            else:
+                found += _winning_plans(value)
+    elif isinstance(explain, list):
+        for value in explain:
+            found += _winning_plans(value)
+    return found
+
+
+async def explain(shape: QueryShape) -> dict:
+    collection = shape.document.get_motor_collection()
+    if shape.pipeline is not None:
+        return await collection.database.command(
+            {
+                "explain": {
+                    "aggregate": collection.name,
+                    "pipeline": shape.pipeline,
+                    "cursor": {},
+                },
+                "verbosity": "queryPlanner",
+            }
+        )
+    cursor = collection.find(shape.filter)
+    if shape.sort:
+        cursor = cursor.sort(shape.sort)
+    return await cursor.limit(50).explain()
+
+
+async def audit() -> list[str]:
+    """
+    explains every query shape
+
+    :return: the names of the shapes that scan a whole collection
+    """
+
+    failures = []
+    for shape in _shapes():
+        plans = _winning_plans(await explain(shape))
+        scans = any(_has_collscan(plan) for plan in plans)
+        print(f"{'COLLSCAN' if scans else 'ok':8}  {shape.name}")
+        if scans:
+            failures.append(shape.name)
+    return failures
+
+
+async def main() -> int:
+    from app.database import init_db
+    from app.settings import settings
+
+    await init_db(settings.DATABASE_URL)
+    failures = await audit()
+    if failures:
+        print(f"\n{len(failures)} query shape(s) scan a whole collection")
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(asyncio.run(main()))
@@ -0,0 +1,227 @@
+"""
+request and database instrumentation
+
+MetricsMiddleware times every request by route template and counts its
+response bytes. MongoCommandListener, registered on the motor client,
+attributes each mongo round trip to the request that issued it: motor
+runs pymongo with a copy of the caller's context, so the listener finds
+the request's RequestStats through a context variable. MongoPoolListener
+tracks the driver's connection pools. Totals go to the prometheus
+registry served at /metrics. Each request also gets a
+Server-Timing header and one json access log line.
+"""
+import logging
+import threading
+import time
+import uuid
+from contextvars import ContextVar
+
+from prometheus_client import CONTENT_TYPE_LATEST, Counter, Gauge, Histogram, generate_latest
+from pymongo import monitoring
+from starlette.datastructures import Headers, MutableHeaders
+from starlette.responses import Response
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+from app.log import REQUEST_ID
+
+logger = logging.getLogger("app.access")
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+REQUEST_LATENCY = Histogram(
+    "http_request_duration_seconds",
+    "time to the last response byte",
+    ["method", "route", "status"],
+    buckets=LATENCY_BUCKETS,
+)
+REQUESTS_IN_FLIGHT = Gauge(
+    "http_requests_in_flight", "requests being served", ["method"]
+)
+RESPONSE_SIZE = Histogram(
+    "http_response_size_bytes",
+    "response body bytes as sent, after compression",
+    ["method", "route"],
+    buckets=(256, 1024, 4096, 16384, 65536, 262144, 1048576, 4194304),
+)
+MONGO_DURATION = Histogram(
+    "mongo_command_duration_seconds",
+    "mongo round trip time per command",
+    ["command"],
+    buckets=LATENCY_BUCKETS,
+)
+MONGO_FAILURES = Counter(
+    "mongo_command_failures_total", "mongo commands that failed", ["command"]
+)
+MONGO_CALLS_PER_REQUEST = Histogram(
+    "mongo_commands_per_request",
+    "mongo round trips a request made",
+    ["route"],
+    buckets=(0, 1, 2, 3, 5, 8, 13, 21, 50),
+)
+POOL_CONNECTIONS = Gauge(
+    "mongo_pool_connections", "open connections in the driver's pool", ["address"]
+)
+POOL_IN_USE = Gauge(
+    "mongo_pool_connections_in_use", "pool connections checked out by an operation", ["address"]
+)
+POOL_CHECKOUT_FAILURES = Counter(
+    "mongo_pool_checkout_failures_total",
+    "operations that got no connection, e.g. on a full pool's wait timeout",
+    ["address", "reason"],
+)
+POOL_CLEARED = Counter(
+    "mongo_pool_cleared_total", "times a server's pool was reset after an error", ["address"]
+)
+
+
+class RequestStats:
+    """the mongo round trips of one request"""
+
+    def __init__(self):
+        self._lock = threading.Lock()  # listeners run on motor's threads
+        self.mongo_calls = 0
+        self.mongo_seconds = 0.0
+
+    def add(self, seconds: float) -> None:
+        with self._lock:
+            self.mongo_calls += 1
+            self.mongo_seconds += seconds
+
+
+REQUEST_STATS: ContextVar[RequestStats | None] = ContextVar("request_stats", default=None)
+
+
+class MongoCommandListener(monitoring.CommandListener):
+    def started(self, event: monitoring.CommandStartedEvent) -> None:
+        pass
+
+    def _finished(self, event, failed: bool) -> None:
+        seconds = event.duration_micros / 1_000_000
+        MONGO_DURATION.labels(event.command_name).observe(seconds)
+        if failed:
+            MONGO_FAILURES.labels(event.command_name).inc()
+        if (stats := REQUEST_STATS.get()) is not None:
+            stats.add(seconds)
+
+    def succeeded(self, event: monitoring.CommandSucceededEvent) -> None:
+        self._finished(event, failed=False)
+
+    def failed(self, event: monitoring.CommandFailedEvent) -> None:
+        self._finished(event, failed=True)
+
+
+class MongoPoolListener(monitoring.ConnectionPoolListener):
+    """keeps the pool gauges in step with the driver's connection events"""
+
+    @staticmethod
+    def _address(event) -> str:
+        host, port = event.address
+        return f"{host}:{port}"
+
+    def pool_created(self, event: monitoring.PoolCreatedEvent) -> None:
+        pass
+
+    def pool_ready(self, event: monitoring.PoolReadyEvent) -> None:
+        pass
+
+    def pool_cleared(self, event: monitoring.PoolClearedEvent) -> None:
+        POOL_CLEARED.labels(self._address(event)).inc()
+
+    def pool_closed(self, event: monitoring.PoolClosedEvent) -> None:
+        pass
+
+    def connection_created(self, event: monitoring.ConnectionCreatedEvent) -> None:
+        POOL_CONNECTIONS.labels(self._address(event)).inc()
+
+    def connection_ready(self, event: monitoring.ConnectionReadyEvent) -> None:
+        pass
+
+    def connection_closed(self, event: monitoring.ConnectionClosedEvent) -> None:
+        POOL_CONNECTIONS.labels(self._address(event)).dec()
+
+    def connection_check_out_started(self, event: monitoring.ConnectionCheckOutStartedEvent) -> None:
+        pass
+
+    def connection_check_out_failed(self, event: monitoring.ConnectionCheckOutFailedEvent) -> None:
+        POOL_CHECKOUT_FAILURES.labels(self._address(event), event.reason).inc()
+
+    def connection_checked_out(self, event: monitoring.ConnectionCheckedOutEvent) -> None:
+        POOL_IN_USE.labels(self._address(event)).inc()
+
+    def connection_checked_in(self, event: monitoring.ConnectionCheckedInEvent) -> None:
+        POOL_IN_USE.labels(self._address(event)).dec()
+
+
+def route_template(scope: Scope) -> str:
+    """the matched route's path, e.g. /api/patients/{patient}, for labels"""
+
+    route = scope.get("route")
+    return getattr(route, "path", None) or "unmatched"
+
+
+class MetricsMiddleware:
+    """times requests, counts their bytes and mongo calls, and logs them"""
+
+    def __init__(self, app: ASGIApp):
+        self.app = app
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        method = scope["method"]
+        start = time.perf_counter()
+        stats = RequestStats()
+        stats_token = REQUEST_STATS.set(stats)
+        # a proxy's id is kept so log lines can be joined across services
+        request_id = Headers(scope=scope).get("x-request-id", "")[:64] or uuid.uuid4().hex
+        id_token = REQUEST_ID.set(request_id)
+        status = 500
+        size = 0
+
+        async def send_wrapper(message: Message) -> None:
+            nonlocal status, size
+            if message["type"] == "http.response.start":
+                status = message["status"]
+                elapsed = (time.perf_counter() - start) * 1000
+                headers = MutableHeaders(scope=message)
+                headers.append("X-Request-ID", request_id)
+                headers.append(
+                    "Server-Timing",
+                    f'app;dur={elapsed:.1f}, '
+                    f'db;dur={stats.mongo_seconds * 1000:.1f};desc="{stats.mongo_calls} mongo calls"',
+                )
+            elif message["type"] == "http.response.body":
+                size += len(message.get("body", b""))
+            await send(message)
+
+        REQUESTS_IN_FLIGHT.labels(method).inc()
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            REQUESTS_IN_FLIGHT.labels(method).dec()
+            duration = time.perf_counter() - start
+            route = route_template(scope)
+            REQUEST_LATENCY.labels(method, route, str(status)).observe(duration)
+            RESPONSE_SIZE.labels(method, route).observe(size)
+            MONGO_CALLS_PER_REQUEST.labels(route).observe(stats.mongo_calls)
+            logger.info(
+                "request",
+                extra={
+                    "method": method,
+                    "route": route,
+                    "path": scope["path"],
+                    "status": status,
+                    "duration_ms": round(duration * 1000, 1),
+                    "mongo_calls": stats.mongo_calls,
+                    "mongo_ms": round(stats.mongo_seconds * 1000, 1),
+                    "bytes": size,
+                },
+            )
+            REQUEST_STATS.reset(stats_token)
+            REQUEST_ID.reset(id_token)
+
+
+def metrics_response() -> Response:
+    return Response(generate_latest(), media_type=CONTENT_TYPE_LATEST)
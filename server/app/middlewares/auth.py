@@ -8,9 +8,14 @@ from fastapi import HTTPException, Security, Cookie
 from fastapi.responses import JSONResponse
 from fastapi_jwt import JwtAuthorizationCredentials, JwtAccessCookie
 from beanie.operators import Or
+from pymongo.errors import DuplicateKeyError
 
 from app.models import User, Roles
-from app.utils import create_passwd_hash, verify_passwd
+from app.utils import (
+    create_passwd_hash_async,
+    duplicate_key_conflict,
+    verify_and_update_passwd_async,
+)
 from app.settings import settings
 
 
@@ -41,19 +46,21 @@ async def authenticate(
 async def register_user(
     email: str, username: str, passwd: str, role: List[Roles]
 ) -> User:
-    """creates a new user"""
-    if await User.find_one(User.username == username):
-        raise HTTPException(status_code=409, detail="username already exists")
-
-    if await User.find_one(User.email == email):
-        raise HTTPException(status_code=409, detail="email already exists")
-
+    """creates a new user, relying on the unique username/email indexes"""
     new_user = User(
-        username=username, email=email, password=create_passwd_hash(passwd), role=role
+        username=username,
+        email=email,
+        password=await create_passwd_hash_async(passwd),
+        role=role,
     )
 
     try:
         await new_user.insert()
+    except DuplicateKeyError as exc:
+        raise duplicate_key_conflict(
+            exc,
+            {"username": "username already exists", "email": "email already exists"},
+        )
     except Exception:
         raise HTTPException(status_code=500, detail="user registration failed")
 
@@ -77,8 +84,11 @@ async def login_user(
             status_code=404, detail="invalid username or email"
         )
 
-    if not verify_passwd(passwd, user.password):
+    verified, new_hash = await verify_and_update_passwd_async(passwd, user.password)
+    if not verified:
         raise HTTPException(status_code=401, detail="invalid password")
+    if new_hash:
+        await user.set({User.password: new_hash})
 
     token = JWT.create_access_token(
         {"username": user.username},
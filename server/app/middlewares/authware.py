@@ -1,12 +1,20 @@
+import asyncio
 from datetime import datetime, timedelta
+import logging
+import time
+from uuid import uuid4
 from jose import JWTError, jwt
 from fastapi import Depends, HTTPException
 from fastapi.security import OAuth2PasswordBearer
 
 from typing import Optional
 
-from app.models import InvalidatedToken, User
+from app.models import User
 from app.settings import settings
+from app.cache import USER_CACHE
+from app.revocation import REVOKED_TOKENS, revocation_key
+
+logger = logging.getLogger(__name__)
 
 ALGORITHM = "HS256"
 ACCESS_TOKEN_EXPIRE_MINUTES = 30
@@ -24,7 +32,7 @@ def create_access_token(data: dict, expires_delta: Optional[timedelta] = None):
         expire = datetime.utcnow() + expires_delta
     else:
         expire = datetime.utcnow() + timedelta(minutes=ACCESS_TOKEN_EXPIRE_MINUTES)
-    to_encode.update({"exp": expire})
+    to_encode.update({"exp": expire, "jti": uuid4().hex})
     encoded_jwt = jwt.encode(to_encode, settings.SECRET_KEY, algorithm=ALGORITHM)
     return encoded_jwt
 
@@ -41,22 +49,85 @@ def decode_access_token(token: str):
 
 
 async def get_current_user(token: str = Depends(oauth2_scheme)) -> User:
+    # Tokens that were validated recently skip the db entirely
+    cached = USER_CACHE.get(token)
+    if cached is not None:
+        user, key = cached
+        if key in REVOKED_TOKENS:
+            USER_CACHE.pop(token)
+            raise HTTPException(status_code=401, detail="Invalid token")
+        return user
+
+    payload = decode_access_token(token)
     # Check if the token is invalidated
-    invalidated_token = await InvalidatedToken.find_one({"token": token})
-    if invalidated_token:
+    key = revocation_key(payload, token)
+    if key in REVOKED_TOKENS:
         raise HTTPException(status_code=401, detail="Invalid token")
 
-    payload = decode_access_token(token)
     username: str = payload.get("sub")
     user = await get_user(username)
     if not user:
         raise HTTPException(status_code=401, detail="Invalid token")
+
+    # never cache a session past the token's own expiry
+    ttl = min(settings.USER_CACHE_TTL, payload["exp"] - time.time())
+    if ttl > 0:
+        USER_CACHE.set(token, (user, key), ttl=ttl)
     return user
 
 
+def _changed(user: User, row: dict | None) -> bool:
+    """whether a cached user no longer matches its stored row"""
+
+    return row is None or (
+        row.get("email") != user.email
+        or row.get("password") != user.password
+        or row.get("role") != [role.value for role in user.role]
+    )
+
+
+async def revalidate_cached_users() -> int:
+    """
+    drops the cached sessions of users changed or deleted since they were
+    cached, by another worker or directly in the db
+
+    the after_event hook on User only clears the worker that made the
+    change; this compares every cached user with its row in one query.
+
+    :return: the number of sessions dropped
+    """
+
+    cached = {user.username: user for user, _ in USER_CACHE.values()}
+    if not cached:
+        return 0
+    rows = {
+        row["username"]: row
+        async for row in User.get_motor_collection().find(
+            {"username": {"$in": list(cached)}},
+            {"_id": 0, "username": 1, "email": 1, "password": 1, "role": 1},
+        )
+    }
+    stale = {name for name, user in cached.items() if _changed(user, rows.get(name))}
+    if not stale:
+        return 0
+    return USER_CACHE.discard_where(lambda entry: entry[0].username in stale)
+
+
+async def revalidate_cached_users_forever(interval: float) -> None:
+    """background task keeping the user cache in line with the collection"""
+
+    while True:
+        await asyncio.sleep(interval)
+        try:
+            await revalidate_cached_users()
+        except Exception:
+            # keep serving from the cache; retry on the next tick
+            logger.exception("revalidating cached users failed")
+
+
 async def is_user_doctor(current_user: User = Depends(get_current_user)):
     user_roles = [role.value for role in current_user.role]
-    print(user_roles)
+    logger.debug("checking roles", extra={"user": current_user.username, "roles": user_roles})
     if "Doctor" not in user_roles:
         raise HTTPException(status_code=403, detail="Forbidden: User is not a doctor")
     return current_user
@@ -64,7 +135,7 @@ async def is_user_doctor(current_user: User = Depends(get_current_user)):
 
 async def is_accountant(current_user: User = Depends(get_current_user)):
     user_roles = [role.value for role in current_user.role]
-    print(user_roles)
+    logger.debug("checking roles", extra={"user": current_user.username, "roles": user_roles})
     if (
         "Doctor" not in user_roles
         and "Accountant" not in user_roles
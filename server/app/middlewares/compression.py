@@ -0,0 +1,80 @@
+"""
+response compression
+
+brotli when the brotli-asgi package is installed and the client accepts
+it, gzip otherwise. Responses under COMPRESS_MIN_SIZE bytes are sent as
+they are, since compressing them costs more than it saves. Exports
+compress themselves (see app.export) and are passed through untouched.
+"""
+import re
+from typing import Sequence
+
+from fastapi import FastAPI
+from starlette.middleware.gzip import GZipMiddleware
+from starlette.types import ASGIApp, Receive, Scope, Send
+
+try:
+    from brotli_asgi import BrotliMiddleware
+except ImportError:  # optional, gzip covers every client
+    BrotliMiddleware = None
+
+# paths whose responses are already compressed by the route
+EXCLUDED_PATHS = [r"/export$"]
+
+
+class ExcludingGZipMiddleware(GZipMiddleware):
+    """GZipMiddleware that skips excluded paths, as BrotliMiddleware can"""
+
+    def __init__(
+        self, app: ASGIApp, minimum_size: int = 500, excluded_handlers: Sequence[str] = ()
+    ) -> None:
+        super().__init__(app, minimum_size=minimum_size)
+        self.excluded_handlers = [re.compile(path) for path in excluded_handlers]
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        path = scope.get("path", "")
+        if any(pattern.search(path) for pattern in self.excluded_handlers):
+            await self.app(scope, receive, send)
+            return
+        await super().__call__(scope, receive, send)
+
+
+def accepts_encoding(accept_encoding: str, coding: str) -> bool:
+    """
+    whether an Accept-Encoding header allows a content coding
+
+    the coding, or failing that "*", must be listed with a q-value above
+    zero, so "gzip;q=0" refuses gzip rather than asking for it.
+    """
+
+    qualities = {}
+    for entry in accept_encoding.split(","):
+        name, _, params = entry.partition(";")
+        quality = 1.0
+        for param in params.split(";"):
+            key, _, value = param.partition("=")
+            if key.strip().lower() == "q":
+                try:
+                    quality = float(value)
+                except ValueError:
+                    quality = 0.0
+        qualities[name.strip().lower()] = quality
+    return qualities.get(coding, qualities.get("*", 0.0)) > 0
+
+
+def add_compression(app: FastAPI, minimum_size: int) -> None:
+    """installs the best available compression middleware on the app"""
+
+    if BrotliMiddleware is not None:
+        app.add_middleware(
+            BrotliMiddleware,
+            minimum_size=minimum_size,
+            gzip_fallback=True,
+            excluded_handlers=EXCLUDED_PATHS,
+        )
+    else:
+        app.add_middleware(
+            ExcludingGZipMiddleware,
+            minimum_size=minimum_size,
+            excluded_handlers=EXCLUDED_PATHS,
+        )
@@ -0,0 +1,137 @@
+"""
+rewrites stored enum labels as their short codes
+
+usage: python -m app.migrate_codes [--dry-run]
+
+streams the documents that still hold a label, in batches, and sets the
+code instead; it can be stopped and rerun at any point. updated_at moves
+on every rewritten document, so synced clients fetch the codes too. Collection and
+index sizes, and the json size of a sample of documents as the list
+endpoints return them, are printed before and after. On disk size only
+follows once the storage engine reuses or compacts the freed space.
+"""
+import asyncio
+import json
+import sys
+from datetime import datetime
+from typing import Type
+
+from beanie import Document
+from bson import BSON
+from pymongo import UpdateOne
+
+from app.codes import codes_by_label
+from app.conditional import bump_version
+from app.models import Finance, Immunization, Patient
+
+# document -> field -> enum the field holds
+CODED_FIELDS: dict[Type[Document], dict[str, str]] = {
+    Patient: {"clinic": "Clinic"},
+    Immunization: {"clinic": "Clinic", "vaccine_given": "Vaccine", "next_vaccine": "Vaccine"},
+    Finance: {"source": "Source"},
+}
+# document -> the name its list versions are kept under
+VERSIONED = {Patient: "patients", Immunization: "immunizations", Finance: "finances"}
+SAMPLE_SIZE = 200
+
+
+def to_codes(value, codes: dict[str, str]):
+    """a stored value, or each value of a list, with labels swapped for codes"""
+
+    if isinstance(value, list):
+        return [codes.get(item, item) for item in value]
+    return codes.get(value, value)
+
+
+async def collection_sizes(document: Type[Document]) -> dict:
+    collection = document.get_motor_collection()
+    stats = await collection.database.command("collStats", collection.name)
+    return {
+        "count": stats.get("count", 0),
+        "size": stats.get("size", 0),
+        "avg_obj_size": stats.get("avgObjSize", 0),
+        "index_size": stats.get("totalIndexSize", 0),
+    }
+
+
+async def sample_sizes(document: Type[Document], ids: list) -> dict:
+    """bson and json bytes of the same sample of documents"""
+
+    rows = await document.get_motor_collection().find(
+        {"_id": {"$in": ids}}
+    ).to_list(length=None)
+    return {
+        "bson": sum(len(BSON.encode(row)) for row in rows),
+        "json": sum(len(json.dumps(row, default=str)) for row in rows),
+    }
+
+
+async def migrate(document: Type[Document], batch_size: int = 1000, dry_run: bool = False) -> int:
+    """
+    replaces labels with codes in one collection
+
+    :return: the number of documents that held a label
+    """
+
+    fields = {field: codes_by_label(enum) for field, enum in CODED_FIELDS[document].items()}
+    query = {"$or": [{field: {"$in": list(codes)}} for field, codes in fields.items()]}
+    collection = document.get_motor_collection()
+    cursor = collection.find(query, {field: 1 for field in fields}, batch_size=batch_size)
+
+    now = datetime.utcnow()
+    seen = 0
+    batch = []
+    async for row in cursor:
+        seen += 1
+        changes = {
+            field: to_codes(row[field], codes)
+            for field, codes in fields.items()
+            if field in row
+        }
+        batch.append(UpdateOne({"_id": row["_id"]}, {"$set": {**changes, "updated_at": now}}))
+        if len(batch) >= batch_size:
+            if not dry_run:
+                await collection.bulk_write(batch, ordered=False)
+            batch = []
+    if batch and not dry_run:
+        await collection.bulk_write(batch, ordered=False)
+    if seen and not dry_run:
+        await bump_version(VERSIONED[document])
+    return seen
+
+
+def _report(name: str, before: dict, after: dict) -> None:
+    for key in before:
+        change = after[key] - before[key]
+        pct = f"{100 * change / before[key]:+.1f}%" if before[key] else ""
+        print(f"  {name + ' ' + key:28} {before[key]:>14,} -> {after[key]:>14,} {pct}")
+
+
+async def main(dry_run: bool = False) -> None:
+    from app.database import init_db
+    from app.settings import settings
+
+    await init_db(settings.DATABASE_URL)
+    for document in CODED_FIELDS:
+        name = document.get_motor_collection().name
+        ids = [
+            row["_id"]
+            for row in await document.get_motor_collection()
+            .find({}, {"_id": 1})
+            .limit(SAMPLE_SIZE)
+            .to_list(length=SAMPLE_SIZE)
+        ]
+        stats_before = await collection_sizes(document)
+        sample_before = await sample_sizes(document, ids)
+
+        migrated = await migrate(document, dry_run=dry_run)
+
+        print(f"{name}: {migrated} documents {'to migrate' if dry_run else 'migrated'}")
+        if dry_run:
+            continue
+        _report("collection", stats_before, await collection_sizes(document))
+        _report(f"{len(ids)} sample docs", sample_before, await sample_sizes(document, ids))
+
+
+if __name__ == "__main__":
+    asyncio.run(main(dry_run="--dry-run" in sys.argv))
@@ -0,0 +1,159 @@
+"""
+resolves duplicate keys and drops indexes the documents no longer declare
+
+usage: python -m app.migrate_indexes [--dry-run]
+
+run it before deploying a version that adds a unique index: init_db
+can't build one over duplicate values, and the app won't start.
+
+the unique indexes on hospital_no, card_no, record_id and the users'
+username and email were once declared in a way Beanie ignored, so
+duplicates may have been stored. Of each duplicated key the oldest record
+keeps it and the others are renamed (see renamed_key); nothing is
+deleted, the renamed records are listed for review.
+
+users.username and users.email used to carry unique TEXT indexes, which
+apply uniqueness to single words rather than whole values. They were
+replaced by plain unique indexes; this drops the old ones. No query of
+the app uses $text, so any other TEXT index found is dropped as well,
+along with the RETIRED_INDEXES. Running it again finds nothing to do.
+"""
+import asyncio
+import sys
+from datetime import datetime
+
+from bson import ObjectId
+from motor.motor_asyncio import AsyncIOMotorClient, AsyncIOMotorCollection, AsyncIOMotorDatabase
+
+# collection -> indexes that were declared once and serve no query now
+RETIRED_INDEXES = {
+    # the password reset sends a signed token, nothing looks users up by it
+    "users": ["reset_token_1"],
+}
+
+
+# collection -> the fields declared unique on its document
+UNIQUE_KEYS = {
+    "Patient": ["hospital_no"],
+    "Immunization": ["card_no"],
+    "Finance": ["record_id"],
+    "users": ["username", "email"],
+}
+# the list version counters of the record collections (app.conditional)
+VERSIONED = {"Patient": "patients", "Immunization": "immunizations", "Finance": "finances"}
+
+
+def renamed_key(field: str, value: str, row_id: ObjectId) -> str:
+    """
+    the key a duplicate is moved to: unique, and still showing the old one
+
+    emails stay valid addresses, with the suffix as a +tag
+    """
+
+    suffix = f"dup-{row_id}"
+    if field == "email" and "@" in value:
+        local, domain = value.rsplit("@", 1)
+        return f"{local}+{suffix}@{domain}"
+    return f"{value}~{suffix}"
+
+
+async def resolve_duplicates(
+    database: AsyncIOMotorDatabase, dry_run: bool = False
+) -> dict[str, list[str]]:
+    """
+    keeps the oldest record of every duplicated unique key, renames the rest
+
+    renamed records get a new updated_at and revision, so syncing clients
+    fetch them and cached lists and ETags are invalidated.
+
+    :return: "collection.field" -> the keys given to the renamed records
+    """
+
+    renames = {}
+    now = datetime.utcnow()
+    for name, fields in UNIQUE_KEYS.items():
+        collection = database[name]
+        for field in fields:
+            groups = collection.aggregate([
+                {"$match": {field: {"$type": "string"}}},
+                {"$group": {"_id": f"${field}", "ids": {"$push": "$_id"}, "count": {"$sum": 1}}},
+                {"$match": {"count": {"$gt": 1}}},
+            ])
+            async for group in groups:
+                # object ids grow with insertion time: the first is the oldest
+                for row_id in sorted(group["ids"])[1:]:
+                    key = renamed_key(field, group["_id"], row_id)
+                    renames.setdefault(f"{name}.{field}", []).append(key)
+                    if dry_run:
+                        continue
+                    update = {"$set": {field: key}}
+                    if name in VERSIONED:
+                        update = {"$set": {field: key, "updated_at": now}, "$inc": {"revision": 1}}
+                    await collection.update_one({"_id": row_id}, update)
+        if name in VERSIONED and not dry_run and any(
+            f"{name}.{field}" in renames for field in fields
+        ):
+            await database["collection_versions"].update_one(
+                {"collection": VERSIONED[name]},
+                {"$inc": {"version": 1}, "$set": {"updated_at": now}},
+                upsert=True,
+            )
+    return renames
+
+
+async def legacy_indexes(collection: AsyncIOMotorCollection) -> list[str]:
+    """the names of a collection's TEXT and retired indexes"""
+
+    retired = RETIRED_INDEXES.get(collection.name, [])
+    return [
+        name
+        for name, spec in (await collection.index_information()).items()
+        if name in retired or any(kind == "text" for _, kind in spec["key"])
+    ]
+
+
+async def migrate(database: AsyncIOMotorDatabase, dry_run: bool = False) -> dict[str, list[str]]:
+    """
+    drops every TEXT and retired index of the database
+
+    :return: collection name -> the indexes dropped (or to drop)
+    """
+
+    dropped = {}
+    for name in await database.list_collection_names():
+        collection = database[name]
+        indexes = await legacy_indexes(collection)
+        if not indexes:
+            continue
+        if not dry_run:
+            for index in indexes:
+                await collection.drop_index(index)
+        dropped[name] = indexes
+    return dropped
+
+
+async def main(dry_run: bool = False) -> None:
+    from app import database
+    from app.settings import settings
+
+    # not init_db: building the declared indexes fails while duplicates remain
+    client = AsyncIOMotorClient(settings.DATABASE_URL, **database.client_options())
+    renames = await resolve_duplicates(client[settings.DB_NAME], dry_run=dry_run)
+    for field, keys in renames.items():
+        print(f"{field}: {len(keys)} duplicates {'to rename' if dry_run else 'renamed'}: {', '.join(keys)}")
+    if not renames:
+        print("no duplicate keys")
+    dropped = await migrate(client[settings.DB_NAME], dry_run=dry_run)
+    for name, indexes in dropped.items():
+        print(f"{name}: {', '.join(indexes)} {'to drop' if dry_run else 'dropped'}")
+    if not dropped:
+        print("no legacy indexes left")
+    client.close()
+    if not dry_run:
+        # builds the unique indexes now that they can be
+        await database.init_db(settings.DATABASE_URL)
+        database.close_db()
+
+
+if __name__ == "__main__":
+    asyncio.run(main(dry_run="--dry-run" in sys.argv))
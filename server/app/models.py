@@ -1,13 +1,15 @@
 """
 Pydantic Models for the API.
 """
-from datetime import datetime, date
+from datetime import datetime, date, timedelta
 import re
 from typing import List, Optional
 from beanie import Indexed
 import pymongo
 from pydantic.types import Enum
 
+from app.codes import CodedEnum
+
 from pydantic import (
     BaseModel,
     EmailStr,
@@ -15,25 +17,43 @@ from pydantic import (
     field_serializer,
     field_validator,
     model_serializer,
+    model_validator,
     AliasChoices,
 )
 from pydantic_core import PydanticCustomError
-from beanie import Document, before_event, Update
+from beanie import Document, after_event, before_event, Delete, Replace, Save, SaveChanges, Update
+
+from app.cache import invalidate_user
+from app.schedule import next_due
+from app.text import dedup_block, search_keys
 
 
 class InvalidatedToken(Document):
-    token: str
-    invalidated_at: datetime
+    token: Indexed(str)  # the jti of the revoked token
+    invalidated_at: Indexed(datetime)
+    expires_at: datetime | None = None
+
+    class Settings:
+        indexes = [
+            # mongo prunes revocations once the token itself has expired
+            pymongo.IndexModel([("expires_at", pymongo.ASCENDING)], expireAfterSeconds=0),
+        ]
 
 class Token(BaseModel):
     access_token: str
     token_type: str
 
+# stored for the server's own queries (search, dedup, revisions) and
+# never sent to clients: not by list, detail, batch, sync or export routes
+INTERNAL_FIELDS = ("revision_id", "search_keys", "dedup_block")
+
+
 class Base(Document):
     """Base model"""
 
     created_at: datetime = Field(default_factory=datetime.utcnow)
     updated_at: datetime = Field(default_factory=datetime.utcnow)
+    revision: int = 0  # bumped by every update, sent to clients as the ETag
 
     @field_serializer("created_at", "updated_at")
     def serialize_datetime(self, v: datetime) -> str:
@@ -54,13 +74,44 @@ class Base(Document):
         self.updated_at = datetime.utcnow()
 
 
-class Clinic(Enum):
-    Okeila_CHC = "Okeila CHC"
-    Igbemo_CHC = "Igbemo CHC"
-    Infant_Welfare_Clinic = "Infant Welfare Clinic"
-    Staff_Clinic = "Staff Clinic"
+class Clinic(CodedEnum):
+    Okeila_CHC = "OKE"
+    Igbemo_CHC = "IGB"
+    Infant_Welfare_Clinic = "IWC"
+    Staff_Clinic = "STF"
+
+
+# spellings seen in provisional_diagnosis mapped to one surveillance key
+DIAGNOSIS_ALIASES = {
+    "mp": "malaria",
+    "mp+": "malaria",
+    "malaria fever": "malaria",
+    "uncomplicated malaria": "malaria",
+    "severe malaria": "malaria",
+    "typhoid fever": "typhoid",
+    "enteric fever": "typhoid",
+    "urti": "upper respiratory tract infection",
+    "uti": "urinary tract infection",
+    "pud": "peptic ulcer disease",
+    "htn": "hypertension",
+    "dm": "diabetes mellitus",
+}
+
+
+def normalize_diagnosis(diagnosis: str) -> str:
+    """
+    reduces a free text diagnosis to a stable key for surveillance
+
+    only the first diagnosis of a list such as "malaria, typhoid" is kept.
+    """
+
+    first = re.split(r"[,;/]| and | with |\?", diagnosis.lower())[0]
+    key = " ".join(re.sub(r"[^a-z0-9+ ]", " ", first).split())
+    return DIAGNOSIS_ALIASES.get(key, key)
+
+
 class Patient(Base):
-    hospital_no: str = Indexed(unique=True)
+    hospital_no: Indexed(str, unique=True)
     name: str
     age: int
     gender: str
@@ -74,6 +125,19 @@ class Patient(Base):
     referral: bool
     clinic: List[Clinic]
     entered_by: str
+    diagnosis_key: Optional[str] = None
+    search_keys: List[str] = []
+    dedup_block: Optional[str] = None
+
+    @model_validator(mode="after")
+    def fill_derived_keys(self) -> "Patient":
+        self.diagnosis_key = normalize_diagnosis(self.provisional_diagnosis)
+        # stored keys are kept as loaded so stale ones can be detected
+        if not self.search_keys:
+            self.search_keys = search_keys([self.name])
+        if self.dedup_block is None:
+            self.dedup_block = dedup_block(self.name, self.gender)
+        return self
 
     class Config:
         json_schema_extra = {
@@ -90,11 +154,31 @@ class Patient(Base):
                 "treatment": "Prescribed medication",
                 "investigations": "MP",
                 "referral": False,
-                "clinic": ["Okeila CHC"],
+                "clinic": ["OKE"],
                 "entered_by": "string",
             }
         }
 
+    class Settings:
+        indexes = [
+            [("created_at", pymongo.DESCENDING), ("_id", pymongo.DESCENDING)],
+            [("updated_at", pymongo.ASCENDING), ("_id", pymongo.ASCENDING)],
+            # surveillance windows match on clinic and a visit date range
+            [
+                ("clinic", pymongo.ASCENDING),
+                ("date_of_visit", pymongo.ASCENDING),
+                ("diagnosis_key", pymongo.ASCENDING),
+            ],
+            # list/export and surveillance over a visit date range alone
+            [("date_of_visit", pymongo.ASCENDING)],
+            # prefix search
+            [("search_keys", pymongo.ASCENDING)],
+            # duplicate detection blocks
+            [("dedup_block", pymongo.ASCENDING), ("age", pymongo.ASCENDING)],
+            # list/export filtered by entered_by, newest first
+            [("entered_by", pymongo.ASCENDING), ("created_at", pymongo.DESCENDING), ("_id", pymongo.DESCENDING)],
+        ]
+
 
 class PatientUpdateModel(BaseModel):
     hospital_no: Optional[str] = None
@@ -128,28 +212,28 @@ class PatientCreateModel(BaseModel):
     clinic: List[Clinic]
 
 
-class Vaccine(Enum):
-    HBV = "HBV (Hepatitis B)"
-    BCG = "BCG (Bacillus Calmette-Guérin)"
-    OPV0 = "OPV0 (Oral Poliovirus Vaccine - Birth Dose)"
-    PENTA1 = "Penta1/Rota/PCV1 (First dose of Pentavalent vaccine combined with Rotavirus and Pneumococcal Conjugate Vaccine)"
-    PENTA2 = "Penta2/Rota/PCV2 (Second dose of Pentavalent vaccine combined with Rotavirus and Pneumococcal Conjugate Vaccine)"
-    PENTA3 = "Penta3/Rota/PCV3 (Third dose of Pentavalent vaccine combined with Rotavirus and Pneumococcal Conjugate Vaccine)"
-    IPV1 = "IPV1 (Inactivated Poliovirus Vaccine - First dose)"
-    IPV2 = "IPV2 (Inactivated Poliovirus Vaccine - Second dose)"
-    MEASLES1 = "Measles1 (First dose of Measles Vaccine)"
-    MEASLES2 = "Measles2 (Second dose of Measles Vaccine)"
-    YELLOW_FEVER = "Yellow Fever"
-    MENA = "MenA (Meningococcal A Vaccine)"
-    TETANUS1 = "Tetanus1 (First dose of Tetanus Vaccine)"
-    TETANUS2 = "Tetanus2 (Second dose of Tetanus Vaccine)"
-    TETANUS3 = "Tetanus3 (Third dose of Tetanus Vaccine)"
-    TETANUS4 = "Tetanus4 (Fourth dose of Tetanus Vaccine)"
-    TETANUS5 = "Tetanus5 (Fifth dose of Tetanus Vaccine)"
+class Vaccine(CodedEnum):
+    HBV = "HBV"
+    BCG = "BCG"
+    OPV0 = "OPV0"
+    PENTA1 = "PENTA1"
+    PENTA2 = "PENTA2"
+    PENTA3 = "PENTA3"
+    IPV1 = "IPV1"
+    IPV2 = "IPV2"
+    MEASLES1 = "MEASLES1"
+    MEASLES2 = "MEASLES2"
+    YELLOW_FEVER = "YELLOW_FEVER"
+    MENA = "MENA"
+    TETANUS1 = "TETANUS1"
+    TETANUS2 = "TETANUS2"
+    TETANUS3 = "TETANUS3"
+    TETANUS4 = "TETANUS4"
+    TETANUS5 = "TETANUS5"
 
 
 class Immunization(Base):
-    card_no: str = Indexed(unique=True)
+    card_no: Indexed(str, unique=True)
     DOB: str
     contact_no: str
     address: str
@@ -159,7 +243,27 @@ class Immunization(Base):
     gender: str
     vaccine_given: List[Vaccine]
     date_of_vaccination: date
+    clinic: Optional[Clinic] = None
     entered_by: str
+    search_keys: List[str] = []
+    dedup_block: Optional[str] = None
+    # the next dose of the national schedule, None once it is complete
+    next_vaccine: Optional[Vaccine] = None
+    next_due_date: Optional[date] = None
+
+    @model_validator(mode="after")
+    def fill_derived_keys(self) -> "Immunization":
+        next_vaccine, self.next_due_date = next_due(
+            self.DOB, [v.name for v in self.vaccine_given], self.date_of_vaccination
+        )
+        self.next_vaccine = Vaccine[next_vaccine] if next_vaccine else None
+        if not self.search_keys:
+            self.search_keys = search_keys(
+                [self.name, self.caregivers_name], [self.contact_no]
+            )
+        if self.dedup_block is None:
+            self.dedup_block = dedup_block(self.name, self.gender)
+        return self
 
     class Config:
         json_schema_extra = {
@@ -174,10 +278,29 @@ class Immunization(Base):
                 "gender": "Male",
                 "vaccine_given": ["HBV", "BCG"],
                 "date_of_vaccination": "2024-04-06",
+                "clinic": "OKE",
                 "entered_by": "Nurse Jane",
             }
         }
 
+    class Settings:
+        indexes = [
+            [("created_at", pymongo.DESCENDING), ("_id", pymongo.DESCENDING)],
+            [("updated_at", pymongo.ASCENDING), ("_id", pymongo.ASCENDING)],
+            # coverage reports match on clinic and a vaccination date range
+            [("clinic", pymongo.ASCENDING), ("date_of_vaccination", pymongo.ASCENDING)],
+            [("date_of_vaccination", pymongo.ASCENDING)],
+            # prefix search
+            [("search_keys", pymongo.ASCENDING)],
+            # duplicate detection blocks
+            [("dedup_block", pymongo.ASCENDING), ("age", pymongo.ASCENDING)],
+            # list/export filtered by entered_by, newest first
+            [("entered_by", pymongo.ASCENDING), ("created_at", pymongo.DESCENDING), ("_id", pymongo.DESCENDING)],
+            # defaulter tracing, most overdue first
+            [("clinic", pymongo.ASCENDING), ("next_due_date", pymongo.ASCENDING), ("_id", pymongo.ASCENDING)],
+            [("next_due_date", pymongo.ASCENDING), ("_id", pymongo.ASCENDING)],
+        ]
+
 
 class ImmunizationCreateModel(BaseModel):
     card_no: str
@@ -190,6 +313,7 @@ class ImmunizationCreateModel(BaseModel):
     gender: str
     vaccine_given: List[Vaccine]
     date_of_vaccination: date
+    clinic: Optional[Clinic] = None
 
 
 class ImmunizationUpdateModel(BaseModel):
@@ -203,24 +327,64 @@ class ImmunizationUpdateModel(BaseModel):
     gender: Optional[str] = None
     vaccine_given: Optional[List[Vaccine]] = None
     date_of_vaccination: Optional[date] = None
+    clinic: Optional[Clinic] = None
 
 # Finance Model
-class Source(Enum):
-    DRF = "Drug Revolving Fund"
-    SS = "Surgical Service"
-    LS = "Laboratory/Radiological Service"
-    NR = "New Registration/Booking Service"
-    FR = "Folder retrieval"
+class Source(CodedEnum):
+    DRF = "DRF"
+    SS = "SS"
+    LS = "LS"
+    NR = "NR"
+    FR = "FR"
+
+
+RECORD_DATE_FORMATS = ("%Y-%m-%d", "%d-%m-%Y", "%Y%m%d", "%d%m%Y")
+
+
+def parse_record_id(record_id: str) -> tuple[str | None, date | None, str | None]:
+    """
+    splits a center_date_source_code record id into its parts
+
+    the center may itself contain underscores, so the id is split from the
+    right. Parts that can't be parsed come back as None.
+
+    :return: (clinic, record_date, source_code)
+    """
+
+    parts = record_id.rsplit("_", 3)
+    if len(parts) != 4:
+        return None, None, None
+    center, raw_date, source_code, _ = parts
+    record_date = None
+    for fmt in RECORD_DATE_FORMATS:
+        try:
+            record_date = datetime.strptime(raw_date, fmt).date()
+            break
+        except ValueError:
+            continue
+    return center or None, record_date, source_code.upper() or None
 
 
 class Finance(Base):
-    record_id: str = Indexed(unique=True) # the record_id will be center_date_source_code
+    record_id: Indexed(str, unique=True)  # the record_id will be center_date_source_code
     record_officer: str
     payment_type: str
     source: List[Source]
     day_total_amount: float
     reviewed_by_doctor: bool
     entered_by: str
+    # parsed from record_id
+    clinic: Optional[str] = None
+    record_date: Optional[date] = None
+    source_code: Optional[str] = None
+
+    @model_validator(mode="after")
+    def fill_record_parts(self) -> "Finance":
+        if self.clinic is None and self.record_date is None:
+            self.clinic, self.record_date, self.source_code = parse_record_id(
+                self.record_id
+            )
+        return self
 
     class Config:
         json_schema_extra = {
@@ -234,6 +398,139 @@ class Finance(Base):
             }
         }
 
+    class Settings:
+        indexes = [
+            [("created_at", pymongo.DESCENDING), ("_id", pymongo.DESCENDING)],
+            [("updated_at", pymongo.ASCENDING), ("_id", pymongo.ASCENDING)],
+            # list/export over a record date range
+            [("record_date", pymongo.ASCENDING)],
+            # list/export filtered by entered_by, newest first
+            [("entered_by", pymongo.ASCENDING), ("created_at", pymongo.DESCENDING), ("_id", pymongo.DESCENDING)],
+        ]
+
+
+class OutboxEmail(Document):
+    """an email waiting for, or done with, the background dispatcher"""
+
+    recipients: List[str]
+    subject: str
+    body: str
+    status: str = "pending"  # pending, sending, sent or failed
+    attempts: int = 0
+    next_attempt_at: datetime = Field(default_factory=datetime.utcnow)
+    claimed_at: Optional[datetime] = None
+    # set with claimed_at, to read back the batch a dispatcher claimed
+    claim_token: Optional[str] = None
+    last_error: Optional[str] = None
+    created_at: datetime = Field(default_factory=datetime.utcnow)
+    sent_at: Optional[datetime] = None
+
+    class Settings:
+        name = "email_outbox"
+        indexes = [
+            [("status", pymongo.ASCENDING), ("next_attempt_at", pymongo.ASCENDING)],
+            [("claim_token", pymongo.ASCENDING)],
+            # sent mail is kept a week for troubleshooting
+            pymongo.IndexModel(
+                [("sent_at", pymongo.ASCENDING)],
+                name="outbox_sent_ttl",
+                expireAfterSeconds=7 * 24 * 60 * 60,
+            ),
+        ]
+
+
+class CollectionVersion(Document):
+    """a counter bumped by every write to a collection, for list ETags"""
+
+    collection: Indexed(str, unique=True)
+    version: int = 0
+    updated_at: datetime = Field(default_factory=datetime.utcnow)
+
+    class Settings:
+        name = "collection_versions"
+
+
+class Lease(Document):
+    """
+    a named, expiring lock, so a background job that every worker starts
+    runs in only one of them at a time
+    """
+
+    name: Indexed(str, unique=True)
+    holder: str
+    expires_at: datetime
+    # when the holder's last run started, for jobs that resume from it
+    last_run: Optional[datetime] = None
+
+    class Settings:
+        name = "leases"
+
+
+# how long deletes are remembered for clients that sync later
+TOMBSTONE_TTL = timedelta(days=90)
+
+
+class Tombstone(Document):
+    """marks a hard deleted record so offline clients can drop it on sync"""
+
+    collection: str
+    key: str  # hospital_no, card_no or record_id of the deleted record
+    updated_at: datetime = Field(default_factory=datetime.utcnow)
+
+    class Settings:
+        name = "tombstones"
+        indexes = [
+            [("updated_at", pymongo.ASCENDING), ("_id", pymongo.ASCENDING)],
+            # clients that haven't synced for this long must resync fully
+            pymongo.IndexModel(
+                [("updated_at", pymongo.ASCENDING)],
+                name="tombstone_ttl",
+                expireAfterSeconds=int(TOMBSTONE_TTL.total_seconds()),
+            ),
+        ]
+
+
+class DuplicateCandidate(Document):
+    """a pair of records suspected to be the same person"""
+
+    kind: str  # "patient" or "immunization"
+    key_a: str
+    key_b: str
+    score: float
+    status: str = "open"  # open, confirmed or dismissed
+    detected_at: datetime = Field(default_factory=datetime.utcnow)
+
+    class Settings:
+        name = "duplicate_candidates"
+        indexes = [
+            pymongo.IndexModel(
+                [("kind", pymongo.ASCENDING), ("key_a", pymongo.ASCENDING), ("key_b", pymongo.ASCENDING)],
+                unique=True,
+            ),
+            [("status", pymongo.ASCENDING), ("score", pymongo.DESCENDING)],
+        ]
+
+
+class FinanceDailyRollup(Document):
+    """running totals of Finance.day_total_amount per clinic, day and source"""
+
+    clinic: str
+    day: datetime
+    source: str
+    total: float = 0.0
+    count: int = 0
+
+    class Settings:
+        name = "finance_daily_rollup"
+        indexes = [
+            pymongo.IndexModel(
+                [("day", pymongo.ASCENDING), ("clinic", pymongo.ASCENDING), ("source", pymongo.ASCENDING)],
+                unique=True,
+            ),
+            # clinic summaries without a date range
+            [("clinic", pymongo.ASCENDING), ("day", pymongo.ASCENDING)],
+        ]
+
 
 class FinanceCreateModel(BaseModel):
     record_id: str  # this will be center_date_source_code
@@ -264,8 +561,8 @@ class User(Base):
     Represents a User of the PopChat app
     """
 
-    username: str = Indexed(str, unique=True, index_type=pymongo.TEXT)
-    email: EmailStr = Indexed(str, unique=True, index_type=pymongo.TEXT)
+    username: Indexed(str, unique=True)
+    email: Indexed(EmailStr, unique=True)
     password: str
     role: List[Roles]
     reset_token: str | None = None
@@ -285,6 +582,11 @@ class User(Base):
             "id": str(self.id),
         }
 
+    @after_event(Update, Replace, Save, SaveChanges, Delete)
+    def drop_cached_sessions(self) -> None:
+        """role or password changes must not be served from the user cache"""
+        invalidate_user(self.username)
+
     class Config:
         populate_by_name = True
         arbitrary_types_allowed = True
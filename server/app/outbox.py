@@ -0,0 +1,235 @@
+"""
+persistent email outbox
+
+requests only enqueue an email; a background dispatcher started with the
+app claims due messages in batches and sends them over a small pool of
+SMTP connections that stay open between messages. A failed send is
+retried with exponential backoff until OUTBOX_MAX_ATTEMPTS, so a slow or
+down mail server neither delays requests nor loses mail.
+
+to try it without a real mail server, run a local stand-in with
+``python -m aiosmtpd -n -l localhost:8025`` and start the app with
+SMTP_PORT=8025 SMTP_USE_SSL=False SMTP_USE_TLS=False.
+"""
+import asyncio
+import logging
+import random
+from datetime import datetime, timedelta
+from email.message import EmailMessage
+from uuid import uuid4
+
+import aiosmtplib
+import pymongo
+
+from app.models import OutboxEmail
+from app.settings import settings
+
+logger = logging.getLogger(__name__)
+
+BACKOFF_BASE = 30  # seconds before the first retry
+BACKOFF_MAX = 60 * 60
+# a message claimed this long ago by a dispatcher that died is retried
+CLAIM_LEASE = timedelta(minutes=5)
+
+
+def backoff(attempts: int) -> timedelta:
+    """the delay before the next attempt, doubling per failure, with jitter"""
+
+    delay = min(BACKOFF_BASE * 2 ** (attempts - 1), BACKOFF_MAX)
+    return timedelta(seconds=delay * random.uniform(0.8, 1.2))
+
+
+def is_permanent(exc: Exception) -> bool:
+    """5xx replies (bad address, rejected content) won't succeed on retry"""
+
+    return isinstance(exc, aiosmtplib.SMTPResponseException) and 500 <= exc.code < 600
+
+
+def build_message(email: OutboxEmail) -> EmailMessage:
+    message = EmailMessage()
+    message["From"] = settings.FROM_EMAIL
+    message["To"] = ", ".join(email.recipients)
+    message["Subject"] = email.subject
+    message.set_content(email.body)
+    return message
+
+
+async def enqueue_email(subject: str, recipients: str | list[str], body: str) -> OutboxEmail:
+    """
+    stores an email for the dispatcher and returns without sending it
+
+    :param recipients: one address or a list of them
+    """
+
+    if isinstance(recipients, str):
+        recipients = [recipients]
+    email = OutboxEmail(recipients=recipients, subject=subject, body=body)
+    await email.insert()
+    OUTBOX.wake()
+    return email
+
+
+class SMTPPool:
+    """a few smtp connections opened on demand and reused between sends"""
+
+    def __init__(self, size: int):
+        self.size = size
+        self._idle: asyncio.Queue[aiosmtplib.SMTP] = asyncio.Queue()
+        self._opened = 0
+
+    def _client(self) -> aiosmtplib.SMTP:
+        # implicit tls unless configured otherwise, as sending always used
+        use_tls = True if settings.SMTP_USE_SSL is None else settings.SMTP_USE_SSL
+        return aiosmtplib.SMTP(
+            hostname=settings.SMTP_HOST,
+            port=settings.SMTP_PORT,
+            use_tls=use_tls,
+            start_tls=settings.SMTP_USE_TLS,
+            timeout=settings.SMTP_TIMEOUT,
+        )
+
+    async def _connect(self, client: aiosmtplib.SMTP) -> None:
+        await client.connect()
+        if client.supports_extension("auth"):
+            await client.login(settings.FROM_EMAIL, settings.SMTP_PASSWORD)
+
+    async def acquire(self) -> aiosmtplib.SMTP:
+        if self._idle.empty() and self._opened < self.size:
+            self._opened += 1
+            return self._client()
+        return await self._idle.get()
+
+    def release(self, client: aiosmtplib.SMTP) -> None:
+        self._idle.put_nowait(client)
+
+    async def send(self, message: EmailMessage) -> None:
+        client = await self.acquire()
+        try:
+            if not client.is_connected:
+                await self._connect(client)
+            try:
+                await client.send_message(message)
+            except aiosmtplib.SMTPServerDisconnected:
+                # the server dropped an idle connection; reconnect once
+                await self._connect(client)
+                await client.send_message(message)
+        except Exception:
+            client.close()
+            raise
+        finally:
+            self.release(client)
+
+    async def close(self) -> None:
+        while not self._idle.empty():
+            client = self._idle.get_nowait()
+            if client.is_connected:
+                try:
+                    await client.quit()
+                except aiosmtplib.SMTPException:
+                    client.close()
+        self._opened = 0
+
+
+class OutboxDispatcher:
+    """claims due emails in batches and sends them over the pool"""
+
+    def __init__(self):
+        self.pool = SMTPPool(settings.SMTP_POOL_SIZE)
+        self._wake = asyncio.Event()
+        self.sent = 0
+        self.failed = 0
+
+    def wake(self) -> None:
+        """sends newly enqueued mail now instead of at the next poll"""
+
+        self._wake.set()
+
+    async def claim(self, limit: int) -> list[OutboxEmail]:
+        """
+        marks up to limit due emails as sending, so one dispatcher sends each
+
+        a batch takes three round trips whatever its size: the due ids are
+        read, stamped with a claim token in one update_many that re-checks
+        they are still due, and whichever of them this dispatcher won are
+        read back by that token.
+        """
+
+        collection = OutboxEmail.get_motor_collection()
+        now = datetime.utcnow()
+        due = {"$or": [
+            {"status": "pending", "next_attempt_at": {"$lte": now}},
+            {"status": "sending", "claimed_at": {"$lt": now - CLAIM_LEASE}},
+        ]}
+        ids = [row["_id"] async for row in collection.find(
+            due, {"_id": 1}, sort=[("next_attempt_at", pymongo.ASCENDING)], limit=limit
+        )]
+        if not ids:
+            return []
+        token = uuid4().hex
+        await collection.update_many(
+            {"_id": {"$in": ids}, **due},
+            {"$set": {"status": "sending", "claimed_at": now, "claim_token": token}},
+        )
+        return [
+            OutboxEmail.model_validate(row)
+            async for row in collection.find({"claim_token": token})
+        ]
+
+    async def deliver(self, email: OutboxEmail) -> None:
+        collection = OutboxEmail.get_motor_collection()
+        try:
+            await self.pool.send(build_message(email))
+        except Exception as exc:
+            attempts = email.attempts + 1
+            give_up = is_permanent(exc) or attempts >= settings.OUTBOX_MAX_ATTEMPTS
+            await collection.update_one({"_id": email.id}, {"$set": {
+                "status": "failed" if give_up else "pending",
+                "attempts": attempts,
+                "next_attempt_at": datetime.utcnow() + backoff(attempts),
+                "last_error": f"{type(exc).__name__}: {exc}"[:500],
+            }})
+            if give_up:
+                self.failed += 1
+            logger.warning(
+                "email failed" if give_up else "email deferred",
+                extra={"email_id": str(email.id), "attempts": attempts, "error": str(exc)},
+            )
+            return
+        await collection.update_one({"_id": email.id}, {"$set": {
+            "status": "sent",
+            "attempts": email.attempts + 1,
+            "sent_at": datetime.utcnow(),
+            "last_error": None,
+        }})
+        self.sent += 1
+
+    async def dispatch(self) -> int:
+        """
+        sends everything that is due
+
+        :return: the number of emails attempted
+        """
+
+        attempted = 0
+        while batch := await self.claim(settings.OUTBOX_BATCH_SIZE):
+            await asyncio.gather(*(self.deliver(email) for email in batch))
+            attempted += len(batch)
+        return attempted
+
+    async def run_forever(self, interval: float) -> None:
+        while True:
+            self._wake.clear()
+            try:
+                await self.dispatch()
+            except Exception:
+                logger.exception("outbox dispatch failed, retrying next tick")
+            try:
+                await asyncio.wait_for(self._wake.wait(), timeout=interval)
+            except asyncio.TimeoutError:
+                pass
+
+    async def close(self) -> None:
+        await self.pool.close()
+
+
+OUTBOX = OutboxDispatcher()
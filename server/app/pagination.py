@@ -0,0 +1,236 @@
+"""
+cursor pagination, filtering and projection helpers for list endpoints
+"""
+import base64
+import json
+from datetime import date, datetime, time
+from functools import lru_cache
+from typing import Optional, Type, get_args
+
+from beanie import Document
+from motor.motor_asyncio import AsyncIOMotorClientSession
+from bson import ObjectId
+from bson.errors import InvalidId
+from fastapi import HTTPException, Query
+from pydantic import BaseModel
+import pymongo
+
+from app.models import INTERNAL_FIELDS, Clinic
+from app.readpref import reader
+
+DEFAULT_PAGE_SIZE = 50
+MAX_PAGE_SIZE = 500
+
+# fields every page needs to build the next cursor
+CURSOR_FIELDS = ("created_at", "_id")
+
+
+class Page(BaseModel):
+    """a single page of a list endpoint"""
+
+    items: list[dict]
+    next_cursor: str | None = None
+    limit: int
+
+
+class ListParams:
+    """common query parameters accepted by the list endpoints"""
+
+    def __init__(
+        self,
+        cursor: Optional[str] = None,
+        limit: int = Query(DEFAULT_PAGE_SIZE, ge=1, le=MAX_PAGE_SIZE),
+        fields: Optional[str] = Query(
+            None, description="comma separated list of fields to return"
+        ),
+        clinic: Optional[Clinic] = None,
+        date_from: Optional[date] = Query(None, alias="from"),
+        date_to: Optional[date] = Query(None, alias="to"),
+        entered_by: Optional[str] = None,
+    ):
+        self.cursor = cursor
+        self.limit = limit
+        self.fields = fields
+        self.clinic = clinic
+        self.date_from = date_from
+        self.date_to = date_to
+        self.entered_by = entered_by
+
+
+def encode_cursor(created_at: datetime, _id: ObjectId) -> str:
+    """
+    builds an opaque cursor from the last row of a page
+
+    :param created_at: the created_at of the last row
+    :param _id: the _id of the last row
+    :return: a urlsafe base64 string
+    """
+
+    raw = json.dumps([created_at.isoformat(), str(_id)]).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip("=")
+
+
+def decode_cursor(cursor: str) -> tuple[datetime, ObjectId]:
+    """
+    decodes a cursor made by encode_cursor
+
+    :param cursor: the opaque cursor
+    :return: the (created_at, _id) pair
+    """
+
+    try:
+        padded = cursor + "=" * (-len(cursor) % 4)
+        created_at, _id = json.loads(base64.urlsafe_b64decode(padded))
+        return datetime.fromisoformat(created_at), ObjectId(_id)
+    except (ValueError, TypeError, InvalidId):
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+
+
+def as_datetime(d: date, end: bool = False) -> datetime:
+    """
+    converts a date to the datetime beanie stores it as
+
+    :param d: the date
+    :param end: use the last instant of the day instead of midnight
+    """
+
+    return datetime.combine(d, time.max if end else time.min)
+
+
+def build_filters(
+    params: ListParams, date_field: str, clinic_field: str | None = None
+) -> dict:
+    """
+    turns the list query parameters into a mongo filter
+
+    :param params: the parsed query parameters (list or export)
+    :param date_field: the field the from/to range applies to
+    :param clinic_field: the field holding the clinic, if the model has one
+    :return: a mongo filter document
+    """
+
+    query: dict = {}
+    if params.clinic:
+        if clinic_field is None:
+            raise HTTPException(
+                status_code=400, detail="clinic filter is not supported here"
+            )
+        query[clinic_field] = params.clinic.value
+    if params.entered_by:
+        query["entered_by"] = params.entered_by
+    date_range = {}
+    if params.date_from:
+        date_range["$gte"] = as_datetime(params.date_from)
+    if params.date_to:
+        date_range["$lte"] = as_datetime(params.date_to, end=True)
+    if date_range:
+        query[date_field] = date_range
+    return query
+
+
+def build_projection(document: Type[Document], fields: str | None) -> dict:
+    """
+    builds a mongo projection from a comma separated field list
+
+    :param document: the document class being queried
+    :param fields: the requested fields, or None for all of them
+    :return: a projection dict; without fields, one leaving out the
+        INTERNAL_FIELDS, which can't be requested either
+    """
+
+    if not fields:
+        return {name: 0 for name in INTERNAL_FIELDS}
+    requested = {f.strip() for f in fields.split(",") if f.strip()}
+    public = set(document.model_fields) - set(INTERNAL_FIELDS)
+    unknown = requested - public - {"_id", "id"}
+    if unknown:
+        raise HTTPException(
+            status_code=400,
+            detail=f"Unknown fields: {', '.join(sorted(unknown))}",
+        )
+    requested.discard("id")
+    return {f: 1 for f in requested | set(CURSOR_FIELDS)}
+
+
+@lru_cache
+def date_fields(document: Type[Document]) -> tuple[str, ...]:
+    """the fields of a document declared as dates, not datetimes"""
+
+    return tuple(
+        name
+        for name, field in document.model_fields.items()
+        if field.annotation is date or date in get_args(field.annotation)
+    )
+
+
+def to_json_row(row: dict, document: Type[Document] | None = None) -> dict:
+    """
+    makes a raw mongo row json friendly
+
+    :param row: the row as read from mongo
+    :param document: its document class; mongo has no date type, so date
+        fields come back as midnight datetimes and are turned back into
+        dates, as the single record routes return them
+    """
+
+    row["_id"] = str(row["_id"])
+    for name in INTERNAL_FIELDS:
+        row.pop(name, None)
+    if document is not None:
+        for name in date_fields(document):
+            if isinstance(row.get(name), datetime):
+                row[name] = row[name].date()
+    return row
+
+
+async def paginate(
+    document: Type[Document],
+    query: dict,
+    params: ListParams,
+    session: AsyncIOMotorClientSession | None = None,
+) -> Page:
+    """
+    returns one page of documents, newest first, keyed on (created_at, _id)
+
+    :param document: the document class to query
+    :param query: the mongo filter to apply
+    :param params: the parsed list query parameters
+    :param session: the request's read_session, if any
+    :return: the page and the cursor for the next one
+    """
+
+    if params.cursor:
+        created_at, _id = decode_cursor(params.cursor)
+        query = {
+            "$and": [
+                query,
+                {
+                    "$or": [
+                        {"created_at": {"$lt": created_at}},
+                        {"created_at": created_at, "_id": {"$lt": _id}},
+                    ]
+                },
+            ]
+        }
+
+    projection = build_projection(document, params.fields)
+    rows = (
+        await reader(document)
+        .find(query, projection, session=session)
+        .sort([("created_at", pymongo.DESCENDING), ("_id", pymongo.DESCENDING)])
+        .limit(params.limit + 1)
+        .to_list(length=params.limit + 1)
+    )
+
+    next_cursor = None
+    if len(rows) > params.limit:
+        rows = rows[: params.limit]
+        last = rows[-1]
+        next_cursor = encode_cursor(last["created_at"], last["_id"])
+
+    # the rows come straight from mongo, there is nothing to validate
+    return Page.model_construct(
+        items=[to_json_row(row, document) for row in rows],
+        next_cursor=next_cursor,
+        limit=params.limit,
+    )
@@ -0,0 +1,119 @@
+"""
+read preference per route
+
+list, search and report routes may read from secondaries, so their scans
+don't compete with clinical writes on the primary; writes, single record
+reads, If-Match checks and sync stay on the primary. A route opts in with
+``Depends(reads("list"))``, which sets the request's read preference from
+Settings, and the query helpers take their collection from
+``reader(document)``.
+
+a list's ETag is the version counter read from the primary, so the list
+routes read in a causally consistent session (``read_session``): the
+secondary serving the rows waits until it has caught up with that read,
+and an ETag is never sent with rows older than it.
+
+to try it locally, run a one node replica set (``mongod --replSet rs0``,
+then ``rs.initiate()`` in mongosh) and add ``?replicaSet=rs0`` to
+DATABASE_URL; with a single node every read preference selects it.
+"""
+from contextlib import asynccontextmanager
+from contextvars import ContextVar
+from typing import AsyncIterator, Callable, Type
+
+from beanie import Document
+from motor.motor_asyncio import AsyncIOMotorClientSession, AsyncIOMotorCollection
+from pymongo.read_preferences import (
+    Nearest,
+    Primary,
+    PrimaryPreferred,
+    Secondary,
+    SecondaryPreferred,
+)
+
+from app import database
+from app.settings import settings
+
+MODES = {
+    "primary": Primary,
+    "primaryPreferred": PrimaryPreferred,
+    "secondary": Secondary,
+    "secondaryPreferred": SecondaryPreferred,
+    "nearest": Nearest,
+}
+
+
+def read_preference(mode: str):
+    """
+    a pymongo read preference, bounded by DB_MAX_STALENESS_SECONDS
+
+    :raises ValueError: for an unknown mode
+    """
+
+    if mode not in MODES:
+        raise ValueError(f"unknown read preference {mode!r}, expected one of {', '.join(MODES)}")
+    if mode == "primary":
+        return Primary()
+    return MODES[mode](max_staleness=settings.DB_MAX_STALENESS_SECONDS)
+
+
+# built at import, so a bad setting stops the app at startup
+ROUTE_READS = {
+    "list": read_preference(settings.DB_LIST_READS),
+    "search": read_preference(settings.DB_SEARCH_READS),
+    "report": read_preference(settings.DB_REPORT_READS),
+}
+
+# set by a route's reads dependency; each request runs in its own context
+READ_PREFERENCE = ContextVar("read_preference", default=Primary())
+
+
+def reads(group: str) -> Callable:
+    """
+    a route dependency reading the request from the group's configured members
+
+    :param group: list, search or report
+    """
+
+    if group not in ROUTE_READS:
+        raise ValueError(f"unknown read group {group!r}, expected one of {', '.join(ROUTE_READS)}")
+
+    async def set_read_preference() -> None:
+        # looked up per request, so ROUTE_READS can be changed after import
+        READ_PREFERENCE.set(ROUTE_READS[group])
+
+    return set_read_preference
+
+
+def reader(document: Type[Document]) -> AsyncIOMotorCollection:
+    """
+    the document's collection, read with the request's read preference
+
+    this is motor's collection, not a Beanie query: Beanie 1.25 runs every
+    query on the document's one shared collection and has no per query read
+    preference, so routed reads go through motor and get raw rows, which
+    the callers (pagination, export, search and the report aggregations)
+    already work with.
+    """
+
+    collection = document.get_motor_collection()
+    preference = READ_PREFERENCE.get()
+    if isinstance(preference, Primary):
+        return collection
+    return collection.with_options(read_preference=preference)
+
+
+@asynccontextmanager
+async def read_session() -> AsyncIterator[AsyncIOMotorClientSession | None]:
+    """
+    a causally consistent session when the request may read from secondaries
+
+    reads in the session see at least what earlier reads in it saw, on
+    whichever member serves them. Yields None when reading the primary.
+    """
+
+    if isinstance(READ_PREFERENCE.get(), Primary) or database.CLIENT is None:
+        yield None
+        return
+    async with await database.CLIENT.start_session(causal_consistency=True) as session:
+        yield session
@@ -0,0 +1,71 @@
+"""
+orjson response serialization
+
+JSONResponse is the app's default response class. Routes returning a
+model still go through FastAPI's response_model validation; the hot
+routes instead return model_response/rows_response, which serialize an
+already validated document or page straight to bytes and skip that pass.
+"""
+from typing import Any
+
+import orjson
+from bson import ObjectId
+from fastapi import Response
+from fastapi.responses import ORJSONResponse
+from pydantic import BaseModel
+
+from app.models import INTERNAL_FIELDS
+
+
+def default(value: Any) -> Any:
+    """serializes the bson types orjson doesn't know"""
+
+    if isinstance(value, ObjectId):
+        return str(value)
+    if isinstance(value, BaseModel):
+        return value.model_dump(mode="json", by_alias=True)
+    raise TypeError(f"Type is not JSON serializable: {type(value).__name__}")
+
+
+class JSONResponse(ORJSONResponse):
+    def render(self, content: Any) -> bytes:
+        return orjson.dumps(content, default=default, option=orjson.OPT_NON_STR_KEYS)
+
+
+def _copy_headers(target: Response, source: Response | None) -> Response:
+    # headers set on an injected Response, e.g. the ETag, are only merged
+    # by FastAPI into responses it builds itself
+    if source is not None:
+        target.headers.update(source.headers)
+        target.status_code = source.status_code or target.status_code
+    return target
+
+
+def model_response(
+    model: BaseModel, status_code: int = 200, response: Response | None = None
+) -> Response:
+    """
+    a validated model as json, as its response_model would send it but
+    without re-validating it, and without the INTERNAL_FIELDS
+
+    :param model: a beanie document or response model
+    :param status_code: the status to send unless response sets one
+    :param response: the route's injected Response, whose headers are kept
+    """
+
+    body = model.model_dump_json(by_alias=True, exclude=set(INTERNAL_FIELDS))
+    return _copy_headers(
+        Response(content=body, status_code=status_code, media_type="application/json"),
+        response,
+    )
+
+
+def rows_response(model: BaseModel, response: Response | None = None) -> Response:
+    """
+    a model wrapping raw mongo rows, e.g. a Page, as json
+
+    the rows are handed to orjson as they are instead of being walked by
+    pydantic and jsonable_encoder.
+    """
+
+    return _copy_headers(JSONResponse(dict(model)), response)
@@ -0,0 +1,152 @@
+"""
+in-process view of revoked access tokens
+
+run ``python -m app.revocation`` once to give revocations recorded before
+they carried an expiry one, so the TTL index can prune them.
+"""
+import asyncio
+import logging
+from datetime import datetime, timedelta
+
+from pymongo import UpdateOne
+
+from app.models import InvalidatedToken
+from app.settings import settings
+
+logger = logging.getLogger(__name__)
+
+# overlap between refreshes so clock skew between workers can't hide a row
+REFRESH_OVERLAP = timedelta(seconds=5)
+# the longest any token is issued for (cookie sessions); a revocation
+# recorded without an expiry is kept this long after it was made
+LEGACY_TOKEN_LIFETIME = settings.ACCESS_TOKEN_DELTA
+
+
+def revocation_key(payload: dict, token: str) -> str:
+    """the id a token is revoked under: its jti, or the raw token if it has none"""
+
+    return payload.get("jti") or token
+
+
+class RevokedTokens:
+    """
+    the set of revoked tokens that have not expired yet
+
+    loaded from the InvalidatedToken collection at startup and refreshed
+    incrementally from invalidated_at, so revocation checks never hit the db.
+    """
+
+    def __init__(self):
+        self._expiry: dict[str, datetime] = {}
+        self._watermark: datetime | None = None
+
+    def __contains__(self, key: str) -> bool:
+        expires_at = self._expiry.get(key)
+        if expires_at is None:
+            return False
+        if expires_at <= datetime.utcnow():
+            del self._expiry[key]
+            return False
+        return True
+
+    def __len__(self) -> int:
+        return len(self._expiry)
+
+    def add(self, key: str, expires_at: datetime) -> None:
+        self._expiry[key] = expires_at
+
+    def purge(self) -> None:
+        """drops entries whose token has expired anyway"""
+
+        now = datetime.utcnow()
+        for key in [k for k, exp in self._expiry.items() if exp <= now]:
+            del self._expiry[key]
+
+    async def load(self) -> None:
+        """loads every unexpired revocation"""
+
+        self._expiry.clear()
+        self._watermark = None
+        await self._fetch({"expires_at": {"$gt": datetime.utcnow()}})
+
+    async def refresh(self) -> None:
+        """pulls revocations made by other workers since the last fetch"""
+
+        if self._watermark is None:
+            return await self.load()
+        await self._fetch(
+            {"invalidated_at": {"$gt": self._watermark - REFRESH_OVERLAP}}
+        )
+        self.purge()
+
+    async def _fetch(self, query: dict) -> None:
+        async for row in InvalidatedToken.find(query):
+            if row.expires_at is not None:
+                self.add(row.token, row.expires_at)
+            if self._watermark is None or row.invalidated_at > self._watermark:
+                self._watermark = row.invalidated_at
+        if self._watermark is None:
+            self._watermark = datetime.utcnow()
+
+    async def refresh_forever(self, interval: float) -> None:
+        """background task keeping the set in sync with the collection"""
+
+        while True:
+            await asyncio.sleep(interval)
+            try:
+                await self.refresh()
+            except Exception:
+                # keep serving from the current set; retry on the next tick
+                logger.exception("refreshing revoked tokens failed")
+
+    async def revoke(self, key: str, expires_at: datetime) -> None:
+        """records a revocation locally and for the other workers"""
+
+        self.add(key, expires_at)
+        await InvalidatedToken(
+            token=key, invalidated_at=datetime.utcnow(), expires_at=expires_at
+        ).insert()
+
+
+REVOKED_TOKENS = RevokedTokens()
+
+
+async def backfill_expiry(batch_size: int = 1000) -> dict[str, int]:
+    """
+    sets expires_at on revocations recorded without one
+
+    the token they revoke was issued at most LEGACY_TOKEN_LIFETIME before
+    it was revoked, so it is expired by invalidated_at plus that long at
+    the latest. Rows already past it are deleted outright.
+
+    :return: the number of rows updated and deleted
+    """
+
+    collection = InvalidatedToken.get_motor_collection()
+    missing = {"expires_at": None}
+    deleted = (await collection.delete_many(
+        {**missing, "invalidated_at": {"$lte": datetime.utcnow() - LEGACY_TOKEN_LIFETIME}}
+    )).deleted_count
+    updated = 0
+    batch = []
+    async for row in collection.find(missing, {"invalidated_at": 1}, batch_size=batch_size):
+        expires_at = row["invalidated_at"] + LEGACY_TOKEN_LIFETIME
+        batch.append(UpdateOne({"_id": row["_id"]}, {"$set": {"expires_at": expires_at}}))
+        if len(batch) >= batch_size:
+            updated += (await collection.bulk_write(batch, ordered=False)).modified_count
+            batch = []
+    if batch:
+        updated += (await collection.bulk_write(batch, ordered=False)).modified_count
+    return {"updated": updated, "deleted": deleted}
+
+
+async def main() -> None:
+    from app.database import init_db
+
+    await init_db(settings.DATABASE_URL)
+    result = await backfill_expiry()
+    print(f"gave {result['updated']} revocations an expiry, deleted {result['deleted']} expired ones")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
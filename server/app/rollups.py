@@ -0,0 +1,206 @@
+"""
+pre-aggregated daily finance totals
+
+every finance write adjusts finance_daily_rollup with a single $inc upsert,
+so summaries read a few hundred rollup rows instead of every record.
+
+run ``python -m app.rollups`` to store the record id parts on finance
+records written before they were parsed and rebuild the rollups from
+scratch.
+"""
+import asyncio
+from collections import defaultdict
+from datetime import date, datetime, time
+from enum import Enum
+from typing import Optional
+
+from fastapi import Query
+from pymongo import UpdateOne
+
+from app.conditional import bump_version
+from app.models import Finance, FinanceDailyRollup, Source, parse_record_id
+from app.readpref import reader
+
+UNKNOWN = "unknown"
+
+
+class GroupBy(Enum):
+    CLINIC = "clinic"
+    SOURCE = "source"
+    MONTH = "month"
+
+
+def rollup_key(finance: Finance) -> tuple[str, datetime, str]:
+    """the (clinic, day, source) bucket a finance record is counted in"""
+
+    day = finance.record_date or finance.created_at.date()
+    source = finance.source_code
+    if source not in Source.__members__ and finance.source:
+        source = finance.source[0].name
+    return (
+        finance.clinic or UNKNOWN,
+        datetime.combine(day, time.min),
+        source or UNKNOWN,
+    )
+
+
+def _increment(key: tuple[str, datetime, str], total: float, count: int) -> UpdateOne:
+    clinic, day, source = key
+    return UpdateOne(
+        {"clinic": clinic, "day": day, "source": source},
+        {"$inc": {"total": total, "count": count}},
+        upsert=True,
+    )
+
+
+async def apply_to_rollup(
+    before: Finance | None, after: Finance | None
+) -> None:
+    """
+    moves a record's amount between rollup buckets
+
+    pass before=None for an insert and after=None for a delete.
+    """
+
+    operations = []
+    if before is not None:
+        operations.append(_increment(rollup_key(before), -before.day_total_amount, -1))
+    if after is not None:
+        operations.append(_increment(rollup_key(after), after.day_total_amount, 1))
+    if operations:
+        await FinanceDailyRollup.get_motor_collection().bulk_write(
+            operations, ordered=True
+        )
+
+
+def _bucket_expression(group_by: GroupBy):
+    if group_by == GroupBy.MONTH:
+        return {"$dateToString": {"format": "%Y-%m", "date": "$day"}}
+    return f"${group_by.value}"
+
+
+async def summarize(
+    group_by: GroupBy,
+    date_from: Optional[date] = None,
+    date_to: Optional[date] = None,
+    clinic: Optional[str] = None,
+) -> list[dict]:
+    """
+    totals per clinic, source or month, read from the rollups
+
+    :return: rows of {"key", "total", "count"} sorted by key
+    """
+
+    match: dict = {"count": {"$gt": 0}}
+    day_range = {}
+    if date_from:
+        day_range["$gte"] = datetime.combine(date_from, time.min)
+    if date_to:
+        day_range["$lte"] = datetime.combine(date_to, time.min)
+    if day_range:
+        match["day"] = day_range
+    if clinic:
+        match["clinic"] = clinic
+
+    pipeline = [
+        {"$match": match},
+        {
+            "$group": {
+                "_id": _bucket_expression(group_by),
+                "total": {"$sum": "$total"},
+                "count": {"$sum": "$count"},
+            }
+        },
+        {"$sort": {"_id": 1}},
+        {"$project": {"_id": 0, "key": "$_id", "total": 1, "count": 1}},
+    ]
+    return await reader(FinanceDailyRollup).aggregate(
+        pipeline
+    ).to_list(length=None)
+
+
+class SummaryParams:
+    """query parameters of the finance summary"""
+
+    def __init__(
+        self,
+        group_by: GroupBy = GroupBy.CLINIC,
+        date_from: Optional[date] = Query(None, alias="from"),
+        date_to: Optional[date] = Query(None, alias="to"),
+        clinic: Optional[str] = None,
+    ):
+        self.group_by = group_by
+        self.date_from = date_from
+        self.date_to = date_to
+        self.clinic = clinic
+
+
+async def rebuild_rollups() -> int:
+    """
+    recomputes every rollup from the finance collection
+
+    :return: the number of rollup buckets written
+    """
+
+    buckets: dict[tuple, list] = defaultdict(lambda: [0.0, 0])
+    async for finance in Finance.find_all():
+        bucket = buckets[rollup_key(finance)]
+        bucket[0] += finance.day_total_amount
+        bucket[1] += 1
+
+    collection = FinanceDailyRollup.get_motor_collection()
+    await collection.delete_many({})
+    if buckets:
+        await collection.insert_many(
+            {"clinic": clinic, "day": day, "source": source, "total": total, "count": count}
+            for (clinic, day, source), (total, count) in buckets.items()
+        )
+    return len(buckets)
+
+
+async def backfill_record_parts(batch_size: int = 1000) -> int:
+    """
+    stores clinic, record_date and source_code on every finance record
+    missing them, so list and export date filters find it
+
+    updated_at moves too, since synced clients see the parts.
+
+    :return: the number of records updated
+    """
+
+    now = datetime.utcnow()
+    collection = Finance.get_motor_collection()
+    cursor = collection.find(
+        {"record_date": {"$exists": False}}, {"record_id": 1}, batch_size=batch_size
+    )
+    updated = 0
+    batch = []
+    async for row in cursor:
+        clinic, record_date, source_code = parse_record_id(row["record_id"])
+        batch.append(UpdateOne({"_id": row["_id"]}, {"$set": {
+            "clinic": clinic,
+            "record_date": datetime.combine(record_date, time.min) if record_date else None,
+            "source_code": source_code,
+            "updated_at": now,
+        }}))
+        if len(batch) >= batch_size:
+            updated += (await collection.bulk_write(batch, ordered=False)).modified_count
+            batch = []
+    if batch:
+        updated += (await collection.bulk_write(batch, ordered=False)).modified_count
+    if updated:
+        await bump_version("finances")
+    return updated
+
+
+async def main() -> None:
+    from app.database import init_db
+    from app.settings import settings
+
+    await init_db(settings.DATABASE_URL)
+    print(f"stored record id parts on {await backfill_record_parts()} finance records")
+    print(f"rebuilt {await rebuild_rollups()} finance rollup buckets")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -4,15 +4,18 @@ authentication endpoints
 from datetime import datetime, timedelta
 from fastapi import APIRouter, Depends
 from fastapi.exceptions import HTTPException
-from app.models import InvalidatedToken, PasswordResetRequest, UserRegister, ResponseModel, User, Token
+from app.models import PasswordResetRequest, UserRegister, ResponseModel, User, Token
 from app.middlewares.auth import register_user # authenticate
-from app.middlewares.authware import create_access_token, oauth2_scheme, ACCESS_TOKEN_EXPIRE_MINUTES, get_current_user
+from app.middlewares.authware import create_access_token, decode_access_token, oauth2_scheme, ACCESS_TOKEN_EXPIRE_MINUTES, get_current_user, is_user_doctor
 from fastapi.security import OAuth2PasswordRequestForm
 
 
 from beanie.operators import Or
 
-from app.utils import send_email, verify_passwd
+from app.utils import HASH_POOL, verify_and_update_passwd_async
+from app.outbox import enqueue_email
+from app.cache import USER_CACHE
+from app.revocation import REVOKED_TOKENS, revocation_key
 
 
 auth_router = APIRouter(
@@ -54,10 +57,16 @@ async def login_user(form_data: OAuth2PasswordRequestForm = Depends()) -> Token:
     if not user:
         raise HTTPException(status_code=401, detail="invalid username or email or password")
 
-    if not verify_passwd(form_data.password, user.password):
+    verified, new_hash = await verify_and_update_passwd_async(
+        form_data.password, user.password
+    )
+    if not verified:
         raise HTTPException(
             status_code=401, detail="invalid username or email or password"
         )
+    if new_hash:
+        # transparently upgrade hashes made with an older cost factor
+        await user.set({User.password: new_hash})
 
     access_token_expires = timedelta(minutes=ACCESS_TOKEN_EXPIRE_MINUTES)
     access_token = create_access_token(
@@ -91,12 +100,27 @@ async def is_authenticated(current_user: User = Depends(get_current_user)):
 async def logout(
     current_user: User = Depends(get_current_user), token: str = Depends(oauth2_scheme)
 ):
-    # Store the token in the invalidated tokens collection
-    invalidated_token = InvalidatedToken(token=token, invalidated_at=datetime.utcnow())
-    await invalidated_token.insert()
+    # Revoke the token until it would have expired anyway
+    payload = decode_access_token(token)
+    await REVOKED_TOKENS.revoke(
+        revocation_key(payload, token), datetime.utcfromtimestamp(payload["exp"])
+    )
+    USER_CACHE.pop(token)
     return {"message": "Successfully logged out"}
 
 
+@auth_router.get("/cache_stats", dependencies=[Depends(is_user_doctor)])
+async def cache_stats():
+    """hit/miss counters of the authenticated user cache"""
+    return USER_CACHE.stats()
+
+
+@auth_router.get("/hash_stats", dependencies=[Depends(is_user_doctor)])
+async def hash_stats():
+    """latency and back-pressure counters of the password hashing pool"""
+    return HASH_POOL.stats()
+
+
 # @auth_router.get("/logout", status_code=200)
 # async def logout(user: User = Depends(authenticate)) -> ResponseModel:
 #     """logs out a user"""
@@ -155,7 +179,8 @@ async def forgot_password(request: PasswordResetRequest):
     email_subject = "Password Reset Request"
     email_body = f"Hi {user.username},\n\nPlease use the following link to reset your password:\n{reset_url}\n\nIf you did not request a password reset, please ignore this email."
     #user_email : EmailSchema = {"email": [user.email]}
-    await send_email(email_subject, [user.email], email_body)
+    # sent by the outbox dispatcher, so a slow mail server can't hold this up
+    await enqueue_email(email_subject, [user.email], email_body)
     return {"message": "Password reset token sent"}
 
 
@@ -0,0 +1,13 @@
+from fastapi import APIRouter, Response
+
+from app.codes import LABELS
+
+router = APIRouter(prefix="/api/codes", tags=["codes"])
+
+
+@router.get("/")
+async def list_codes(response: Response):
+    """Display labels of the clinic, vaccine and source codes records carry."""
+    # the labels only change with a release
+    response.headers["Cache-Control"] = "public, max-age=86400"
+    return LABELS
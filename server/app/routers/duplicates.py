@@ -0,0 +1,65 @@
+from typing import Optional
+
+from beanie import PydanticObjectId
+from fastapi import APIRouter, Depends, HTTPException, Query
+
+from app.models import DuplicateCandidate, Roles, User
+from app.middlewares.authware import get_current_user
+
+router = APIRouter(prefix="/api/duplicates", tags=["duplicates"])
+
+# the roles that may review each kind, mirroring the list routes
+REVIEWERS = {
+    "patient": {Roles.DR},
+    "immunization": {Roles.DR, Roles.NR},
+}
+
+
+def reviewable_kinds(user: User) -> list[str]:
+    roles = set(user.role)
+    return [kind for kind, reviewers in REVIEWERS.items() if roles & reviewers]
+
+
+@router.get("/", response_model=list[DuplicateCandidate])
+async def list_duplicates(
+    kind: Optional[str] = None,
+    status: str = Query("open", pattern="^(open|confirmed|dismissed)$"),
+    limit: int = Query(50, ge=1, le=500),
+    current_user: User = Depends(get_current_user),
+):
+    """List suspected duplicate pairs (open ones by default), most similar first."""
+    kinds = reviewable_kinds(current_user)
+    if kind is not None:
+        if kind not in kinds:
+            raise HTTPException(status_code=403, detail="Not allowed to review these records")
+        kinds = [kind]
+    return await DuplicateCandidate.find(
+        {"status": status, "kind": {"$in": kinds}}
+    ).sort([("score", -1)]).limit(limit).to_list()
+
+
+async def review(candidate_id: PydanticObjectId, user: User, status: str) -> DuplicateCandidate:
+    """sets a reviewable candidate's status, 404 when the user can't see it"""
+    candidate = await DuplicateCandidate.get(candidate_id)
+    if candidate is None or candidate.kind not in reviewable_kinds(user):
+        raise HTTPException(status_code=404, detail="Duplicate candidate not found")
+    await candidate.set({"status": status})
+    return candidate
+
+
+@router.post("/{candidate_id}/confirm", response_model=DuplicateCandidate)
+async def confirm_duplicate(
+    candidate_id: PydanticObjectId,
+    current_user: User = Depends(get_current_user),
+):
+    """Mark a suspected pair as the same person, for merging."""
+    return await review(candidate_id, current_user, "confirmed")
+
+
+@router.post("/{candidate_id}/dismiss", response_model=DuplicateCandidate)
+async def dismiss_duplicate(
+    candidate_id: PydanticObjectId,
+    current_user: User = Depends(get_current_user),
+):
+    """Mark a suspected pair as distinct people so it isn't reported again."""
+    return await review(candidate_id, current_user, "dismissed")
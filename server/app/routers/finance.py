@@ -1,9 +1,33 @@
-from fastapi import APIRouter, Depends, HTTPException
-from typing import List
+import asyncio
+
+from fastapi import APIRouter, Depends, Header, HTTPException, Request, Response
 from datetime import datetime 
-from app.models import Finance, FinanceCreateModel, User, Roles
+import logging
+from typing import Optional
+
+from beanie import UpdateResponse
+from pymongo.errors import DuplicateKeyError
+from app.models import Finance, FinanceCreateModel, FinanceUpdateModel, User, Roles
 from app.middlewares.authware import is_accountant, get_current_user, is_user_doctor
-from app.utils import encode_input
+from app.utils import duplicate_key_conflict, encode_input
+from app.pagination import ListParams, Page, build_filters, paginate
+from app.export import ExportParams, export_response
+from app.rollups import SummaryParams, apply_to_rollup, summarize
+from app.sync import record_tombstone
+from app.concurrency import raise_missing_or_conflict, set_etag, with_revision
+from app.responses import model_response, rows_response
+from app.readpref import read_session, reads
+from app.conditional import (
+    bump_version,
+    document_validators,
+    is_conditional,
+    list_validators,
+    not_modified,
+    not_modified_response,
+    record_validators,
+)
+
+logger = logging.getLogger(__name__)
 
 router = APIRouter(prefix="/api/finances", tags=["finances"])
 
@@ -17,27 +41,49 @@ async def create_finance(
     finance_data: FinanceCreateModel, current_user: User = Depends(get_current_user)
 ):
     """Create a new finance record."""
-    existing_finance = await Finance.find_one({"record_id": finance_data.record_id})
-    if existing_finance:
-        raise HTTPException(status_code=400, detail="Record ID already exists")
-
     new_finance = Finance(
         **finance_data.dict(),
         entered_by=current_user.username,
         updated_at=datetime.utcnow()
     )
-    await new_finance.insert()
-    return new_finance
+    try:
+        await new_finance.insert()
+    except DuplicateKeyError as exc:
+        raise duplicate_key_conflict(exc, {"record_id": "Record ID already exists"})
+    await asyncio.gather(apply_to_rollup(None, new_finance), bump_version("finances"))
+    return model_response(new_finance)
 
 # get all finances information
 @router.get(
     "/", 
-    response_model=List[Finance],
-    dependencies=[Depends(is_accountant)])
-async def list_financial_records():
-    """Retrieve a list of financial records."""
-    financial_records = await Finance.find_all().to_list()
-    return financial_records
+    response_model=Page,
+    dependencies=[Depends(is_accountant), Depends(reads("list"))])
+async def list_financial_records(
+    request: Request, response: Response, params: ListParams = Depends()
+):
+    """Retrieve a page of financial records, newest first."""
+    async with read_session() as session:
+        validators = await list_validators("finances", request, session)
+        if not_modified(request, validators):
+            return not_modified_response(validators)
+        query = build_filters(params, "record_date", clinic_field="clinic")
+        page = await paginate(Finance, query, params, session)
+    validators.apply(response)
+    return rows_response(page, response)
+
+
+@router.get("/export", dependencies=[Depends(is_accountant), Depends(reads("report"))])
+async def export_financial_records(params: ExportParams = Depends()):
+    """Stream every matching financial record as NDJSON or CSV."""
+    query = build_filters(params, "record_date", clinic_field="clinic")
+    return export_response(Finance, query, params, "finances")
+
+@router.get("/summary", dependencies=[Depends(is_accountant), Depends(reads("report"))])
+async def finance_summary(params: SummaryParams = Depends()):
+    """Totals per clinic, source or month, served from the daily rollups."""
+    return await summarize(
+        params.group_by, params.date_from, params.date_to, params.clinic
+    )
 
 # get one financial record using the specified financial id
 @router.get(
@@ -45,12 +91,20 @@ async def list_financial_records():
     response_model=Finance, 
     dependencies=[Depends(is_accountant)]
 )
-async def get_financial_record(record_id: str):
+async def get_financial_record(record_id: str, request: Request, response: Response):
     """Retrieve a specific financial record by ID."""
-    financial_record = await Finance.find_one({"record_id": record_id})
+    query = {"record_id": record_id}
+    if is_conditional(request):
+        validators = await record_validators(Finance, query)
+        if validators is None:
+            raise HTTPException(status_code=404, detail="Financial record not found")
+        if not_modified(request, validators):
+            return not_modified_response(validators)
+    financial_record = await Finance.find_one(query)
     if not financial_record:
         raise HTTPException(status_code=404, detail="Financial record not found")
-    return financial_record
+    document_validators(financial_record).apply(response)
+    return model_response(financial_record, response=response)
 
 
 @router.put(
@@ -59,14 +113,14 @@ async def get_financial_record(record_id: str):
     dependencies=[Depends(is_user_doctor)],
 )
 async def update_financial_record(
-    record_id: str, finance_data: Finance, current_user: User = Depends(get_current_user)
+    record_id: str,
+    finance_data: FinanceUpdateModel,
+    response: Response,
+    if_match: Optional[str] = Header(None),
+    current_user: User = Depends(get_current_user),
 ):
-    """Update an existing financial record."""
-    existing_finance = await Finance.find_one({"record_id": record_id})
-    if not existing_finance:
-        raise HTTPException(status_code=404, detail="Financial record not found")
-
-    if finance_data.reviewed_by_doctor and Roles.DR not in current_user.roles:
+    """Update an existing financial record in one round trip."""
+    if finance_data.reviewed_by_doctor and Roles.DR not in current_user.role:
         raise HTTPException(
             status_code=403,
             detail="Forbidden: Only doctors can review financial records",
@@ -76,22 +130,41 @@ async def update_financial_record(
     update_data['updated_at'] = datetime.utcnow()
     update_data["entered_by"] = current_user.username
 
-    if "record_id" in update_data:
-        del update_data["record_id"]
-    record = encode_input(update_data)
+    changes = encode_input(update_data)
 
-    _ = await existing_finance.update({"$set": record})
-    return existing_finance
+    # the rollups need both versions; the new one is the old one plus $set
+    query = {"record_id": record_id}
+    before = await Finance.find_one(with_revision(query, if_match)).update(
+        {"$set": changes, "$inc": {"revision": 1}},
+        response_type=UpdateResponse.OLD_DOCUMENT,
+    )
+    if before is None:
+        await raise_missing_or_conflict(Finance, query, "Financial record not found")
+    after = before.model_copy(
+        update={**update_data, "revision": before.revision + 1}
+    )
+    await asyncio.gather(apply_to_rollup(before, after), bump_version("finances"))
+    set_etag(response, after)
+    return model_response(after, response=response)
 
 @router.delete(
     "/financial-record",
     status_code=204,
     dependencies=[Depends(is_user_doctor)],
 )
-async def delete_financial_record(record_id: str):
+async def delete_financial_record(
+    record_id: str, if_match: Optional[str] = Header(None)
+):
     """Delete a financial record."""
-    financial_record = await Finance.find_one({"record_id": record_id})
-    if not financial_record:
-        raise HTTPException(status_code=404, detail="Financial record not found")
-    _ = await financial_record.delete()
-    print({"message": "Financial Record Deleted"})
+    query = {"record_id": record_id}
+    deleted = await Finance.get_motor_collection().find_one_and_delete(
+        with_revision(query, if_match)
+    )
+    if deleted is None:
+        await raise_missing_or_conflict(Finance, query, "Financial record not found")
+    await asyncio.gather(
+        apply_to_rollup(Finance.model_validate(deleted), None),
+        record_tombstone("finances", record_id),
+        bump_version("finances"),
+    )
+    logger.info("financial record deleted", extra={"record_id": record_id})
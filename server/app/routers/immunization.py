@@ -1,14 +1,70 @@
-from fastapi import APIRouter, Depends, HTTPException
+import asyncio
+
+from fastapi import APIRouter, Body, Depends, Header, HTTPException, Request, Response
 from datetime import datetime
-from typing import List
+from typing import List, Optional
+
+from beanie import UpdateResponse
+from pymongo.errors import DuplicateKeyError
 
 from app.models import Immunization, ImmunizationCreateModel, ImmunizationUpdateModel, User
 from app.middlewares.authware import is_nurse_or_doctor, is_chew,get_current_user
-from app.utils import encode_input
+from app.utils import duplicate_key_conflict, encode_input
+from app.pagination import ListParams, Page, build_filters, paginate
+from app.export import ExportParams, export_response
+from app.bulk import BatchGetRequest, BatchGetResult, BulkResult, batch_get, bulk_insert
+from app.analytics import (
+    CoverageParams,
+    DefaultersParams,
+    immunization_coverage,
+    immunization_defaulters,
+    invalidate_coverage,
+)
+from app.sync import record_tombstone
+from app.concurrency import raise_missing_or_conflict, set_etag, update_derived, with_revision
+from app.schedule import next_due
+from app.search import SEARCH_INDEX
+from app.text import dedup_block, search_keys
+from app.responses import model_response, rows_response
+from app.readpref import read_session, reads
+from app.conditional import (
+    bump_version,
+    document_validators,
+    is_conditional,
+    list_validators,
+    not_modified,
+    not_modified_response,
+    record_validators,
+)
+from app.dedup import duplicates_header, find_duplicates, record_pairs
+
+# fields the next due dose is derived from
+SCHEDULE_INPUTS = {"DOB", "vaccine_given", "date_of_vaccination"}
+# fields the search keys and dedup block are derived from
+KEY_INPUTS = {"name", "gender", "caregivers_name", "contact_no"}
 
 router = APIRouter(prefix="/api/immunizations", tags=["immunizations"])
 
 
+def derived_fields(row: dict) -> dict:
+    """the next due dose, search keys and dedup block of a raw record's inputs"""
+
+    last_visit = row.get("date_of_vaccination")
+    next_vaccine, next_due_date = next_due(
+        row.get("DOB"),
+        row.get("vaccine_given") or [],
+        last_visit.date() if isinstance(last_visit, datetime) else last_visit,
+    )
+    return {
+        "next_vaccine": next_vaccine,
+        "next_due_date": next_due_date,
+        "search_keys": search_keys(
+            [row.get("name"), row.get("caregivers_name")], [row.get("contact_no")]
+        ),
+        "dedup_block": dedup_block(row.get("name"), row.get("gender")),
+    }
+
+
 @router.post(
     "/",
     response_model=Immunization,
@@ -16,38 +72,120 @@ router = APIRouter(prefix="/api/immunizations", tags=["immunizations"])
     dependencies=[Depends(is_chew)],
 )
 async def create_immunization(
-    immunization_data: ImmunizationCreateModel, 
+    immunization_data: ImmunizationCreateModel,
+    response: Response,
     current_user: User = Depends(get_current_user)
 ):
     """Create a new immunization record."""
-    existing_client = await Immunization.find_one({"card_no": immunization_data.card_no})
-    if existing_client:
-        raise HTTPException(status_code=400, detail="Card number already exists")
     new_immunization = Immunization(
         **immunization_data.dict(),
         entered_by=current_user.username,
         updated_at=datetime.utcnow()
     )
-    _ = await new_immunization.insert()
-    return new_immunization
+    # scored before the insert; pairs are only stored once it succeeds
+    suspects = await find_duplicates("immunization", new_immunization.model_dump())
+    try:
+        _ = await new_immunization.insert()
+    except DuplicateKeyError as exc:
+        raise duplicate_key_conflict(exc, {"card_no": "Card number already exists"})
+    invalidate_coverage()
+    await asyncio.gather(
+        SEARCH_INDEX.upsert("immunization", new_immunization),
+        bump_version("immunizations"),
+        record_pairs("immunization", new_immunization.card_no, suspects),
+    )
+    if suspects:
+        response.headers["X-Possible-Duplicates"] = duplicates_header(suspects)
+    return model_response(new_immunization, 201, response)
 
 
-@router.get("/", response_model=List[Immunization])
-async def list_immunizations():
-    """Retrieve a list of immunizations."""
-    immunizations = await Immunization.find_all().to_list()
-    if not immunizations:
-        raise HTTPException(status_code=404, detail="Immunization not found")
-    return immunizations
+@router.post(
+    "/bulk",
+    response_model=BulkResult,
+    dependencies=[Depends(is_chew)],
+)
+async def bulk_create_immunizations(
+    rows: List[dict] = Body(...),
+    current_user: User = Depends(get_current_user),
+):
+    """Create many immunization records in one round trip."""
+    result = await bulk_insert(
+        Immunization,
+        ImmunizationCreateModel,
+        rows,
+        "card_no",
+        current_user.username,
+        on_created=lambda docs: SEARCH_INDEX.upsert_many("immunization", docs),
+    )
+    if result.created:
+        invalidate_coverage()
+        await bump_version("immunizations")
+    return result
+
+
+@router.post(
+    "/batch-get",
+    response_model=BatchGetResult,
+    dependencies=[Depends(get_current_user)],
+)
+async def batch_get_immunizations(request: BatchGetRequest):
+    """Resolve many card numbers at once, in request order."""
+    return rows_response(await batch_get(Immunization, "card_no", request))
+
+
+@router.get("/", response_model=Page, dependencies=[Depends(reads("list"))])
+async def list_immunizations(
+    request: Request, response: Response, params: ListParams = Depends()
+):
+    """Retrieve a page of immunizations, newest first."""
+    async with read_session() as session:
+        validators = await list_validators("immunizations", request, session)
+        if not_modified(request, validators):
+            return not_modified_response(validators)
+        query = build_filters(params, "date_of_vaccination", clinic_field="clinic")
+        page = await paginate(Immunization, query, params, session)
+    validators.apply(response)
+    return rows_response(page, response)
+
+
+@router.get("/export", dependencies=[Depends(is_nurse_or_doctor), Depends(reads("report"))])
+async def export_immunizations(params: ExportParams = Depends()):
+    """Stream every matching immunization as NDJSON or CSV."""
+    query = build_filters(params, "date_of_vaccination", clinic_field="clinic")
+    return export_response(Immunization, query, params, "immunizations")
+
+
+@router.get("/coverage", dependencies=[Depends(is_nurse_or_doctor), Depends(reads("report"))])
+async def immunization_coverage_report(params: CoverageParams = Depends()):
+    """Doses given per vaccine, clinic, month and gender, with dropout rates."""
+    return await immunization_coverage(params)
+
+
+@router.get(
+    "/defaulters",
+    response_model=Page,
+    dependencies=[Depends(is_nurse_or_doctor), Depends(reads("report"))],
+)
+async def list_defaulters(params: DefaultersParams = Depends()):
+    """Children whose next scheduled dose is overdue, for defaulter tracing."""
+    return rows_response(await immunization_defaulters(params))
 
 
 @router.get("/{immunization}", response_model=Immunization)
-async def get_immunization(card_no: str):
+async def get_immunization(card_no: str, request: Request, response: Response):
     """Retrieve a specific immunization record by ID."""
-    immunization = await Immunization.find_one({"card_no": card_no})
+    query = {"card_no": card_no}
+    if is_conditional(request):
+        validators = await record_validators(Immunization, query)
+        if validators is None:
+            raise HTTPException(status_code=404, detail="Immunization not found")
+        if not_modified(request, validators):
+            return not_modified_response(validators)
+    immunization = await Immunization.find_one(query)
     if not immunization:
         raise HTTPException(status_code=404, detail="Immunization not found")
-    return immunization
+    document_validators(immunization).apply(response)
+    return model_response(immunization, response=response)
 
 
 @router.put(
@@ -58,12 +196,11 @@ async def get_immunization(card_no: str):
 async def update_immunization(
     card_no: str, 
     immunization_data: ImmunizationUpdateModel, 
+    response: Response,
+    if_match: Optional[str] = Header(None),
     current_user: User = Depends(get_current_user),
 ):
-    """Update an existing immunization record."""
-    existing_immunization = await Immunization.find_one({"card_no": card_no})
-    if not existing_immunization:
-        raise HTTPException(status_code=404, detail="Immunization not found")
+    """Update an existing immunization record in a single write."""
     update_data = immunization_data.dict(exclude_unset=True)
     update_data["updated_at"] = datetime.utcnow()
     update_data["entered_by"] = current_user.username
@@ -71,19 +208,50 @@ async def update_immunization(
     # Ensure card_no is not changed
     if "card_no" in update_data:
         del update_data["card_no"]
-    immunization = encode_input(update_data)
-    _ = await existing_immunization.update({"$set": immunization})
-    return existing_immunization
+    changes = encode_input(update_data)
+
+    query = {"card_no": card_no}
+    if (SCHEDULE_INPUTS | KEY_INPUTS) & update_data.keys():
+        # derived fields go into the same write as their inputs
+        immunization = await update_derived(
+            Immunization,
+            query,
+            if_match,
+            changes,
+            derived_fields,
+            SCHEDULE_INPUTS | KEY_INPUTS,
+            "Immunization not found",
+        )
+    else:
+        immunization = await Immunization.find_one(with_revision(query, if_match)).update(
+            {"$set": changes, "$inc": {"revision": 1}},
+            response_type=UpdateResponse.NEW_DOCUMENT,
+        )
+        if immunization is None:
+            await raise_missing_or_conflict(Immunization, query, "Immunization not found")
+    invalidate_coverage()
+    await asyncio.gather(
+        SEARCH_INDEX.upsert("immunization", immunization),
+        bump_version("immunizations"),
+    )
+    set_etag(response, immunization)
+    return model_response(immunization, response=response)
 
 @router.delete(
     "/{immunization}",
     status_code=204,
     dependencies=[Depends(is_nurse_or_doctor)],
 )
-async def delete_immunization(card_no: str):
+async def delete_immunization(card_no: str, if_match: Optional[str] = Header(None)):
     """Delete an immunization record."""
-    immunization = await Immunization.find_one({"card_no": card_no})
-    if not immunization:
-        raise HTTPException(status_code=404, detail="Immunization not found")
-    _ = await immunization.delete()
+    query = {"card_no": card_no}
+    result = await Immunization.find_one(with_revision(query, if_match)).delete()
+    if not result.deleted_count:
+        await raise_missing_or_conflict(Immunization, query, "Immunization not found")
+    invalidate_coverage()
+    await asyncio.gather(
+        record_tombstone("immunizations", card_no),
+        SEARCH_INDEX.remove("immunization", card_no),
+        bump_version("immunizations"),
+    )
     return {"message": "immmunization deleted"}
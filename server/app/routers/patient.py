@@ -1,42 +1,148 @@
-from fastapi import APIRouter, Depends, HTTPException
+import asyncio
+
+from fastapi import APIRouter, Body, Depends, Header, HTTPException, Request, Response
 from datetime import datetime
-from typing import List
+from typing import List, Optional
+
+from beanie import UpdateResponse
+from pymongo.errors import DuplicateKeyError
 
-from app.models import Patient, PatientCreateModel, PatientUpdateModel, User
+from app.models import Patient, PatientCreateModel, PatientUpdateModel, User, normalize_diagnosis
 from app.middlewares.authware import get_current_user, is_user_doctor
-from app.utils import encode_input
+from app.utils import duplicate_key_conflict, encode_input
+from app.pagination import ListParams, Page, build_filters, paginate
+from app.export import ExportParams, export_response
+from app.bulk import BatchGetRequest, BatchGetResult, BulkResult, batch_get, bulk_insert
+from app.analytics import SurveillanceParams, diagnosis_surveillance
+from app.sync import record_tombstone
+from app.concurrency import raise_missing_or_conflict, set_etag, update_derived, with_revision
+from app.search import SEARCH_INDEX
+from app.text import dedup_block, search_keys
+from app.responses import model_response, rows_response
+from app.readpref import read_session, reads
+from app.conditional import (
+    bump_version,
+    document_validators,
+    is_conditional,
+    list_validators,
+    not_modified,
+    not_modified_response,
+    record_validators,
+)
+from app.dedup import duplicates_header, find_duplicates, record_pairs
 
 
 router = APIRouter(prefix="/api/patients", tags=["patients"])
 
+# fields the search keys and dedup block are derived from
+KEY_INPUTS = {"name", "gender"}
+
+
+def derived_fields(row: dict) -> dict:
+    """the search keys and dedup block of a raw patient's KEY_INPUTS"""
+
+    return {
+        "search_keys": search_keys([row.get("name")]),
+        "dedup_block": dedup_block(row.get("name"), row.get("gender")),
+    }
+
 
 @router.post(
     "/",
     status_code=201,
     dependencies=[Depends(is_user_doctor)],
 )
-async def create_patient(patient: PatientCreateModel, current_user: User = Depends(get_current_user)):
+async def create_patient(
+    patient: PatientCreateModel,
+    response: Response,
+    current_user: User = Depends(get_current_user),
+):
     """Create a new patient record."""
-    existing_patient = await Patient.find_one({"hospital_no": patient.hospital_no})
-    if existing_patient:
-        raise HTTPException(status_code=400, detail="Hospital number already exists")
     new_patient = Patient(
         **patient.dict(),
         entered_by=current_user.username,
         updated_at=datetime.utcnow()
     )
-    _ = await new_patient.insert()
-    return new_patient
+    # scored before the insert; pairs are only stored once it succeeds
+    suspects = await find_duplicates("patient", new_patient.model_dump())
+    try:
+        _ = await new_patient.insert()
+    except DuplicateKeyError as exc:
+        raise duplicate_key_conflict(
+            exc, {"hospital_no": "Hospital number already exists"}
+        )
+    await asyncio.gather(
+        SEARCH_INDEX.upsert("patient", new_patient),
+        bump_version("patients"),
+        record_pairs("patient", new_patient.hospital_no, suspects),
+    )
+    if suspects:
+        response.headers["X-Possible-Duplicates"] = duplicates_header(suspects)
+    return model_response(new_patient, 201, response)
+
+@router.post(
+    "/bulk",
+    response_model=BulkResult,
+    dependencies=[Depends(is_user_doctor)],
+)
+async def bulk_create_patients(
+    rows: List[dict] = Body(...),
+    current_user: User = Depends(get_current_user),
+):
+    """Create many patient records in one round trip."""
+    result = await bulk_insert(
+        Patient,
+        PatientCreateModel,
+        rows,
+        "hospital_no",
+        current_user.username,
+        on_created=lambda docs: SEARCH_INDEX.upsert_many("patient", docs),
+    )
+    if result.created:
+        await bump_version("patients")
+    return result
+
+
+@router.post(
+    "/batch-get",
+    response_model=BatchGetResult,
+    dependencies=[Depends(is_user_doctor)],
+)
+async def batch_get_patients(request: BatchGetRequest):
+    """Resolve many hospital numbers at once, in request order."""
+    return rows_response(await batch_get(Patient, "hospital_no", request))
+
 
 @router.get(
     "/", 
-    response_model=List[Patient], 
-    dependencies=[Depends(is_user_doctor)]
+    response_model=Page, 
+    dependencies=[Depends(is_user_doctor), Depends(reads("list"))]
 )
-async def list_patients():
-    """Retrieve a list of patients."""
-    patients = await Patient.find_all().to_list()
-    return patients
+async def list_patients(
+    request: Request, response: Response, params: ListParams = Depends()
+):
+    """Retrieve a page of patients, newest first."""
+    async with read_session() as session:
+        validators = await list_validators("patients", request, session)
+        if not_modified(request, validators):
+            return not_modified_response(validators)
+        query = build_filters(params, "date_of_visit", clinic_field="clinic")
+        page = await paginate(Patient, query, params, session)
+    validators.apply(response)
+    return rows_response(page, response)
+
+
+@router.get("/export", dependencies=[Depends(is_user_doctor), Depends(reads("report"))])
+async def export_patients(params: ExportParams = Depends()):
+    """Stream every matching patient as NDJSON or CSV."""
+    query = build_filters(params, "date_of_visit", clinic_field="clinic")
+    return export_response(Patient, query, params, "patients")
+
+
+@router.get("/surveillance", dependencies=[Depends(is_user_doctor), Depends(reads("report"))])
+async def patient_surveillance(params: SurveillanceParams = Depends()):
+    """Weekly diagnosis counts per clinic with week over week deltas."""
+    return await diagnosis_surveillance(params)
 
 
 @router.get(
@@ -44,12 +150,20 @@ async def list_patients():
     response_model=Patient,
     dependencies=[Depends(is_user_doctor)],
 )
-async def get_patient(hospital_no: str):
+async def get_patient(hospital_no: str, request: Request, response: Response):
     """Retrieve a specific patient's details by ID."""
-    patient = await Patient.find_one({"hospital_no": hospital_no})
+    query = {"hospital_no": hospital_no}
+    if is_conditional(request):
+        validators = await record_validators(Patient, query)
+        if validators is None:
+            raise HTTPException(status_code=404, detail="Patient not found")
+        if not_modified(request, validators):
+            return not_modified_response(validators)
+    patient = await Patient.find_one(query)
     if not patient:
         raise HTTPException(status_code=404, detail="Patient not found")
-    return patient
+    document_validators(patient).apply(response)
+    return model_response(patient, response=response)
 
 
 @router.put(
@@ -60,30 +174,55 @@ async def get_patient(hospital_no: str):
 async def update_patient(
     hospital_no: str,
     patient_data: PatientUpdateModel,
+    response: Response,
+    if_match: Optional[str] = Header(None),
     current_user: User = Depends(get_current_user),
 ):
-    """Update an existing patient record."""
-    existing_patient = await Patient.find_one({"hospital_no": hospital_no})
-    if not existing_patient:
-        raise HTTPException(status_code=404, detail="Patient not found")
+    """Update an existing patient record in a single write."""
     update_data = patient_data.dict(exclude_unset=True)
     update_data["updated_at"] = datetime.utcnow()
     update_data["entered_by"] = current_user.username
     if 'hospital_no' in update_data:
         del update_data['hospital_no']
-    patient = encode_input(update_data)
+    if update_data.get("provisional_diagnosis"):
+        update_data["diagnosis_key"] = normalize_diagnosis(
+            update_data["provisional_diagnosis"]
+        )
+    changes = encode_input(update_data)
 
-    _ = await existing_patient.update({"$set": patient})
-    return existing_patient
+    query = {"hospital_no": hospital_no}
+    if KEY_INPUTS & update_data.keys():
+        # derived fields go into the same write as their inputs
+        patient = await update_derived(
+            Patient, query, if_match, changes, derived_fields, KEY_INPUTS, "Patient not found"
+        )
+    else:
+        patient = await Patient.find_one(with_revision(query, if_match)).update(
+            {"$set": changes, "$inc": {"revision": 1}},
+            response_type=UpdateResponse.NEW_DOCUMENT,
+        )
+        if patient is None:
+            await raise_missing_or_conflict(Patient, query, "Patient not found")
+    await asyncio.gather(
+        SEARCH_INDEX.upsert("patient", patient),
+        bump_version("patients"),
+    )
+    set_etag(response, patient)
+    return model_response(patient, response=response)
 
 
 @router.delete(
     "/{patient}", status_code=204, dependencies=[Depends(is_user_doctor)]
 )
-async def delete_patient(hospital_no: str):
+async def delete_patient(hospital_no: str, if_match: Optional[str] = Header(None)):
     """Delete a patient record."""
-    patient = await Patient.find_one({"hospital_no": hospital_no})
-    if not patient:
-        raise HTTPException(status_code=404, detail="Patient not found")
-    _ = await patient.delete()
+    query = {"hospital_no": hospital_no}
+    result = await Patient.find_one(with_revision(query, if_match)).delete()
+    if not result.deleted_count:
+        await raise_missing_or_conflict(Patient, query, "Patient not found")
+    await asyncio.gather(
+        record_tombstone("patients", hospital_no),
+        SEARCH_INDEX.remove("patient", hospital_no),
+        bump_version("patients"),
+    )
     return {"message": "Patient deleted"}
@@ -0,0 +1,22 @@
+from fastapi import APIRouter, Depends, Query
+
+from app.models import Roles, User
+from app.middlewares.authware import get_current_user
+from app.readpref import reads
+from app.search import MAX_RESULTS, search
+
+router = APIRouter(prefix="/api/search", tags=["search"])
+
+
+@router.get("/", dependencies=[Depends(reads("search"))])
+async def search_records(
+    q: str = Query(..., min_length=2),
+    limit: int = Query(20, ge=1, le=MAX_RESULTS),
+    current_user: User = Depends(get_current_user),
+):
+    """Find patients and immunization cards by name, caregiver or phone prefix."""
+    # patient records are doctor only, like the patient routes
+    kinds = ["immunization"]
+    if Roles.DR in current_user.role:
+        kinds.insert(0, "patient")
+    return await search(q, kinds, limit)
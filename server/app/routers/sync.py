@@ -0,0 +1,33 @@
+from typing import Optional
+
+from fastapi import APIRouter, Depends, Query
+
+from app.models import Roles, User
+from app.middlewares.authware import get_current_user
+from app.sync import SyncResponse, collect_changes
+from app.responses import rows_response
+
+router = APIRouter(prefix="/api/sync", tags=["sync"])
+
+# the roles that may read each synced collection, mirroring the list routes
+READERS = {
+    "patients": {Roles.DR},
+    "immunizations": None,  # any authenticated user
+    "finances": {Roles.DR, Roles.AC, Roles.NR},
+}
+
+
+@router.get("/", response_model=SyncResponse)
+async def sync(
+    since: Optional[str] = None,
+    limit: int = Query(500, ge=1, le=5000),
+    current_user: User = Depends(get_current_user),
+):
+    """Return the records created, updated or deleted after a watermark."""
+    roles = set(current_user.role)
+    collections = [
+        name
+        for name, readers in READERS.items()
+        if readers is None or roles & readers
+    ]
+    return rows_response(await collect_changes(since, collections, limit))
@@ -0,0 +1,84 @@
+"""
+the national routine immunization schedule and what a child needs next
+
+kept free of app imports so the models can derive next due doses on
+every write. Vaccines are referred to by their ``Vaccine`` member name.
+"""
+from datetime import date, datetime, timedelta
+from typing import Iterable, NamedTuple
+
+DOB_FORMATS = ("%Y-%m-%d", "%d-%m-%Y", "%d/%m/%Y", "%Y/%m/%d")
+
+# shortest gap between doses of the same series
+MIN_INTERVAL = timedelta(days=28)
+
+
+class Dose(NamedTuple):
+    vaccine: str
+    # age the dose is due at
+    age: timedelta
+    # the earlier dose of the same series, if any
+    after: str | None = None
+    # age after which a missed dose is no longer given
+    valid_until: timedelta | None = None
+
+
+# child doses in the order they are given; tetanus doses are for mothers
+SCHEDULE: tuple[Dose, ...] = (
+    Dose("BCG", timedelta(0), valid_until=timedelta(days=365)),
+    Dose("OPV0", timedelta(0), valid_until=timedelta(days=14)),
+    Dose("HBV", timedelta(0), valid_until=timedelta(days=14)),
+    Dose("PENTA1", timedelta(weeks=6)),
+    Dose("PENTA2", timedelta(weeks=10), after="PENTA1"),
+    Dose("PENTA3", timedelta(weeks=14), after="PENTA2"),
+    Dose("IPV1", timedelta(weeks=14)),
+    Dose("MEASLES1", timedelta(days=274)),
+    Dose("YELLOW_FEVER", timedelta(days=274)),
+    Dose("MENA", timedelta(days=274)),
+    Dose("IPV2", timedelta(days=274), after="IPV1"),
+    Dose("MEASLES2", timedelta(days=456), after="MEASLES1"),
+)
+
+
+def parse_dob(value: str | None) -> date | None:
+    """reads a date of birth in any of the formats clinics write it in"""
+
+    for fmt in DOB_FORMATS:
+        try:
+            return datetime.strptime((value or "").strip(), fmt).date()
+        except ValueError:
+            continue
+    return None
+
+
+def next_due(
+    dob: str | None, given: Iterable[str], last_visit: date | None = None
+) -> tuple[str | None, date | None]:
+    """
+    the next dose a child needs and the date it falls due
+
+    :param dob: the date of birth as written on the card
+    :param given: names of the vaccines already given
+    :param last_visit: the date of the latest vaccination; a following
+        dose of the same series can't be given within MIN_INTERVAL of it,
+        and doses whose window closed before it are skipped
+    :return: (vaccine, due date), or (None, None) once the schedule is
+        complete or the date of birth can't be read
+    """
+
+    born = parse_dob(dob)
+    if born is None:
+        return None, None
+    given = set(given)
+    # only stored dates are used so the result stays valid until next write
+    seen = last_visit or born
+    for dose in SCHEDULE:
+        if dose.vaccine in given:
+            continue
+        if dose.valid_until is not None and seen > born + dose.valid_until:
+            continue  # missed and no longer given
+        due = born + dose.age
+        if dose.after in given and last_visit is not None:
+            due = max(due, last_visit + MIN_INTERVAL)
+        return dose.vaccine, due
+    return None, None
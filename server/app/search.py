@@ -0,0 +1,225 @@
+"""
+prefix search over patients and immunization cards
+
+records carry search_keys, the edge n-grams of their names (and phone
+numbers) plus a key per whole word, maintained on write and indexed, so
+a query is an index lookup on its first word filtered by the rest. SEARCH_BACKEND=memory swaps the
+collection for an in-process index, for tests.
+
+run ``python -m app.search`` to store keys on records written before
+search, or whole word keys, existed.
+"""
+import asyncio
+import re
+from typing import Iterable, Type
+
+from beanie import Document
+from pymongo import UpdateOne
+
+from app.models import Immunization, Patient
+from app.readpref import reader
+from app.settings import settings
+from app.text import WORD_END, query_tokens, search_keys, tokenize, word_key
+
+MAX_RESULTS = 50
+# candidates fetched per kind before ranking
+CANDIDATE_FACTOR = 4
+
+# kind -> (document, natural key, fields returned and ranked on)
+SEARCHABLE: dict[str, tuple[Type[Document], str, tuple[str, ...]]] = {
+    "patient": (Patient, "hospital_no", ("name",)),
+    "immunization": (
+        Immunization,
+        "card_no",
+        ("name", "caregivers_name", "contact_no"),
+    ),
+}
+
+
+def keys_for(kind: str, record: dict) -> list[str]:
+    """the search keys a record of the given kind should carry"""
+
+    if kind == "immunization":
+        return search_keys(
+            [record.get("name"), record.get("caregivers_name")],
+            [record.get("contact_no")],
+        )
+    return search_keys([record.get("name")])
+
+
+def score(tokens: list[str], record: dict, fields: tuple[str, ...]) -> float:
+    """
+    ranks a candidate: whole word matches beat prefix matches, the name
+    beats other fields, and shorter names win ties
+    """
+
+    total = 0.0
+    for position, field in enumerate(fields):
+        words = tokenize(str(record.get(field) or ""))
+        weight = 1.0 if position == 0 else 0.5
+        for token in tokens:
+            if token in words:
+                total += 2 * weight
+            elif any(word.startswith(token) for word in words):
+                total += weight
+    if words := tokenize(str(record.get(fields[0]) or "")):
+        if words[0].startswith(tokens[0]):
+            total += 0.5
+        total -= 0.01 * len(words)
+    return total
+
+
+def rank(tokens: list[str], hits: Iterable[tuple[str, dict]], limit: int) -> list[dict]:
+    """orders (kind, record) hits best first and shapes the response rows"""
+
+    rows = []
+    for kind, record in hits:
+        _, key, fields = SEARCHABLE[kind]
+        row = {"kind": kind, "key": record[key]}
+        row.update({field: record.get(field) for field in fields})
+        row["score"] = round(score(tokens, record, fields), 3)
+        rows.append(row)
+    # kind and key last, so ties come out the same from either backend
+    rows.sort(key=lambda row: (-row["score"], row["name"] or "", row["kind"], str(row["key"])))
+    return rows[:limit]
+
+
+class MongoSearchIndex:
+    """
+    searches the indexed search_keys of the collections themselves
+
+    the candidates are capped, so records matching every token as a whole
+    word are fetched first and only the rest of the cap is filled with
+    prefix matches; otherwise a common prefix could crowd exact matches out.
+    """
+
+    async def search(self, tokens: list[str], kinds: list[str], limit: int) -> list[tuple[str, dict]]:
+        wanted = limit * CANDIDATE_FACTOR
+        hits = []
+        for kind in kinds:
+            document, key, fields = SEARCHABLE[kind]
+            projection = {"_id": 0, key: 1, **{field: 1 for field in fields}}
+            collection = reader(document)
+            rows = await collection.find(
+                {"search_keys": {"$all": [word_key(token) for token in tokens]}}, projection
+            ).limit(wanted).to_list(length=wanted)
+            if len(rows) < wanted:
+                found = [row[key] for row in rows]
+                rows += await collection.find(
+                    {"search_keys": {"$all": tokens}, key: {"$nin": found}}, projection
+                ).limit(wanted - len(rows)).to_list(length=wanted - len(rows))
+            hits += [(kind, row) for row in rows]
+        return hits
+
+    async def upsert(self, kind: str, record: Document) -> None:
+        # records are written with their keys, inserts and updates alike;
+        # this only repairs ones stored before the keys changed
+        keys = keys_for(kind, record.model_dump())
+        if keys != record.search_keys:
+            document, key, _ = SEARCHABLE[kind]
+            await document.get_motor_collection().update_one(
+                {key: getattr(record, key)}, {"$set": {"search_keys": keys}}
+            )
+
+    async def upsert_many(self, kind: str, records: list[Document]) -> None:
+        pass  # bulk inserts validate records, which fills their keys
+
+    async def remove(self, kind: str, key: str) -> None:
+        pass  # the keys go with the document
+
+
+class MemorySearchIndex:
+    """an in-process inverted index with the same behaviour, for tests"""
+
+    def __init__(self):
+        self._records: dict[tuple[str, str], dict] = {}
+        self._postings: dict[str, set[tuple[str, str]]] = {}
+
+    async def search(self, tokens: list[str], kinds: list[str], limit: int) -> list[tuple[str, dict]]:
+        postings = [self._postings.get(token, set()) for token in tokens]
+        matches = set.intersection(*postings) if postings else set()
+        return [(kind, self._records[(kind, key)]) for kind, key in matches if kind in kinds]
+
+    async def upsert(self, kind: str, record: Document) -> None:
+        _, key_field, fields = SEARCHABLE[kind]
+        data = record.model_dump()
+        key = data[key_field]
+        await self.remove(kind, key)
+        self._records[(kind, key)] = {key_field: key, **{f: data.get(f) for f in fields}}
+        for token in keys_for(kind, data):
+            self._postings.setdefault(token, set()).add((kind, key))
+
+    async def upsert_many(self, kind: str, records: list[Document]) -> None:
+        for record in records:
+            await self.upsert(kind, record)
+
+    async def remove(self, kind: str, key: str) -> None:
+        if self._records.pop((kind, key), None) is None:
+            return
+        for postings in self._postings.values():
+            postings.discard((kind, key))
+
+
+SEARCH_INDEX = (
+    MemorySearchIndex() if settings.SEARCH_BACKEND == "memory" else MongoSearchIndex()
+)
+
+
+async def search(q: str, kinds: list[str], limit: int = 20) -> list[dict]:
+    """
+    finds patients and immunization cards whose words start with the
+    words of q
+
+    :param q: the query, e.g. "ade olu" or a phone number
+    :param kinds: the record kinds the caller may see
+    :param limit: the most results returned
+    """
+
+    tokens = query_tokens(q)
+    if not tokens or not kinds:
+        return []
+    hits = await SEARCH_INDEX.search(tokens, kinds, limit)
+    return rank(tokens, hits, limit)
+
+
+async def backfill_search_keys(batch_size: int = 1000) -> int:
+    """
+    stores search keys on records written before they existed, or before
+    they held whole word keys
+
+    updated_at is left alone: sync rows don't carry search keys, so
+    clients have nothing new to fetch.
+    """
+
+    # no key ends with WORD_END; matches a missing field too
+    outdated = {"search_keys": {"$not": re.compile(re.escape(WORD_END) + "$")}}
+    updated = 0
+    for kind, (document, _, fields) in SEARCHABLE.items():
+        collection = document.get_motor_collection()
+        cursor = collection.find(
+            outdated,
+            {field: 1 for field in fields},
+            batch_size=batch_size,
+        )
+        batch = []
+        async for row in cursor:
+            batch.append(UpdateOne(
+                {"_id": row["_id"]}, {"$set": {"search_keys": keys_for(kind, row)}}
+            ))
+            if len(batch) >= batch_size:
+                updated += (await collection.bulk_write(batch, ordered=False)).modified_count
+                batch = []
+        if batch:
+            updated += (await collection.bulk_write(batch, ordered=False)).modified_count
+    return updated
+
+
+async def main() -> None:
+    from app.database import init_db
+
+    await init_db(settings.DATABASE_URL)
+    print(f"stored search keys on {await backfill_search_keys()} records")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
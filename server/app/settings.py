@@ -1,11 +1,17 @@
 # from secrets import token_hex
 from datetime import timedelta
 
-from decouple import config
+from decouple import config, strtobool
 from pydantic_settings import BaseSettings
 from pydantic.types import Enum
 
 
+def optional_bool(value) -> bool | None:
+    """casts a setting to bool, keeping an unset (None) default as None"""
+
+    return None if value is None else bool(strtobool(str(value)))
+
+
 class Mode(Enum):
     """app mode enum"""
 
@@ -25,6 +31,35 @@ class Settings(BaseSettings):
     ACCESS_COOKIE_KEY: str = config("ACCESS_COOKIE_KEY", default="access_token_cookie")
     COOKIE_MAX_AGE: int = config("COOKIE_EXPIRE", default=24 * 60 * 60, cast=int)
     COOKIE_SAMESITE: str = "strict"
+    USER_CACHE_TTL: int = config("USER_CACHE_TTL", default=60, cast=int)
+    USER_CACHE_SIZE: int = config("USER_CACHE_SIZE", default=10_000, cast=int)
+    REVOKED_TOKENS_REFRESH: int = config("REVOKED_TOKENS_REFRESH", default=5, cast=int)
+    # seconds between checks of the cached users against the db: a role
+    # change or a deleted user takes effect in every worker within this long
+    USER_CACHE_REFRESH: int = config("USER_CACHE_REFRESH", default=5, cast=int)
+
+    # password hashing
+    BCRYPT_ROUNDS: int = config("BCRYPT_ROUNDS", default=12, cast=int)
+    HASH_WORKERS: int = config("HASH_WORKERS", default=4, cast=int)
+    HASH_MAX_PENDING: int = config("HASH_MAX_PENDING", default=64, cast=int)
+
+    # analytics
+    ANALYTICS_CACHE_TTL: int = config("ANALYTICS_CACHE_TTL", default=300, cast=int)
+
+    # search: "mongo" or "memory" (an in-process index, for tests)
+    SEARCH_BACKEND: str = config("SEARCH_BACKEND", default="mongo")
+
+    LOG_LEVEL: str = config("LOG_LEVEL", default="INFO")
+
+    # responses smaller than this many bytes aren't compressed
+    COMPRESS_MIN_SIZE: int = config("COMPRESS_MIN_SIZE", default=1000, cast=int)
+
+    # seconds behind its watermark a caught up client's next sync re-reads,
+    # for writes that committed after a newer updated_at was already synced
+    SYNC_OVERLAP_SECONDS: int = config("SYNC_OVERLAP_SECONDS", default=60, cast=int)
+
+    # seconds between background duplicate sweeps
+    DEDUP_INTERVAL: int = config("DEDUP_INTERVAL", default=600, cast=int)
 
     # database configuration
     DATABASE_URL: str = config("DATABASE_URL", default="mongodb://localhost:27017")
@@ -33,6 +68,35 @@ class Settings(BaseSettings):
     DB_HOST: str = config("DB_HOST", default="localhost")
     DB_USER: str | None = config("DB_USER", default=None)
     DB_PASSWD: str | None = config("DB_PORT", default=None)
+    # connection pool; DB_MIN_POOL_SIZE connections are opened at startup
+    DB_MAX_POOL_SIZE: int = config("DB_MAX_POOL_SIZE", default=100, cast=int)
+    DB_MIN_POOL_SIZE: int = config("DB_MIN_POOL_SIZE", default=10, cast=int)
+    DB_MAX_IDLE_TIME_MS: int = config("DB_MAX_IDLE_TIME_MS", default=300_000, cast=int)
+    DB_MAX_CONNECTING: int = config("DB_MAX_CONNECTING", default=2, cast=int)
+    # timeouts; DB_TIMEOUT_MS bounds a whole operation, retries included (0 = none)
+    DB_CONNECT_TIMEOUT_MS: int = config("DB_CONNECT_TIMEOUT_MS", default=10_000, cast=int)
+    DB_SOCKET_TIMEOUT_MS: int = config("DB_SOCKET_TIMEOUT_MS", default=30_000, cast=int)
+    DB_SERVER_SELECTION_TIMEOUT_MS: int = config(
+        "DB_SERVER_SELECTION_TIMEOUT_MS", default=10_000, cast=int
+    )
+    DB_TIMEOUT_MS: int = config("DB_TIMEOUT_MS", default=0, cast=int)
+    # wire compression, in order of preference; ones not installed are skipped
+    DB_COMPRESSORS: str = config("DB_COMPRESSORS", default="zstd,snappy,zlib")
+    # write concern: a node count or "majority"; unset keeps the server default
+    DB_WRITE_CONCERN: str | None = config("DB_WRITE_CONCERN", default=None)
+    DB_WRITE_TIMEOUT_MS: int = config("DB_WRITE_TIMEOUT_MS", default=0, cast=int)
+    DB_JOURNAL: bool | None = config("DB_JOURNAL", default=None, cast=optional_bool)
+    DB_APP_NAME: str = config("DB_APP_NAME", default="comclic")
+    # drop indexes that aren't declared on the documents at startup
+    DB_ALLOW_INDEX_DROPPING: bool = config("DB_ALLOW_INDEX_DROPPING", default=False, cast=bool)
+    # where list, search and report routes read from: primary,
+    # primaryPreferred, secondary, secondaryPreferred or nearest. Writes
+    # and single record reads always go to the primary.
+    DB_LIST_READS: str = config("DB_LIST_READS", default="secondaryPreferred")
+    DB_SEARCH_READS: str = config("DB_SEARCH_READS", default="secondaryPreferred")
+    DB_REPORT_READS: str = config("DB_REPORT_READS", default="secondaryPreferred")
+    # secondaries lagging further than this aren't read (at least 90; -1 = no bound)
+    DB_MAX_STALENESS_SECONDS: int = config("DB_MAX_STALENESS_SECONDS", default=90, cast=int)
 
     # email configuration
     SMTP_HOST: str = config("SMTP_HOST", default="localhost")
@@ -40,8 +104,14 @@ class Settings(BaseSettings):
     SMTP_USERNAME: str = config("SMTP_USERNAME")
     SMTP_PASSWORD: str = config("SMTP_PASSWORD")
     FROM_EMAIL: str = config("FROM_EMAIL")
-    SMTP_USE_TLS: bool | None = config("SMTP_USE_TLS", default=None, cast=bool)
-    SMTP_USE_SSL: bool | None= config("SMTP_USE_SSL", default=None, cast=bool)
+    SMTP_USE_TLS: bool | None = config("SMTP_USE_TLS", default=None, cast=optional_bool)
+    SMTP_USE_SSL: bool | None = config("SMTP_USE_SSL", default=None, cast=optional_bool)
+    SMTP_TIMEOUT: int = config("SMTP_TIMEOUT", default=30, cast=int)
+    # connections kept open to the smtp server by the outbox dispatcher
+    SMTP_POOL_SIZE: int = config("SMTP_POOL_SIZE", default=2, cast=int)
+    OUTBOX_BATCH_SIZE: int = config("OUTBOX_BATCH_SIZE", default=50, cast=int)
+    OUTBOX_POLL_INTERVAL: int = config("OUTBOX_POLL_INTERVAL", default=5, cast=int)
+    OUTBOX_MAX_ATTEMPTS: int = config("OUTBOX_MAX_ATTEMPTS", default=8, cast=int)
 
 # redis configuration
 # REDIS_HOST: str = config("REDIS_HOST", default="localhost")
@@ -0,0 +1,208 @@
+"""
+delta sync for offline first clients
+
+each synced collection is read in (updated_at, _id) order from the
+position stored in the client's watermark, so a sync only returns what
+changed since the last one.
+
+updated_at is stamped by the app before the write commits, so a slow
+write can become visible after a newer one was already synced. The first
+sync after a client caught up therefore re-reads SYNC_OVERLAP_SECONDS
+behind its watermark; clients apply rows by key and revision, so the
+repeats are harmless. Paging through a backlog (has_more) stays strictly
+forward.
+
+deletes are only remembered for TOMBSTONE_TTL. A watermark older than
+that may have missed some, so it gets full_resync: the response starts
+over from scratch and the client replaces its local copy.
+"""
+import base64
+import json
+from datetime import datetime, timedelta
+from typing import NamedTuple, Type
+
+from beanie import Document
+from bson import ObjectId
+from bson.errors import InvalidId
+from fastapi import HTTPException
+from pydantic import BaseModel
+import pymongo
+
+from app.models import INTERNAL_FIELDS, TOMBSTONE_TTL, Finance, Immunization, Patient, Tombstone
+from app.pagination import to_json_row
+from app.settings import settings
+
+# collection name -> (document class, natural key)
+SYNCED = {
+    "patients": (Patient, "hospital_no"),
+    "immunizations": (Immunization, "card_no"),
+    "finances": (Finance, "record_id"),
+}
+OVERLAP = timedelta(seconds=settings.SYNC_OVERLAP_SECONDS)
+FIRST_ID = ObjectId("0" * 24)
+
+
+class SyncResponse(BaseModel):
+    """the changes since a watermark"""
+
+    patients: list[dict] = []
+    immunizations: list[dict] = []
+    finances: list[dict] = []
+    deleted: dict[str, list[dict]] = {}
+    watermark: str
+    has_more: bool
+    # the watermark was too old: drop the local copy, these rows replace it
+    full_resync: bool = False
+
+
+class Watermark(NamedTuple):
+    """what a client's watermark says about its last sync"""
+
+    # collection (or "tombstones") -> the last (updated_at, _id) returned
+    positions: dict[str, tuple[datetime, ObjectId]]
+    # when it was issued; None for a from scratch sync
+    issued_at: datetime | None = None
+    # issued with has_more set, so the client is still paging
+    paging: bool = False
+
+
+def encode_watermark(
+    positions: dict[str, tuple[datetime, ObjectId]],
+    issued_at: datetime,
+    paging: bool = False,
+) -> str:
+    """packs the per collection positions into an opaque watermark"""
+
+    raw = json.dumps({
+        "positions": {
+            name: [ts.isoformat(), str(_id)] for name, (ts, _id) in positions.items()
+        },
+        "issued_at": issued_at.isoformat(),
+        "paging": paging,
+    }).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip("=")
+
+
+def decode_watermark(watermark: str | None) -> Watermark:
+    """unpacks a watermark made by encode_watermark; None means from scratch"""
+
+    if not watermark:
+        return Watermark({})
+    try:
+        padded = watermark + "=" * (-len(watermark) % 4)
+        raw = json.loads(base64.urlsafe_b64decode(padded))
+        if "positions" not in raw:
+            # issued before watermarks carried their age: it is at least
+            # as old as the newest change it had seen
+            raw = {"positions": raw, "issued_at": None, "paging": False}
+        positions = {
+            name: (datetime.fromisoformat(ts), ObjectId(_id))
+            for name, (ts, _id) in raw["positions"].items()
+        }
+        issued_at = raw["issued_at"]
+        if issued_at is not None:
+            issued_at = datetime.fromisoformat(issued_at)
+        elif positions:
+            issued_at = max(ts for ts, _ in positions.values())
+        return Watermark(positions, issued_at, bool(raw["paging"]))
+    except (ValueError, TypeError, KeyError, AttributeError, InvalidId):
+        raise HTTPException(status_code=400, detail="Invalid watermark")
+
+
+def start_position(
+    mark: Watermark, name: str
+) -> tuple[datetime, ObjectId] | None:
+    """where a sync reads a collection from, rewound by OVERLAP unless paging"""
+
+    position = mark.positions.get(name)
+    if position is None or mark.paging:
+        return position
+    return position[0] - OVERLAP, FIRST_ID
+
+
+async def changes_after(
+    document: Type[Document],
+    position: tuple[datetime, ObjectId] | None,
+    limit: int,
+    query: dict | None = None,
+) -> tuple[list[dict], bool]:
+    """
+    rows of a collection after a position, oldest change first
+
+    :return: at most limit rows and whether more remain
+    """
+
+    query = dict(query or {})
+    if position is not None:
+        ts, _id = position
+        query["$or"] = [
+            {"updated_at": {"$gt": ts}},
+            {"updated_at": ts, "_id": {"$gt": _id}},
+        ]
+    rows = (
+        await document.get_motor_collection()
+        .find(query, {name: 0 for name in INTERNAL_FIELDS})
+        .sort([("updated_at", pymongo.ASCENDING), ("_id", pymongo.ASCENDING)])
+        .limit(limit + 1)
+        .to_list(length=limit + 1)
+    )
+    return rows[:limit], len(rows) > limit
+
+
+async def collect_changes(
+    watermark: str | None, collections: list[str], limit: int
+) -> SyncResponse:
+    """
+    the changed and deleted records of the given collections
+
+    :param watermark: the watermark returned by the previous sync
+    :param collections: the collections the caller may read
+    :param limit: the most rows returned per collection
+    """
+
+    now = datetime.utcnow()
+    mark = decode_watermark(watermark)
+    full_resync = mark.issued_at is not None and mark.issued_at < now - TOMBSTONE_TTL
+    if full_resync:
+        mark = Watermark({})
+    positions = dict(mark.positions)
+    response = {}
+    has_more = False
+
+    for name in collections:
+        document, _ = SYNCED[name]
+        rows, more = await changes_after(document, start_position(mark, name), limit)
+        has_more |= more
+        if rows:
+            positions[name] = (rows[-1]["updated_at"], rows[-1]["_id"])
+        response[name] = [to_json_row(row, document) for row in rows]
+
+    tombstones, more = await changes_after(
+        Tombstone,
+        start_position(mark, "tombstones"),
+        limit,
+        {"collection": {"$in": collections}},
+    )
+    has_more |= more
+    if tombstones:
+        positions["tombstones"] = (tombstones[-1]["updated_at"], tombstones[-1]["_id"])
+    # clients compare deleted_at with updated_at in case a key was reused
+    deleted: dict[str, list[dict]] = {}
+    for row in tombstones:
+        deleted.setdefault(row["collection"], []).append(
+            {"key": row["key"], "deleted_at": row["updated_at"]}
+        )
+
+    return SyncResponse.model_construct(
+        **response,
+        deleted=deleted,
+        watermark=encode_watermark(positions, now, paging=has_more),
+        has_more=has_more,
+        full_resync=full_resync,
+    )
+
+
+async def record_tombstone(collection: str, key: str) -> None:
+    """remembers a hard delete for clients that sync later"""
+
+    await Tombstone(collection=collection, key=key).insert()
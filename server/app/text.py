@@ -0,0 +1,128 @@
+"""
+text normalization shared by search and duplicate detection
+"""
+import re
+import unicodedata
+from typing import Iterable
+
+MIN_GRAM = 2
+MAX_GRAM = 15
+# ends the key of a whole word, which tokenize never produces, so exact
+# word matches can be looked up apart from prefix matches
+WORD_END = "$"
+
+
+def fold(value: str) -> str:
+    """lower cases and strips accents, so "Adébáyọ̀" matches "adebayo" """
+
+    decomposed = unicodedata.normalize("NFKD", value)
+    return "".join(c for c in decomposed if not unicodedata.combining(c)).lower()
+
+
+def tokenize(value: str | None) -> list[str]:
+    """splits a name into folded alphanumeric words"""
+
+    if not value:
+        return []
+    return re.findall(r"[a-z0-9]+", fold(value))
+
+
+def edge_ngrams(token: str) -> list[str]:
+    """the prefixes of a word a user may have typed so far"""
+
+    return [token[:n] for n in range(MIN_GRAM, min(len(token), MAX_GRAM) + 1)]
+
+
+def word_key(token: str) -> str:
+    """the key of a whole word, as opposed to its prefixes"""
+
+    return token[:MAX_GRAM] + WORD_END
+
+
+def phone_variants(value: str | None) -> list[str]:
+    """the digits of a phone number, with +234 also written as a leading 0"""
+
+    digits = re.sub(r"\D", "", value or "")
+    if not digits:
+        return []
+    variants = [digits]
+    if digits.startswith("234") and len(digits) > 3:
+        variants.append("0" + digits[3:])
+    return variants
+
+
+def search_keys(names: Iterable[str | None], phones: Iterable[str | None] = ()) -> list[str]:
+    """
+    the prefix keys a record is found under
+
+    :param names: free text name fields
+    :param phones: phone number fields
+    :return: sorted, de-duplicated edge n-grams and whole word keys
+    """
+
+    keys: set[str] = set()
+    for name in names:
+        for token in tokenize(name):
+            keys.update(edge_ngrams(token))
+            keys.add(word_key(token))
+    for phone in phones:
+        for digits in phone_variants(phone):
+            keys.update(edge_ngrams(digits))
+            keys.add(word_key(digits))
+    return sorted(keys)
+
+
+def query_tokens(q: str) -> list[str]:
+    """the words of a search query, trimmed to what the keys can match"""
+
+    if not re.search(r"[^\d\s()+-]", q):
+        # a phone number typed with separators is still one number
+        return [v[:MAX_GRAM] for v in phone_variants(q)[:1] if len(v) >= MIN_GRAM]
+    tokens = []
+    for token in tokenize(q):
+        if len(token) >= MIN_GRAM and token[:MAX_GRAM] not in tokens:
+            tokens.append(token[:MAX_GRAM])
+    return tokens
+
+
+SOUNDEX_CODES = {
+    **dict.fromkeys("bfpv", "1"),
+    **dict.fromkeys("cgjkqsxz", "2"),
+    **dict.fromkeys("dt", "3"),
+    "l": "4",
+    **dict.fromkeys("mn", "5"),
+    "r": "6",
+}
+
+
+def soundex(word: str) -> str:
+    """the classic four character soundex code of a word"""
+
+    word = "".join(c for c in word if c.isalpha())
+    if not word:
+        return ""
+    code = word[0].upper()
+    last = SOUNDEX_CODES.get(word[0], "")
+    for char in word[1:]:
+        digit = SOUNDEX_CODES.get(char, "")
+        if digit and digit != last:
+            code += digit
+            if len(code) == 4:
+                break
+        if char not in "hw":
+            last = digit
+    return code.ljust(4, "0")
+
+
+def dedup_block(name: str | None, gender: str | None) -> str | None:
+    """
+    the blocking key of a record: the soundex of its first and last name,
+    order independent, plus the first letter of its gender
+    """
+
+    words = [w for w in tokenize(name) if not w.isdigit()]
+    if not words:
+        return None
+    codes = sorted({soundex(words[0]), soundex(words[-1])})
+    sex = (gender or "?").strip()[:1].upper() or "?"
+    return f"{'-'.join(codes)}:{sex}"
@@ -3,10 +3,15 @@ chat utility helper functions
 """
 
 # import smtplib
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+import time
+from typing import Callable
+
+from fastapi import HTTPException
+from pymongo.errors import DuplicateKeyError
 from passlib.context import CryptContext
-from fastapi.encoders import jsonable_encoder
-import aiosmtplib
-from email.message import EmailMessage
+from beanie.odm.utils.encoder import Encoder
 # from typing import List
 # from fastapi import BackgroundTasks, FastAPI
 # from fastapi_mail import ConnectionConfig, FastMail, MessageSchema, MessageType
@@ -15,7 +20,15 @@ from email.message import EmailMessage
 # from app.models import EmailSchema
 from app.settings import settings
 
-HASHER = CryptContext(schemes=["bcrypt"], deprecated="auto")
+# hashes of any other cost count as outdated, so verify_and_update rehashes
+# them at the next login after BCRYPT_ROUNDS changes
+HASHER = CryptContext(
+    schemes=["bcrypt"],
+    deprecated="auto",
+    bcrypt__rounds=settings.BCRYPT_ROUNDS,
+    bcrypt__min_rounds=settings.BCRYPT_ROUNDS,
+    bcrypt__max_rounds=settings.BCRYPT_ROUNDS,
+)
 
 def create_passwd_hash(passwd: str) -> str:
     """
@@ -31,26 +44,127 @@ def verify_passwd(passwd: str, passwd_hash: str) -> bool:
     return HASHER.verify(passwd, passwd_hash)
 
 
+class HashPool:
+    """
+    runs bcrypt on a bounded thread pool so it never blocks the event loop
+
+    at most max_pending calls may be queued or running; beyond that callers
+    get a 503 instead of piling up behind the pool.
+    """
+
+    def __init__(self, workers: int, max_pending: int):
+        self.workers = workers
+        self.max_pending = max_pending
+        self.pending = 0
+        self.calls = 0
+        self.rejected = 0
+        self.total_seconds = 0.0
+        self.max_seconds = 0.0
+        self._executor: ThreadPoolExecutor | None = None
+
+    @property
+    def executor(self) -> ThreadPoolExecutor:
+        if self._executor is None:
+            self._executor = ThreadPoolExecutor(
+                max_workers=self.workers, thread_name_prefix="bcrypt"
+            )
+        return self._executor
+
+    async def run(self, func: Callable, *args):
+        """runs func(*args) on the pool, recording queue + run latency"""
+
+        if self.pending >= self.max_pending:
+            self.rejected += 1
+            raise HTTPException(
+                status_code=503,
+                detail="server busy, try again",
+                headers={"Retry-After": "1"},
+            )
+        self.pending += 1
+        start = time.perf_counter()
+        try:
+            loop = asyncio.get_running_loop()
+            return await loop.run_in_executor(self.executor, func, *args)
+        finally:
+            elapsed = time.perf_counter() - start
+            self.pending -= 1
+            self.calls += 1
+            self.total_seconds += elapsed
+            self.max_seconds = max(self.max_seconds, elapsed)
+
+    def stats(self) -> dict:
+        return {
+            "workers": self.workers,
+            "pending": self.pending,
+            "calls": self.calls,
+            "rejected": self.rejected,
+            "avg_seconds": self.total_seconds / self.calls if self.calls else 0.0,
+            "max_seconds": self.max_seconds,
+        }
+
+    def shutdown(self) -> None:
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
+
+
+HASH_POOL = HashPool(settings.HASH_WORKERS, settings.HASH_MAX_PENDING)
+
+
+async def create_passwd_hash_async(passwd: str) -> str:
+    """
+    returns the hash of the password, computed off the event loop
+    """
+    return await HASH_POOL.run(HASHER.hash, passwd)
+
+
+async def verify_and_update_passwd_async(
+    passwd: str, passwd_hash: str
+) -> tuple[bool, str | None]:
+    """
+    verifies the password off the event loop
+
+    :return: whether it matched, and a rehash if the stored hash uses an
+        outdated cost factor
+    """
+    return await HASH_POOL.run(HASHER.verify_and_update, passwd, passwd_hash)
+
+
 def encode_input(data) -> dict:
-    data = jsonable_encoder(data)
+    """
+    encodes an update the way beanie encodes inserts, dropping unset values
+
+    dates become datetimes and enums their values, so updated fields keep
+    the same bson types as freshly inserted ones.
+    """
+    data = Encoder().encode(data)
     data = {k: v for k, v in data.items() if v is not None}
     return data
 
 
-async def send_email(subject: str, recipient: str, body: str):
-    message = EmailMessage()
-    message["From"] = settings.FROM_EMAIL
-    message["To"] = recipient
-    message["Subject"] = subject
-    message.set_content(body)
-
-    await aiosmtplib.send(
-        message,
-        hostname=settings.SMTP_HOST,
-        port=settings.SMTP_PORT,
-        username=settings.FROM_EMAIL,
-        password=settings.SMTP_PASSWORD,
-        use_tls=True,
+def duplicate_key_conflict(
+    exc: DuplicateKeyError, messages: dict[str, str]
+) -> HTTPException:
+    """
+    turns a unique index violation into a structured 409
+
+    :param exc: the error raised by the insert
+    :param messages: a human readable message per uniquely indexed field
+    """
+    details = exc.details or {}
+    key_value = details.get("keyValue") or {}
+    field = next(iter(key_value), None)
+    if field is None:
+        # older servers only name the index in the error message
+        errmsg = details.get("errmsg", str(exc))
+        field = next((f for f in messages if f in errmsg), None)
+    return HTTPException(
+        status_code=409,
+        detail={
+            "message": messages.get(field, "record already exists"),
+            "field": field,
+            "value": key_value.get(field),
+        },
     )
 
 
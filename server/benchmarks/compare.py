@@ -0,0 +1,77 @@
+"""
+compares two load test reports
+
+prints each scenario's p50/p95/p99 and throughput side by side with the
+change, and exits with 1 when a scenario's p95 grew or its throughput
+fell by more than --threshold percent, so it can gate a commit.
+
+usage: python -m benchmarks.compare baseline.json candidate.json [--threshold 10]
+"""
+import argparse
+import json
+import sys
+
+METRICS = ("p50_ms", "p95_ms", "p99_ms", "throughput_rps")
+
+
+def change(before: float, after: float) -> float:
+    """percent change from before to after"""
+
+    return (after - before) / before * 100 if before else 0.0
+
+
+def regressions(baseline: dict, candidate: dict, threshold: float) -> list[str]:
+    found = []
+    for name, after in candidate["scenarios"].items():
+        before = baseline["scenarios"].get(name)
+        if before is None:
+            continue
+        if change(before["p95_ms"], after["p95_ms"]) > threshold:
+            found.append(f"{name}: p95 {before['p95_ms']} -> {after['p95_ms']} ms")
+        if change(before["throughput_rps"], after["throughput_rps"]) < -threshold:
+            found.append(
+                f"{name}: throughput {before['throughput_rps']} -> {after['throughput_rps']} rps"
+            )
+    return found
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("baseline")
+    parser.add_argument("candidate")
+    parser.add_argument("--threshold", type=float, default=10.0, help="percent")
+    args = parser.parse_args()
+
+    with open(args.baseline) as file:
+        baseline = json.load(file)
+    with open(args.candidate) as file:
+        candidate = json.load(file)
+
+    for key in ("backend", "scale", "seed", "concurrency", "requests"):
+        if baseline["meta"].get(key) != candidate["meta"].get(key):
+            print(
+                f"warning: {key} differs ({baseline['meta'].get(key)} vs "
+                f"{candidate['meta'].get(key)}), numbers aren't comparable",
+                file=sys.stderr,
+            )
+
+    print(f"{baseline['meta'].get('commit')} -> {candidate['meta'].get('commit')}")
+    for name, after in candidate["scenarios"].items():
+        before = baseline["scenarios"].get(name)
+        if before is None:
+            print(f"{name}: not in baseline")
+            continue
+        cells = [
+            f"{metric} {before[metric]} -> {after[metric]} ({change(before[metric], after[metric]):+.1f}%)"
+            for metric in METRICS
+        ]
+        print(f"{name}: " + ", ".join(cells))
+
+    found = regressions(baseline, candidate, args.threshold)
+    for line in found:
+        print(f"regression: {line}")
+    sys.exit(1 if found else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,255 @@
+"""
+synthetic data for the load tests
+
+fills a database with patients, immunizations and finance records shaped
+like the clinics' own. Rows are built from a seeded random generator and
+dated from a fixed epoch rather than today, so the same scale and seed
+give the same database on every machine and commit. Documents go through
+the models, so derived fields (search keys, dedup blocks, next due dose)
+are exactly what the app would store.
+
+the seed is recorded in a bench_meta collection; seeding a database that
+already holds the same scale and seed is a no-op.
+
+usage: python -m benchmarks.datagen [--scale 10k|100k|1m] [--seed N]
+needs a running mongo at DATABASE_URL; writes to DB_NAME, so point it at
+a scratch database, e.g. DB_NAME=comclic_bench.
+"""
+import argparse
+import asyncio
+import random
+import time
+from datetime import date, datetime, timedelta
+from typing import Iterator
+
+from app.models import (
+    Clinic,
+    Finance,
+    Immunization,
+    Patient,
+    Roles,
+    Source,
+    User,
+    Vaccine,
+)
+from app.schedule import SCHEDULE
+from app.utils import create_passwd_hash
+
+SCALES = {"10k": 10_000, "100k": 100_000, "1m": 1_000_000}
+BATCH_SIZE = 5_000
+EPOCH = datetime(2024, 1, 1)
+
+# finance rows are one per clinic, day and source, so far fewer of them
+FINANCE_RATIO = 10
+
+BENCH_PASSWORD = "bench-password"
+
+FIRST_NAMES = (
+    "Adebayo", "Adaeze", "Bola", "Chinedu", "Damilola", "Emeka", "Folake",
+    "Funmilayo", "Ibrahim", "Ifeoma", "Kehinde", "Ngozi", "Olumide",
+    "Oluwaseun", "Segun", "Taiwo", "Temitope", "Tunde", "Yetunde", "Zainab",
+)
+SURNAMES = (
+    "Adeyemi", "Afolabi", "Akinola", "Babatunde", "Eze", "Fashola", "Ibe",
+    "Ogunleye", "Okafor", "Okonkwo", "Olaniyan", "Oyelaran", "Usman",
+)
+DIAGNOSES = (
+    "Malaria", "malaria fever", "Typhoid", "URTI", "Hypertension",
+    "Diabetes mellitus", "Gastroenteritis", "Pneumonia", "Peptic ulcer",
+)
+COMPLAINTS = (
+    "Fever and headache for three days", "Cough for one week",
+    "Abdominal pain", "Body weakness", "Vomiting and diarrhoea",
+)
+TREATMENTS = ("ACT", "Ciprofloxacin", "Amoxicillin", "ORS and zinc", "Amlodipine")
+GENDERS = ("Male", "Female")
+CLINICS = tuple(Clinic)
+SOURCES = tuple(Source)
+CHILD_DOSES = [dose.vaccine for dose in SCHEDULE]
+
+
+def parse_scale(value: str) -> int:
+    """a scale name like 100k, or a plain row count"""
+
+    return SCALES.get(value.lower()) or int(value)
+
+
+def _name(rng: random.Random) -> str:
+    return f"{rng.choice(FIRST_NAMES)} {rng.choice(SURNAMES)}"
+
+
+def patient_row(rng: random.Random, i: int, prefix: str = "H") -> dict:
+    """the fields a client sends to create one patient"""
+
+    return {
+        "hospital_no": f"{prefix}{i:08d}",
+        "name": _name(rng),
+        "age": rng.randint(0, 90),
+        "gender": rng.choice(GENDERS),
+        "reason_for_visit": None,
+        "complaint": rng.choice(COMPLAINTS),
+        "date_of_visit": (EPOCH + timedelta(days=rng.randint(0, 364))).date().isoformat(),
+        "provisional_diagnosis": rng.choice(DIAGNOSES),
+        "differential_diagnosis": None,
+        "investigations": None,
+        "treatment": rng.choice(TREATMENTS),
+        "referral": rng.random() < 0.05,
+        "clinic": [rng.choice(CLINICS).value],
+    }
+
+
+def patients(count: int, seed: int) -> Iterator[Patient]:
+    rng = random.Random(f"patients-{seed}")
+    for i in range(count):
+        created = EPOCH + timedelta(minutes=i)
+        yield Patient(
+            **patient_row(rng, i),
+            entered_by="bench-doctor",
+            created_at=created,
+            updated_at=created,
+        )
+
+
+def immunizations(count: int, seed: int) -> Iterator[Immunization]:
+    rng = random.Random(f"immunizations-{seed}")
+    for i in range(count):
+        born = EPOCH.date() - timedelta(days=rng.randint(0, 600))
+        given = CHILD_DOSES[: rng.randint(1, len(CHILD_DOSES))]
+        visit = min(born + timedelta(days=rng.randint(0, 500)), date(2024, 12, 31))
+        created = EPOCH + timedelta(minutes=i)
+        yield Immunization(
+            card_no=f"C{i:08d}",
+            DOB=born.isoformat(),
+            contact_no=f"080{rng.randint(0, 99_999_999):08d}",
+            address=f"{rng.randint(1, 200)} Market Road",
+            caregivers_name=_name(rng),
+            name=_name(rng),
+            age=(visit - born).days // 30,
+            gender=rng.choice(GENDERS),
+            vaccine_given=[Vaccine[v] for v in given],
+            date_of_vaccination=visit,
+            clinic=rng.choice(CLINICS),
+            entered_by="bench-nurse",
+            created_at=created,
+            updated_at=created,
+        )
+
+
+def finances(count: int, seed: int) -> Iterator[Finance]:
+    rng = random.Random(f"finances-{seed}")
+    for i in range(count):
+        day = (EPOCH + timedelta(days=i // len(SOURCES))).date()
+        source = SOURCES[i % len(SOURCES)]
+        clinic = CLINICS[(i // len(SOURCES)) % len(CLINICS)]
+        created = EPOCH + timedelta(minutes=i)
+        yield Finance(
+            record_id=f"{clinic.value}_{day:%Y-%m-%d}_{source.value}_{i:06d}",
+            record_officer="bench-accountant",
+            payment_type=source.value,
+            source=[source],
+            day_total_amount=round(rng.uniform(1_000, 250_000), 2),
+            reviewed_by_doctor=rng.random() < 0.5,
+            entered_by="bench-accountant",
+            created_at=created,
+            updated_at=created,
+        )
+
+
+def bench_usernames(count: int) -> list[str]:
+    return [f"bench-user-{i:03d}" for i in range(count)]
+
+
+async def seed_users(count: int) -> list[str]:
+    """
+    creates count users with every role, all with BENCH_PASSWORD
+
+    :return: their usernames
+    """
+
+    names = bench_usernames(count)
+    existing = {
+        user.username
+        async for user in User.find({"username": {"$in": names}})
+    }
+    # one hash for all of them; bcrypt cost is what the login storm measures
+    password = create_passwd_hash(BENCH_PASSWORD)
+    missing = [
+        User(
+            username=name,
+            email=f"{name}@bench.example.com",
+            password=password,
+            role=list(Roles),
+        )
+        for name in names
+        if name not in existing
+    ]
+    if missing:
+        await User.insert_many(missing)
+    return names
+
+
+async def _insert(document, rows: Iterator) -> int:
+    inserted = 0
+    batch = []
+    for row in rows:
+        batch.append(row)
+        if len(batch) == BATCH_SIZE:
+            await document.insert_many(batch)
+            inserted += len(batch)
+            batch = []
+    if batch:
+        await document.insert_many(batch)
+        inserted += len(batch)
+    return inserted
+
+
+async def seed(scale: int, seed: int, users: int = 50) -> dict:
+    """
+    fills the initialized database unless it already holds this scale and seed
+
+    :return: what was seeded and how long it took
+    """
+
+    meta = Patient.get_motor_collection().database["bench_meta"]
+    wanted = {"_id": "seed", "scale": scale, "seed": seed}
+    await seed_users(users)
+    if await meta.find_one(wanted):
+        return {"scale": scale, "seed": seed, "seeded": False}
+
+    start = time.perf_counter()
+    for document in (Patient, Immunization, Finance):
+        await document.get_motor_collection().delete_many({})
+    counts = {
+        "patients": await _insert(Patient, patients(scale, seed)),
+        "immunizations": await _insert(Immunization, immunizations(scale, seed)),
+        "finances": await _insert(Finance, finances(scale // FINANCE_RATIO, seed)),
+    }
+    await meta.replace_one({"_id": "seed"}, wanted, upsert=True)
+    return {
+        "scale": scale,
+        "seed": seed,
+        "seeded": True,
+        "counts": counts,
+        "seconds": round(time.perf_counter() - start, 1),
+    }
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--scale", default="10k", help="10k, 100k, 1m or a row count")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--users", type=int, default=50)
+    args = parser.parse_args()
+
+    from app.database import init_db
+    from app.settings import settings
+
+    async def run():
+        await init_db(settings.DATABASE_URL)
+        print(await seed(parse_scale(args.scale), args.seed, args.users))
+
+    asyncio.run(run())
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,115 @@
+"""
+insert throughput: probe-then-insert vs insert-and-catch
+
+compares the old create path (find_one on the unique key, then insert)
+with relying on the unique index and catching DuplicateKeyError.
+A share of the rows reuse an existing key so both paths hit conflicts.
+
+usage: python -m benchmarks.insert_throughput [--rows N] [--concurrency C]
+needs a running mongo at DATABASE_URL; creates, uses and drops the scratch
+database SCRATCH_DB, and refuses to run if it already exists.
+"""
+import argparse
+import asyncio
+import json
+import time
+
+from motor.motor_asyncio import AsyncIOMotorClient
+from pymongo.errors import DuplicateKeyError
+
+from app.settings import settings
+
+# not comclic_bench, the database benchmarks.load seeds and keeps
+SCRATCH_DB = f"{settings.DB_NAME}_insert_bench"
+
+
+def make_rows(count: int, duplicate_every: int) -> list[dict]:
+    """patient-like rows; every duplicate_every-th reuses an earlier key"""
+
+    rows = []
+    for i in range(count):
+        key = i - 1 if duplicate_every and i and i % duplicate_every == 0 else i
+        rows.append({
+            "hospital_no": f"{key:08d}",
+            "name": f"Patient {i}",
+            "age": i % 90,
+            "gender": "Female" if i % 2 else "Male",
+            "complaint": "Fever",
+            "provisional_diagnosis": "Malaria",
+            "treatment": "ACT",
+            "referral": False,
+            "clinic": ["Okeila CHC"],
+        })
+    return rows
+
+
+async def probe_then_insert(collection, row: dict) -> None:
+    if await collection.find_one({"hospital_no": row["hospital_no"]}):
+        return
+    try:
+        await collection.insert_one(dict(row))
+    except DuplicateKeyError:
+        pass  # lost the race between the probe and the insert
+
+
+async def insert_and_catch(collection, row: dict) -> None:
+    try:
+        await collection.insert_one(dict(row))
+    except DuplicateKeyError:
+        pass
+
+
+async def run(strategy, collection, rows: list[dict], concurrency: int) -> dict:
+    await collection.delete_many({})
+    queue = iter(rows)
+
+    async def worker():
+        for row in queue:
+            await strategy(collection, row)
+
+    start = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    elapsed = time.perf_counter() - start
+    return {
+        "strategy": strategy.__name__,
+        "rows": len(rows),
+        "seconds": round(elapsed, 3),
+        "inserts_per_second": round(len(rows) / elapsed, 1),
+    }
+
+
+async def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--rows", type=int, default=5000)
+    parser.add_argument("--concurrency", type=int, default=32)
+    parser.add_argument("--duplicate-every", type=int, default=20)
+    args = parser.parse_args()
+
+    client = AsyncIOMotorClient(settings.DATABASE_URL)
+    if SCRATCH_DB in await client.list_database_names():
+        client.close()
+        # it is dropped afterwards, so it must be one this script created
+        parser.exit(1, f"{SCRATCH_DB} already exists, drop it or set DB_NAME\n")
+    collection = client[SCRATCH_DB]["Patient"]
+    await collection.create_index("hospital_no", unique=True)
+    rows = make_rows(args.rows, args.duplicate_every)
+    try:
+        results = [
+            await run(strategy, collection, rows, args.concurrency)
+            for strategy in (probe_then_insert, insert_and_catch)
+        ]
+    finally:
+        await client.drop_database(SCRATCH_DB)
+        client.close()
+
+    baseline, candidate = results
+    print(json.dumps({
+        "results": results,
+        "speedup": round(
+            candidate["inserts_per_second"] / baseline["inserts_per_second"], 2
+        ),
+    }, indent=2))
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,115 @@
+"""
+list endpoint throughput: response_model + stdlib json vs orjson rows
+
+serves the same page of patient rows two ways through FastAPI: the old
+path (response_model=Page, validated and walked by jsonable_encoder, then
+json.dumps) and the new one (an unvalidated Page handed to orjson by
+rows_response). Requests go through the ASGI app in process, so only the
+framework and serialization cost is measured, not mongo.
+
+usage: python -m benchmarks.list_serialization [--requests N] [--page-sizes 50,500]
+"""
+import argparse
+import asyncio
+import json
+import time
+from datetime import datetime, timedelta
+
+import httpx
+from bson import ObjectId
+from fastapi import FastAPI
+from fastapi.responses import JSONResponse as StdJSONResponse
+
+from app.pagination import Page, to_json_row
+from app.responses import JSONResponse, rows_response
+
+
+def make_rows(count: int) -> list[dict]:
+    """raw rows shaped like those paginate reads from the patients collection"""
+
+    now = datetime.utcnow()
+    return [
+        to_json_row({
+            "_id": ObjectId(),
+            "hospital_no": f"{i:08d}",
+            "name": f"Patient {i}",
+            "age": i % 90,
+            "gender": "Female" if i % 2 else "Male",
+            "complaint": "Fever and headache for three days",
+            "provisional_diagnosis": "Malaria",
+            "diagnosis_key": "malaria",
+            "treatment": "ACT",
+            "referral": False,
+            "clinic": ["OKE"],
+            "date_of_visit": now - timedelta(days=i % 30),
+            "entered_by": "doctor1",
+            "created_at": now - timedelta(minutes=i),
+            "updated_at": now - timedelta(minutes=i),
+            "revision": 0,
+            "search_keys": ["pa", "pat", "pati", "patie", "patien", "patient"],
+            "revision_id": None,
+        })
+        for i in range(count)
+    ]
+
+
+def build_app(rows: list[dict]) -> FastAPI:
+    app = FastAPI(default_response_class=JSONResponse)
+    old = FastAPI(default_response_class=StdJSONResponse)
+
+    @old.get("/page", response_model=Page)
+    async def old_page(limit: int):
+        return Page(items=rows[:limit], next_cursor="x", limit=limit)
+
+    @app.get("/page", response_model=Page)
+    async def new_page(limit: int):
+        return rows_response(
+            Page.model_construct(items=rows[:limit], next_cursor="x", limit=limit)
+        )
+
+    app.mount("/old", old)
+    return app
+
+
+async def run(client: httpx.AsyncClient, path: str, limit: int, requests: int) -> dict:
+    body = (await client.get(path, params={"limit": limit})).content  # warm up
+    start = time.perf_counter()
+    for _ in range(requests):
+        response = await client.get(path, params={"limit": limit})
+        response.raise_for_status()
+    elapsed = time.perf_counter() - start
+    return {
+        "path": path,
+        "page_size": limit,
+        "bytes": len(body),
+        "requests_per_second": round(requests / elapsed, 1),
+        "ms_per_request": round(1000 * elapsed / requests, 3),
+    }
+
+
+async def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--requests", type=int, default=500)
+    parser.add_argument("--page-sizes", default="50,500")
+    args = parser.parse_args()
+    sizes = [int(size) for size in args.page_sizes.split(",")]
+
+    app = build_app(make_rows(max(sizes)))
+    transport = httpx.ASGITransport(app=app)
+    results = []
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench") as client:
+        for size in sizes:
+            baseline = await run(client, "/old/page", size, args.requests)
+            candidate = await run(client, "/page", size, args.requests)
+            results.append({
+                "page_size": size,
+                "results": [baseline, candidate],
+                "speedup": round(
+                    candidate["requests_per_second"] / baseline["requests_per_second"], 2
+                ),
+            })
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
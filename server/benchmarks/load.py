@@ -0,0 +1,275 @@
+"""
+load test: drives the whole app in process against a seeded database
+
+boots the app with its lifespan, seeds the database with
+benchmarks.datagen (skipped when it already holds the same scale and
+seed) and runs each scenario through httpx's ASGI transport with a fixed
+number of requests in flight:
+
+- login: the login form for a rotating set of users (a bcrypt storm)
+- list: pages through patients, immunizations and finances by cursor
+- bulk_create: POST /api/patients/bulk with --bulk-size new patients
+- update: PUT /api/patients/patient on random seeded patients
+
+each scenario reports p50/p95/p99 latency, throughput and status counts,
+with the commit, scale, seed and concurrency, as json. Rows created by
+bulk_create are deleted afterwards, so back to back runs (and runs on
+different commits) see the same data; compare two reports with
+benchmarks.compare.
+
+usage: python -m benchmarks.load [--scale 10k] [--scenarios login,list,...]
+    [--requests N] [--concurrency C] [--output report.json] [--mongomock]
+
+needs a running mongo at DATABASE_URL unless --mongomock is given, which
+swaps in mongomock-motor: numbers then show the app's own cost only.
+DB_NAME defaults to comclic_bench here, never the app's database.
+"""
+import os
+
+# before the app reads its settings
+os.environ.setdefault("DB_NAME", "comclic_bench")
+os.environ.setdefault("LOG_LEVEL", "WARNING")
+
+import argparse
+import asyncio
+import json
+import platform
+import random
+import statistics
+import subprocess
+import sys
+import time
+from collections import Counter
+from datetime import datetime
+
+import httpx
+
+from benchmarks.datagen import BENCH_PASSWORD, bench_usernames, parse_scale, patient_row, seed
+
+SCENARIOS = ("login", "list", "bulk_create", "update")
+LIST_PATHS = ("/api/patients/", "/api/immunizations/", "/api/finances/")
+# bulk_create rows use this hospital_no prefix and are removed after the run
+CREATED_PREFIX = "L"
+
+
+class Context:
+    """what the scenarios share during a run"""
+
+    def __init__(self, scale: int, users: list[str], seed: int, bulk_size: int):
+        self.scale = scale
+        self.users = users
+        self.rng = random.Random(f"load-{seed}")
+        self.bulk_size = bulk_size
+        self.headers: dict[str, str] = {}
+        self.cursors: dict[str, str | None] = {path: None for path in LIST_PATHS}
+
+
+async def login(client: httpx.AsyncClient, ctx: Context, i: int) -> httpx.Response:
+    return await client.post(
+        "/api/auth/login",
+        data={"username": ctx.users[i % len(ctx.users)], "password": BENCH_PASSWORD},
+    )
+
+
+async def list_page(client: httpx.AsyncClient, ctx: Context, i: int) -> httpx.Response:
+    path = LIST_PATHS[i % len(LIST_PATHS)]
+    params = {"limit": 50}
+    if ctx.cursors[path]:
+        params["cursor"] = ctx.cursors[path]
+    response = await client.get(path, params=params, headers=ctx.headers)
+    if response.status_code == 200:
+        # walk forward through the collection, starting over at the end
+        ctx.cursors[path] = response.json().get("next_cursor")
+    return response
+
+
+async def bulk_create(client: httpx.AsyncClient, ctx: Context, i: int) -> httpx.Response:
+    rows = [
+        patient_row(ctx.rng, i * ctx.bulk_size + j, prefix=CREATED_PREFIX)
+        for j in range(ctx.bulk_size)
+    ]
+    return await client.post("/api/patients/bulk", json=rows, headers=ctx.headers)
+
+
+async def update(client: httpx.AsyncClient, ctx: Context, i: int) -> httpx.Response:
+    return await client.put(
+        "/api/patients/patient",
+        params={"hospital_no": f"H{ctx.rng.randrange(ctx.scale):08d}"},
+        json={"treatment": ctx.rng.choice(("ACT", "Amoxicillin", "Paracetamol"))},
+        headers=ctx.headers,
+    )
+
+
+SCENARIO_CALLS = {
+    "login": login,
+    "list": list_page,
+    "bulk_create": bulk_create,
+    "update": update,
+}
+
+
+def percentile(ordered: list[float], pct: float) -> float:
+    """nearest-rank percentile of sorted values"""
+
+    if not ordered:
+        return 0.0
+    rank = max(0, min(len(ordered) - 1, round(pct / 100 * len(ordered) + 0.5) - 1))
+    return ordered[rank]
+
+
+async def drive(call, client, ctx: Context, requests: int, concurrency: int, offset: int = 0) -> dict:
+    """
+    sends requests calls with at most concurrency in flight
+
+    :return: latency percentiles in ms, throughput and status counts
+    """
+
+    latencies: list[float] = []
+    statuses: Counter = Counter()
+    errors = 0
+    next_index = 0
+
+    async def worker():
+        nonlocal next_index, errors
+        while next_index < requests:
+            i = offset + next_index
+            next_index += 1
+            start = time.perf_counter()
+            try:
+                response = await call(client, ctx, i)
+            except Exception as exc:
+                errors += 1
+                statuses[type(exc).__name__] += 1
+                continue
+            latencies.append(time.perf_counter() - start)
+            statuses[str(response.status_code)] += 1
+            if response.status_code >= 400:
+                errors += 1
+
+    start = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    wall = time.perf_counter() - start
+
+    ordered = sorted(latencies)
+    ms = lambda seconds: round(seconds * 1000, 2)
+    return {
+        "requests": requests,
+        "errors": errors,
+        "seconds": round(wall, 3),
+        "throughput_rps": round(requests / wall, 1) if wall else 0.0,
+        "p50_ms": ms(percentile(ordered, 50)),
+        "p95_ms": ms(percentile(ordered, 95)),
+        "p99_ms": ms(percentile(ordered, 99)),
+        "mean_ms": ms(statistics.fmean(ordered)) if ordered else 0.0,
+        "max_ms": ms(ordered[-1]) if ordered else 0.0,
+        "statuses": dict(statuses),
+    }
+
+
+def git_revision() -> dict:
+    def git(*args: str) -> str:
+        try:
+            return subprocess.run(
+                ["git", *args], capture_output=True, text=True, check=True
+            ).stdout.strip()
+        except (OSError, subprocess.CalledProcessError):
+            return ""
+
+    return {"commit": git("rev-parse", "HEAD") or None, "dirty": bool(git("status", "--porcelain"))}
+
+
+def use_mongomock() -> None:
+    """points the app's database client at mongomock-motor"""
+
+    from mongomock_motor import AsyncMongoMockClient
+
+    import app.database
+    from app.settings import settings
+
+    # the real client's options (event listeners, pool size) don't apply
+    app.database.AsyncIOMotorClient = lambda *args, **kwargs: AsyncMongoMockClient()
+    # nor do replicas and sessions; read before app.readpref is imported
+    settings.DB_LIST_READS = settings.DB_SEARCH_READS = settings.DB_REPORT_READS = "primary"
+
+
+async def run(args: argparse.Namespace) -> dict:
+    from app.models import Patient
+    from main import app
+
+    scale = parse_scale(args.scale)
+    report = {
+        "meta": {
+            **git_revision(),
+            "started_at": datetime.utcnow().isoformat(),
+            "backend": "mongomock" if args.mongomock else "mongo",
+            "scale": scale,
+            "seed": args.seed,
+            "concurrency": args.concurrency,
+            "requests": args.requests,
+            "bulk_size": args.bulk_size,
+            "python": sys.version.split()[0],
+            "platform": platform.platform(),
+            "cpus": os.cpu_count(),
+        },
+        "scenarios": {},
+    }
+
+    async with app.router.lifespan_context(app):
+        report["meta"]["seeding"] = await seed(scale, args.seed, args.users)
+        ctx = Context(scale, bench_usernames(args.users), args.seed, args.bulk_size)
+        transport = httpx.ASGITransport(app=app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://bench") as client:
+            response = await login(client, ctx, 0)
+            response.raise_for_status()
+            ctx.headers = {"Authorization": f"Bearer {response.json()['access_token']}"}
+            try:
+                for name in args.scenarios:
+                    call = SCENARIO_CALLS[name]
+                    # warm caches and connections; not reported
+                    await drive(call, client, ctx, args.warmup, args.concurrency, offset=args.requests)
+                    report["scenarios"][name] = await drive(
+                        call, client, ctx, args.requests, args.concurrency
+                    )
+                    print(name, json.dumps(report["scenarios"][name]), file=sys.stderr)
+            finally:
+                await Patient.get_motor_collection().delete_many(
+                    {"hospital_no": {"$regex": f"^{CREATED_PREFIX}"}}
+                )
+    return report
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--scale", default="10k", help="10k, 100k, 1m or a row count")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument(
+        "--scenarios",
+        type=lambda value: value.split(","),
+        default=list(SCENARIOS),
+        help=f"comma separated, from {','.join(SCENARIOS)}",
+    )
+    parser.add_argument("--requests", type=int, default=1000, help="per scenario")
+    parser.add_argument("--warmup", type=int, default=50, help="per scenario, not reported")
+    parser.add_argument("--concurrency", type=int, default=32)
+    parser.add_argument("--users", type=int, default=50, help="accounts the login storm rotates through")
+    parser.add_argument("--bulk-size", type=int, default=100)
+    parser.add_argument("--mongomock", action="store_true", help="use mongomock-motor instead of mongo")
+    parser.add_argument("--output", help="also write the report to this file")
+    args = parser.parse_args()
+
+    unknown = set(args.scenarios) - set(SCENARIOS)
+    if unknown:
+        parser.error(f"unknown scenarios: {', '.join(sorted(unknown))}")
+    if args.mongomock:
+        use_mongomock()
+
+    report = asyncio.run(run(args))
+    output = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, "w") as file:
+            file.write(output + "\n")
+    print(output)
+
+
+if __name__ == "__main__":
+    main()
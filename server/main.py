@@ -1,10 +1,23 @@
+import asyncio
+import logging
 from contextlib import asynccontextmanager
 from fastapi import FastAPI
-from app.routers import patient, immunization, finance, auth_router
-from app.database import init_db #get_mongo_uri, db
+from app.routers import patient, immunization, finance, auth_router, codes, duplicates, search, sync
+from app.database import close_db, init_db, warm_up_db #get_mongo_uri, db
 from app.settings import settings
+from app.revocation import REVOKED_TOKENS
+from app.middlewares.authware import revalidate_cached_users_forever
+from app.utils import HASH_POOL
+from app.dedup import DEDUP_ENGINE
+from app.outbox import OUTBOX
+from app.responses import JSONResponse
+from app.middlewares.compression import add_compression
+from app.log import setup_logging
+from app.metrics import MetricsMiddleware, metrics_response
 from fastapi.middleware.cors import CORSMiddleware
 
+logger = logging.getLogger("app")
+
 ORIGINS = [
     "http://127.0.0.1:5173",
     "http://localhost:5173",
@@ -14,32 +27,67 @@ ORIGINS = [
 @asynccontextmanager
 async def lifecycle(app: FastAPI):
     """app lifecycle"""
-    # logger.info('starting app')
+    logger.info("starting app")
     await init_db(settings.DATABASE_URL)
+    await warm_up_db()
+    await REVOKED_TOKENS.load()
+    refresher = asyncio.create_task(
+        REVOKED_TOKENS.refresh_forever(settings.REVOKED_TOKENS_REFRESH)
+    )
+    revalidator = asyncio.create_task(
+        revalidate_cached_users_forever(settings.USER_CACHE_REFRESH)
+    )
+    deduper = asyncio.create_task(
+        DEDUP_ENGINE.run_forever(settings.DEDUP_INTERVAL)
+    )
+    mailer = asyncio.create_task(OUTBOX.run_forever(settings.OUTBOX_POLL_INTERVAL))
     yield
-    # logger.info('stopping app')
+    refresher.cancel()
+    revalidator.cancel()
+    deduper.cancel()
+    mailer.cancel()
+    # let them unwind before the client they use is closed
+    await asyncio.gather(refresher, revalidator, deduper, mailer, return_exceptions=True)
+    await OUTBOX.close()
+    close_db()
+    HASH_POOL.shutdown()
+    logger.info("stopping app")
 
 
 def create_app() -> FastAPI:
     """app factory function"""
-    app = FastAPI(lifespan=lifecycle)
+    setup_logging(settings.LOG_LEVEL)
+    app = FastAPI(lifespan=lifecycle, default_response_class=JSONResponse)
     app.add_middleware(
         CORSMiddleware,
         allow_origins=ORIGINS,
         allow_credentials=True,
         allow_methods=["*"],
         allow_headers=["*"],
+        # let the browser client read the conditional GET validators
+        expose_headers=["ETag", "Last-Modified", "Server-Timing", "X-Request-ID"],
     )
+    add_compression(app, settings.COMPRESS_MIN_SIZE)
+    # outermost, so timings and sizes cover everything the client waits for
+    app.add_middleware(MetricsMiddleware)
 
     app.include_router(auth_router.auth_router)
     app.include_router(patient.router)
     app.include_router(immunization.router)
     app.include_router(finance.router)
+    app.include_router(sync.router)
+    app.include_router(search.router)
+    app.include_router(duplicates.router)
+    app.include_router(codes.router)
 
     @app.get("/api")
     async def root():
         return {"message": "Welcome to the COMCLIC API!"}
 
+    @app.get("/metrics", include_in_schema=False)
+    async def metrics():
+        return metrics_response()
+
     return app
 
 app = create_app()
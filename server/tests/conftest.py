@@ -0,0 +1,91 @@
+"""
+shared fixtures
+
+the app runs in process against mongomock-motor, so no mongo server is
+needed; each test gets a fresh, empty database. Settings are read from
+the environment when app.settings is imported, so the test values are
+set before anything from the app is.
+"""
+import os
+
+TEST_ENV = {
+    "SECRET_KEY": "test-secret-key-0123456789abcdef",
+    "SMTP_USERNAME": "clinic",
+    "SMTP_PASSWORD": "clinic",
+    "FROM_EMAIL": "clinic@example.com",
+    "SMTP_USE_TLS": "False",
+    "SMTP_USE_SSL": "False",
+    "DB_NAME": "comclic_test",
+    "BCRYPT_ROUNDS": "4",
+    "LOG_LEVEL": "WARNING",
+    # mongomock has neither replicas nor sessions
+    "DB_LIST_READS": "primary",
+    "DB_SEARCH_READS": "primary",
+    "DB_REPORT_READS": "primary",
+}
+for name, value in TEST_ENV.items():
+    os.environ.setdefault(name, value)
+
+import httpx
+import pytest
+from mongomock_motor import AsyncMongoMockClient
+
+from app import database
+from app.analytics import invalidate_coverage
+from app.cache import USER_CACHE
+from app.models import Roles, User
+from app.settings import settings
+from app.utils import create_passwd_hash
+from main import app
+
+PASSWORD = "Passw0rd#"
+
+
+@pytest.fixture
+async def db(monkeypatch):
+    """a fresh in-memory database with every document initialized"""
+
+    monkeypatch.setattr(
+        database, "AsyncIOMotorClient", lambda *args, **kwargs: AsyncMongoMockClient()
+    )
+    await database.init_db(settings.DATABASE_URL)
+    USER_CACHE.clear()
+    invalidate_coverage()
+    yield database.CLIENT[settings.DB_NAME]
+    database.close_db()
+
+
+@pytest.fixture
+async def client(db):
+    """an http client for the app; the lifespan's background tasks don't run"""
+
+    transport = httpx.ASGITransport(app=app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://test") as client:
+        yield client
+
+
+@pytest.fixture
+def login(client):
+    """creates a user with the given roles and returns its auth headers"""
+
+    async def login(username: str, roles: list[Roles]) -> dict[str, str]:
+        await User(
+            username=username,
+            email=f"{username}@example.com",
+            password=create_passwd_hash(PASSWORD),
+            role=roles,
+        ).insert()
+        response = await client.post(
+            "/api/auth/login", data={"username": username, "password": PASSWORD}
+        )
+        assert response.status_code == 200, response.text
+        return {"Authorization": f"Bearer {response.json()['access_token']}"}
+
+    return login
+
+
+@pytest.fixture
+async def doctor(login):
+    """auth headers of a user holding every role"""
+
+    return await login("doctor1", list(Roles))
@@ -0,0 +1,51 @@
+"""
+request bodies for the record routes
+"""
+
+
+def patient(hospital_no: str = "H0001", **overrides) -> dict:
+    return {
+        "hospital_no": hospital_no,
+        "name": "Adebayo Okafor",
+        "age": 34,
+        "gender": "Male",
+        "reason_for_visit": None,
+        "complaint": "fever",
+        "date_of_visit": "2024-03-02",
+        "provisional_diagnosis": "Malaria",
+        "differential_diagnosis": None,
+        "investigations": None,
+        "treatment": "ACT",
+        "referral": False,
+        "clinic": ["OKE"],
+        **overrides,
+    }
+
+
+def immunization(card_no: str = "C0001", **overrides) -> dict:
+    return {
+        "card_no": card_no,
+        "DOB": "2024-01-01",
+        "contact_no": "+2348031234567",
+        "address": "12 Market Road",
+        "caregivers_name": "Ngozi Eze",
+        "name": "Chidi Eze",
+        "age": 0,
+        "gender": "Male",
+        "vaccine_given": ["BCG", "OPV0", "HBV"],
+        "date_of_vaccination": "2024-01-02",
+        "clinic": "OKE",
+        **overrides,
+    }
+
+
+def finance(record_id: str = "OKE_2024-03-02_DRF_1", **overrides) -> dict:
+    return {
+        "record_id": record_id,
+        "record_officer": "Bola",
+        "payment_type": "cash",
+        "source": ["DRF"],
+        "day_total_amount": 1500.0,
+        "reviewed_by_doctor": False,
+        **overrides,
+    }
@@ -0,0 +1,82 @@
+from datetime import datetime
+
+from app.conditional import bump_version
+from tests import payloads
+
+
+async def coverage(client, headers, **query) -> dict:
+    response = await client.get("/api/immunizations/coverage", params=query, headers=headers)
+    assert response.status_code == 200, response.text
+    return response.json()
+
+
+async def test_coverage_counts_doses_and_dropout(client, doctor):
+    await client.post(
+        "/api/immunizations/",
+        json=payloads.immunization("C1", vaccine_given=["PENTA1", "PENTA3"], date_of_vaccination="2024-03-04"),
+        headers=doctor,
+    )
+    await client.post(
+        "/api/immunizations/",
+        json=payloads.immunization("C2", gender="Female", vaccine_given=["PENTA1"], date_of_vaccination="2024-03-05"),
+        headers=doctor,
+    )
+    await client.post("/api/immunizations/", json=payloads.immunization("C3"), headers=doctor)
+
+    report = await coverage(client, doctor, **{"from": "2024-03-01"})
+    rows = sorted(report["rows"], key=lambda row: (row["vaccine"], row["gender"]))
+    assert rows == [
+        {"vaccine": "PENTA1", "clinic": "OKE", "month": "2024-03", "gender": "Female", "count": 1},
+        {"vaccine": "PENTA1", "clinic": "OKE", "month": "2024-03", "gender": "Male", "count": 1},
+        {"vaccine": "PENTA3", "clinic": "OKE", "month": "2024-03", "gender": "Male", "count": 1},
+    ]
+    assert report["dropout"]["penta1_penta3"] == {"first": 2, "last": 1, "rate": 0.5}
+    assert report["dropout"]["measles1_measles2"]["rate"] is None
+
+
+async def test_coverage_sees_writes_made_through_other_workers(client, doctor, db):
+    await client.post("/api/immunizations/", json=payloads.immunization("C1"), headers=doctor)
+    assert sum(row["count"] for row in (await coverage(client, doctor))["rows"]) == 3
+
+    # another worker's write: it clears only its own cache, but bumps the
+    # shared version
+    await db["Immunization"].insert_one({
+        **payloads.immunization("C2"),
+        "vaccine_given": ["BCG"],
+        "DOB": datetime(2024, 1, 1),
+        "date_of_vaccination": datetime(2024, 1, 2),
+    })
+    assert sum(row["count"] for row in (await coverage(client, doctor))["rows"]) == 3
+    await bump_version("immunizations")
+    assert sum(row["count"] for row in (await coverage(client, doctor))["rows"]) == 4
+
+
+async def test_surveillance_counts_visits_per_week(client, doctor):
+    visits = [
+        ("H1", "2024-03-02", "Malaria"),
+        ("H2", "2024-03-01", "malaria"),
+        ("H3", "2024-02-25", "Malaria"),
+        ("H4", "2024-03-03", "Typhoid fever"),
+        ("H5", "2024-01-01", "Malaria"),  # outside the window
+    ]
+    for hospital_no, day, diagnosis in visits:
+        await client.post(
+            "/api/patients/",
+            json=payloads.patient(hospital_no, date_of_visit=day, provisional_diagnosis=diagnosis),
+            headers=doctor,
+        )
+
+    response = await client.get("/api/patients/surveillance", params={"as_of": "2024-03-03"}, headers=doctor)
+    assert response.status_code == 200, response.text
+    rows = {row["diagnosis"]: row for row in response.json()}
+    assert rows["malaria"]["weekly_counts"] == [2, 1, 0, 0]
+    assert (rows["malaria"]["delta"], rows["malaria"]["change"]) == (1, 1.0)
+    assert rows["typhoid"]["weekly_counts"][0] == 1
+    assert rows["typhoid"]["change"] is None
+
+    response = await client.get(
+        "/api/patients/surveillance",
+        params={"as_of": "2024-03-03", "diagnosis": "MALARIA", "weeks": 2},
+        headers=doctor,
+    )
+    assert [(row["diagnosis"], row["weekly_counts"]) for row in response.json()] == [("malaria", [2, 1])]
@@ -0,0 +1,104 @@
+from tests import payloads
+
+
+async def bulk(client, headers, rows: list) -> dict:
+    response = await client.post("/api/patients/bulk", json=rows, headers=headers)
+    assert response.status_code == 200, response.text
+    return response.json()
+
+
+def statuses(result: dict) -> list[tuple]:
+    return [(row["index"], row["status"], row["key"]) for row in result["results"]]
+
+
+async def test_duplicates_within_a_batch(client, doctor, db):
+    result = await bulk(client, doctor, [payloads.patient("H1"), payloads.patient("H2"), payloads.patient("H1")])
+    assert statuses(result) == [(0, "created", "H1"), (1, "created", "H2"), (2, "duplicate", "H1")]
+    assert result["results"][2]["detail"] == "hospital_no repeats row 0"
+    assert (result["created"], result["duplicates"], result["invalid"]) == (2, 1, 0)
+    assert await db["Patient"].count_documents({"hospital_no": "H1"}) == 1
+
+
+async def test_duplicates_of_stored_records(client, doctor, db):
+    await client.post("/api/patients/", json=payloads.patient("H1"), headers=doctor)
+    result = await bulk(client, doctor, [payloads.patient("H1"), payloads.patient("H2")])
+    assert statuses(result) == [(0, "duplicate", "H1"), (1, "created", "H2")]
+    assert result["results"][0]["detail"] == "hospital_no already exists"
+    assert await db["Patient"].count_documents({}) == 2
+
+
+async def test_mixed_batch(client, doctor, db):
+    await client.post("/api/patients/", json=payloads.patient("H0"), headers=doctor)
+    rows = [
+        payloads.patient("H1"),
+        payloads.patient("H2", age="unknown"),
+        payloads.patient("H0"),
+        {"name": "Ada Obi"},
+        payloads.patient("H3"),
+        payloads.patient("H3", name="Ngozi Eze"),
+    ]
+    result = await bulk(client, doctor, rows)
+    assert statuses(result) == [
+        (0, "created", "H1"),
+        (1, "invalid", "H2"),
+        (2, "duplicate", "H0"),
+        (3, "invalid", None),
+        (4, "created", "H3"),
+        (5, "duplicate", "H3"),
+    ]
+    assert result["results"][1]["detail"][0]["loc"] == ["age"]
+    assert (result["created"], result["duplicates"], result["invalid"]) == (2, 2, 2)
+    stored = await db["Patient"].distinct("hospital_no")
+    assert sorted(stored) == ["H0", "H1", "H3"]
+    # created rows are searchable like single creates
+    response = await client.get("/api/search/", params={"q": "adebayo"}, headers=doctor)
+    assert {"H1", "H3"} <= {row["key"] for row in response.json()}
+
+
+async def test_batch_size_limit(client, doctor, monkeypatch):
+    from app import bulk as bulk_module
+
+    monkeypatch.setattr(bulk_module, "MAX_BULK_SIZE", 2)
+    rows = [payloads.patient(f"H{i}") for i in range(3)]
+    response = await client.post("/api/patients/bulk", json=rows, headers=doctor)
+    assert response.status_code == 413
+
+
+async def batch_get(client, headers, path: str, body: dict) -> dict:
+    response = await client.post(path, json=body, headers=headers)
+    assert response.status_code == 200, response.text
+    return response.json()
+
+
+async def test_batch_get_keeps_request_order_and_flags_missing_keys(client, doctor):
+    for card_no in ("C1", "C2", "C3"):
+        await client.post("/api/immunizations/", json=payloads.immunization(card_no), headers=doctor)
+
+    result = await batch_get(
+        client, doctor, "/api/immunizations/batch-get", {"keys": ["C3", "C404", "C1", "C3", "C405", "C404"]}
+    )
+    assert [(item["key"], item["found"]) for item in result["items"]] == [
+        ("C3", True), ("C404", False), ("C1", True), ("C3", True), ("C405", False), ("C404", False),
+    ]
+    assert [item["record"]["card_no"] for item in result["items"] if item["found"]] == ["C3", "C1", "C3"]
+    assert all(item["record"] is None for item in result["items"] if not item["found"])
+    # each missing key once, in request order
+    assert result["missing"] == ["C404", "C405"]
+
+
+async def test_batch_get_fields(client, doctor):
+    await client.post("/api/patients/", json=payloads.patient("H1"), headers=doctor)
+    result = await batch_get(client, doctor, "/api/patients/batch-get", {"keys": ["H1"], "fields": "name"})
+    record = result["items"][0]["record"]
+    assert (record["hospital_no"], record["name"]) == ("H1", "Adebayo Okafor")
+    assert "complaint" not in record
+
+
+async def test_batch_get_size_limit(client, doctor, monkeypatch):
+    from app import bulk as bulk_module
+
+    monkeypatch.setattr(bulk_module, "MAX_BATCH_GET_SIZE", 2)
+    response = await client.post("/api/patients/batch-get", json={"keys": ["H1", "H2"]}, headers=doctor)
+    assert response.status_code == 200
+    response = await client.post("/api/patients/batch-get", json={"keys": ["H1", "H2", "H3"]}, headers=doctor)
+    assert response.status_code == 413
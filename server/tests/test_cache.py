@@ -0,0 +1,68 @@
+from app.cache import TTLCache
+
+
+class Clock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self) -> float:
+        return self.now
+
+
+def test_entries_expire():
+    clock = Clock()
+    cache = TTLCache(maxsize=10, ttl=5, timer=clock)
+    cache.set("a", 1)
+    assert cache.get("a") == 1
+    clock.now = 5
+    assert cache.get("a") is None
+    assert (cache.hits, cache.misses) == (1, 1)
+
+
+def test_least_recently_used_is_evicted():
+    cache = TTLCache(maxsize=2, ttl=60)
+    cache.set("a", 1)
+    cache.set("b", 2)
+    cache.get("a")
+    cache.set("c", 3)
+    assert cache.get("b") is None
+    assert cache.get("a") == 1 and cache.get("c") == 3
+
+
+def test_discard_where():
+    cache = TTLCache(maxsize=10, ttl=60)
+    cache.set("a", {"user": "ada"})
+    cache.set("b", {"user": "obi"})
+    assert cache.discard_where(lambda value: value["user"] == "ada") == 1
+    assert len(cache) == 1
+
+
+async def test_role_change_in_this_worker_takes_effect_at_once(client, login):
+    from app.models import Roles, User
+
+    headers = await login("ada", [Roles.DR])
+    assert (await client.get("/api/patients/", headers=headers)).status_code == 200
+    user = await User.find_one(User.username == "ada")
+    await user.set({User.role: [Roles.NR]})
+    assert (await client.get("/api/patients/", headers=headers)).status_code == 403
+
+
+async def test_role_change_elsewhere_takes_effect_on_revalidation(client, login, db):
+    from app.middlewares.authware import revalidate_cached_users
+    from app.models import Roles
+
+    doctor = await login("ada", [Roles.DR])
+    nurse = await login("obi", [Roles.NR])
+    assert (await client.get("/api/patients/", headers=doctor)).status_code == 200
+    assert (await client.get("/api/search/", params={"q": "ada"}, headers=nurse)).status_code == 200
+
+    # as another worker or an admin would: no hook runs in this one
+    await db["users"].update_one({"username": "ada"}, {"$set": {"role": ["Nurse"]}})
+    await db["users"].delete_one({"username": "obi"})
+    assert (await client.get("/api/patients/", headers=doctor)).status_code == 200
+
+    assert await revalidate_cached_users() == 2
+    assert (await client.get("/api/patients/", headers=doctor)).status_code == 403
+    assert (await client.get("/api/search/", params={"q": "ada"}, headers=nurse)).status_code == 401
+    # unchanged users stay cached
+    assert await revalidate_cached_users() == 0
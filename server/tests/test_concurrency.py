@@ -0,0 +1,192 @@
+import pytest
+from bson import ObjectId
+from fastapi import HTTPException
+
+from app.concurrency import DERIVED_WRITE_ATTEMPTS, etag, parse_if_match, with_revision
+from app.models import Immunization
+from app.routers.immunization import KEY_INPUTS, SCHEDULE_INPUTS
+from tests import payloads
+
+
+RECORD_ID = ObjectId("65e2f0c1a4b5c6d7e8f90123")
+
+
+def test_etag():
+    assert etag(RECORD_ID, 3) == f'"{RECORD_ID}-3"'
+    assert etag(RECORD_ID, None) == f'"{RECORD_ID}-0"'
+
+
+@pytest.mark.parametrize(
+    "header, expected",
+    [
+        (None, None),
+        ("*", None),
+        (f'"{RECORD_ID}-3"', (RECORD_ID, 3)),
+        (f'W/"{RECORD_ID}-3"', (RECORD_ID, 3)),
+        # ETags sent before they named the record
+        ('"3"', (None, 3)),
+        ("4", (None, 4)),
+    ],
+)
+def test_parse_if_match(header, expected):
+    assert parse_if_match(header) == expected
+
+
+@pytest.mark.parametrize("header", ['"three"', '"nope-3"', f'"{RECORD_ID}-x"'])
+def test_parse_if_match_rejects_garbage(header):
+    with pytest.raises(HTTPException) as raised:
+        parse_if_match(header)
+    assert raised.value.status_code == 400
+
+
+def test_with_revision():
+    query = {"hospital_no": "H1"}
+    assert with_revision(query, None) is query
+    assert with_revision(query, f'"{RECORD_ID}-2"') == {"hospital_no": "H1", "_id": RECORD_ID, "revision": 2}
+    assert with_revision(query, '"2"') == {"hospital_no": "H1", "revision": 2}
+    # records written before revisions existed have none stored
+    assert with_revision(query, '"0"') == {"hospital_no": "H1", "revision": {"$in": [0, None]}}
+
+
+async def test_update_checks_if_match(client, doctor):
+    await client.post("/api/patients/", json=payloads.patient("H1"), headers=doctor)
+    response = await client.get("/api/patients/patient", params={"hospital_no": "H1"}, headers=doctor)
+    tag = response.headers["ETag"]
+    record_id = response.json()["_id"]
+    assert tag == f'"{record_id}-0"'
+
+    path = "/api/patients/patient"
+    response = await client.put(
+        path, params={"hospital_no": "H1"}, json={"treatment": "Amoxicillin"},
+        headers={**doctor, "If-Match": tag},
+    )
+    assert response.status_code == 200
+    assert response.headers["ETag"] == f'"{record_id}-1"'
+    assert response.json()["treatment"] == "Amoxicillin"
+
+    # the same, now stale, revision again
+    response = await client.put(
+        path, params={"hospital_no": "H1"}, json={"treatment": "ACT"},
+        headers={**doctor, "If-Match": tag},
+    )
+    assert response.status_code == 412
+
+    response = await client.put(
+        path, params={"hospital_no": "H404"}, json={"treatment": "ACT"},
+        headers={**doctor, "If-Match": tag},
+    )
+    assert response.status_code == 404
+
+
+async def test_delete_checks_if_match(client, doctor):
+    await client.post("/api/patients/", json=payloads.patient("H1"), headers=doctor)
+    response = await client.delete(
+        "/api/patients/H1", params={"hospital_no": "H1"}, headers={**doctor, "If-Match": '"5"'}
+    )
+    assert response.status_code == 412
+    response = await client.delete(
+        "/api/patients/H1", params={"hospital_no": "H1"}, headers={**doctor, "If-Match": '"0"'}
+    )
+    assert response.status_code == 204
+
+
+async def test_rename_rekeys_in_the_same_write(client, doctor, db):
+    await client.post("/api/patients/", json=payloads.patient("H1"), headers=doctor)
+    response = await client.put(
+        "/api/patients/patient", params={"hospital_no": "H1"},
+        json={"name": "Ngozi Eze", "gender": "Female"}, headers={**doctor, "If-Match": '"0"'},
+    )
+    assert response.status_code == 200
+    stored = await db["Patient"].find_one({"hospital_no": "H1"})
+    assert "ngozi" in stored["search_keys"] and "adebayo" not in stored["search_keys"]
+    assert stored["dedup_block"].endswith(":F")
+    assert stored["revision"] == 1
+
+    response = await client.put(
+        "/api/patients/patient", params={"hospital_no": "H1"},
+        json={"name": "Ada Eze"}, headers={**doctor, "If-Match": '"0"'},
+    )
+    assert response.status_code == 412
+
+
+async def test_a_recreated_record_has_a_new_etag(client, doctor):
+    path, params = "/api/patients/patient", {"hospital_no": "H1"}
+    await client.post("/api/patients/", json=payloads.patient("H1"), headers=doctor)
+    old_tag = (await client.get(path, params=params, headers=doctor)).headers["ETag"]
+    await client.delete("/api/patients/H1", params=params, headers=doctor)
+    await client.post("/api/patients/", json=payloads.patient("H1", complaint="cough"), headers=doctor)
+
+    response = await client.get(path, params=params, headers={**doctor, "If-None-Match": old_tag})
+    assert response.status_code == 200
+    assert response.json()["complaint"] == "cough"
+    assert response.headers["ETag"] != old_tag
+    response = await client.put(
+        path, params=params, json={"treatment": "ACT"}, headers={**doctor, "If-Match": old_tag}
+    )
+    assert response.status_code == 412
+
+
+def watch_reads(monkeypatch, document, race: bool = False) -> list:
+    """
+    records the raw reads of a collection; with race, another writer bumps
+    the record's revision after each one
+    """
+
+    collection = document.get_motor_collection()
+    find_one, reads = collection.find_one, []
+
+    async def spy(*args, **kwargs):
+        reads.append(args or kwargs)
+        row = await find_one(*args, **kwargs)
+        if race and row is not None:
+            await collection.update_one({"_id": row["_id"]}, {"$inc": {"revision": 1}})
+        return row
+
+    monkeypatch.setattr(collection, "find_one", spy)
+    return reads
+
+
+async def test_derived_write_reads_only_missing_inputs(client, doctor, db, monkeypatch):
+    path, params = "/api/immunizations/C1", {"card_no": "C1"}
+    await client.post("/api/immunizations/", json=payloads.immunization("C1"), headers=doctor)
+    reads = watch_reads(monkeypatch, Immunization)
+
+    # every input sent: derived from the request, one write
+    inputs = {
+        key: value for key, value in payloads.immunization("C1", name="Tunde Bello").items()
+        if key in SCHEDULE_INPUTS | KEY_INPUTS
+    }
+    response = await client.put(path, params=params, json=inputs, headers=doctor)
+    assert response.status_code == 200, response.text
+    assert reads == []
+    stored = await db["Immunization"].find_one({"card_no": "C1"})
+    assert "tunde" in stored["search_keys"] and "chidi" not in stored["search_keys"]
+    assert stored["next_vaccine"] == "PENTA1"
+
+    # only some: the rest are read first
+    response = await client.put(
+        path, params=params, json={"vaccine_given": ["BCG", "OPV0", "HBV", "PENTA1"]}, headers=doctor
+    )
+    assert response.status_code == 200
+    assert len(reads) == 1
+    assert response.json()["next_vaccine"] == "PENTA2"
+    stored = await db["Immunization"].find_one({"card_no": "C1"})
+    assert "tunde" in stored["search_keys"] and stored["revision"] == 2
+
+
+async def test_derived_write_that_keeps_losing_is_a_conflict(client, doctor, monkeypatch):
+    path, params = "/api/immunizations/C1", {"card_no": "C1"}
+    await client.post("/api/immunizations/", json=payloads.immunization("C1"), headers=doctor)
+    tag = (await client.get(path, params=params, headers=doctor)).headers["ETag"]
+    reads = watch_reads(monkeypatch, Immunization, race=True)
+
+    # the revision the client sent was overtaken
+    response = await client.put(path, params=params, json={"name": "Ada Eze"}, headers={**doctor, "If-Match": tag})
+    assert response.status_code == 412
+    assert len(reads) == 1
+
+    # no precondition of the client's failed, other writers kept winning
+    reads.clear()
+    response = await client.put(path, params=params, json={"name": "Ada Eze"}, headers=doctor)
+    assert response.status_code == 409
+    assert len(reads) == DERIVED_WRITE_ATTEMPTS
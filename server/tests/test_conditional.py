@@ -0,0 +1,80 @@
+from email.utils import format_datetime
+from datetime import datetime, timedelta, timezone
+
+from app.middlewares.compression import BrotliMiddleware
+from tests import payloads
+
+RECORD = "/api/patients/patient"
+
+
+async def test_record_not_modified_until_it_changes(client, doctor):
+    params = {"hospital_no": "H1"}
+    await client.post("/api/patients/", json=payloads.patient("H1"), headers=doctor)
+    response = await client.get(RECORD, params=params, headers=doctor)
+    tag = response.headers["ETag"]
+    assert response.headers["Cache-Control"] == "private, no-cache"
+
+    response = await client.get(RECORD, params=params, headers={**doctor, "If-None-Match": tag})
+    assert response.status_code == 304
+    assert response.headers["ETag"] == tag
+    assert not response.content
+    # compared weakly, and within a list of tags
+    response = await client.get(
+        RECORD, params=params, headers={**doctor, "If-None-Match": f'"other", W/{tag}'}
+    )
+    assert response.status_code == 304
+
+    await client.put(RECORD, params=params, json={"treatment": "Amoxicillin"}, headers=doctor)
+    response = await client.get(RECORD, params=params, headers={**doctor, "If-None-Match": tag})
+    assert response.status_code == 200
+    assert response.json()["treatment"] == "Amoxicillin"
+
+
+async def test_record_if_modified_since(client, doctor):
+    params = {"hospital_no": "H1"}
+    await client.post("/api/patients/", json=payloads.patient("H1"), headers=doctor)
+    last_modified = (await client.get(RECORD, params=params, headers=doctor)).headers["Last-Modified"]
+
+    response = await client.get(RECORD, params=params, headers={**doctor, "If-Modified-Since": last_modified})
+    assert response.status_code == 304
+    earlier = format_datetime(datetime.now(timezone.utc) - timedelta(days=1), usegmt=True)
+    response = await client.get(RECORD, params=params, headers={**doctor, "If-Modified-Since": earlier})
+    assert response.status_code == 200
+
+
+async def test_list_not_modified_until_a_write(client, doctor):
+    await client.post("/api/immunizations/", json=payloads.immunization("C1"), headers=doctor)
+    response = await client.get("/api/immunizations/", headers=doctor)
+    tag = response.headers["ETag"]
+    assert tag.startswith('W/"')
+
+    response = await client.get("/api/immunizations/", headers={**doctor, "If-None-Match": tag})
+    assert response.status_code == 304
+    # another query is another resource
+    response = await client.get(
+        "/api/immunizations/", params={"limit": 5}, headers={**doctor, "If-None-Match": tag}
+    )
+    assert response.status_code == 200
+
+    await client.post("/api/immunizations/", json=payloads.immunization("C2"), headers=doctor)
+    response = await client.get("/api/immunizations/", headers={**doctor, "If-None-Match": tag})
+    assert response.status_code == 200
+    assert len(response.json()["items"]) == 2
+
+
+async def test_large_responses_are_compressed(client, doctor):
+    for i in range(20):
+        await client.post("/api/patients/", json=payloads.patient(f"H{i}"), headers=doctor)
+
+    # brotli only when its optional package is installed
+    for accepted in ("br", "gzip") if BrotliMiddleware is not None else ("gzip",):
+        response = await client.get("/api/patients/", headers={**doctor, "Accept-Encoding": accepted})
+        assert response.headers["Content-Encoding"] == accepted
+        assert len(response.json()["items"]) == 20
+
+    response = await client.get("/api/patients/", headers={**doctor, "Accept-Encoding": "identity"})
+    assert "Content-Encoding" not in response.headers
+
+    # small responses aren't worth it
+    response = await client.get(RECORD, params={"hospital_no": "H1"}, headers={**doctor, "Accept-Encoding": "gzip"})
+    assert "Content-Encoding" not in response.headers
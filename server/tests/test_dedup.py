@@ -0,0 +1,62 @@
+from datetime import datetime, timedelta
+
+from app.dedup import SWEEP_LEASE, DedupEngine, acquire_lease
+from app.models import Roles
+from tests import payloads
+
+
+async def test_create_reports_and_stores_suspected_duplicates(client, doctor, db):
+    await client.post("/api/patients/", json=payloads.patient("H1"), headers=doctor)
+    response = await client.post(
+        "/api/patients/", json=payloads.patient("H2", name="Adebayo Okafur"), headers=doctor
+    )
+    assert response.status_code == 201, response.text
+    assert response.headers["X-Possible-Duplicates"] == "H1"
+    pairs = await db["duplicate_candidates"].find({}, {"_id": 0, "key_a": 1, "key_b": 1, "status": 1}).to_list(None)
+    assert pairs == [{"key_a": "H1", "key_b": "H2", "status": "open"}]
+
+
+async def test_confirm_and_dismiss(client, doctor, login):
+    for card_no in ("C1", "C2", "C3"):
+        await client.post("/api/immunizations/", json=payloads.immunization(card_no), headers=doctor)
+    open_pairs = (await client.get("/api/duplicates/", headers=doctor)).json()
+    assert len(open_pairs) == 3
+
+    confirmed, dismissed = open_pairs[0]["_id"], open_pairs[1]["_id"]
+    response = await client.post(f"/api/duplicates/{confirmed}/confirm", headers=doctor)
+    assert response.json()["status"] == "confirmed"
+    await client.post(f"/api/duplicates/{dismissed}/dismiss", headers=doctor)
+
+    assert len((await client.get("/api/duplicates/", headers=doctor)).json()) == 1
+    listed = (await client.get("/api/duplicates/", params={"status": "confirmed"}, headers=doctor)).json()
+    assert [pair["_id"] for pair in listed] == [confirmed]
+
+    accountant = await login("accountant1", [Roles.AC])
+    response = await client.post(f"/api/duplicates/{confirmed}/confirm", headers=accountant)
+    assert response.status_code == 404
+
+
+async def test_only_the_lease_holder_sweeps(db):
+    first, second = DedupEngine(), DedupEngine()
+    assert await first.sweep_if_leader(60) == 0
+    assert await second.sweep_if_leader(60) is None
+    # the holder renews its own lease
+    assert await first.sweep_if_leader(60) == 0
+
+    await db["leases"].update_one(
+        {"name": SWEEP_LEASE}, {"$set": {"expires_at": datetime.utcnow() - timedelta(seconds=1)}}
+    )
+    assert await second.sweep_if_leader(60) == 0
+    assert await first.sweep_if_leader(60) is None
+
+
+async def test_new_holder_resumes_from_the_last_sweep(client, doctor, db):
+    first, second = DedupEngine(), DedupEngine()
+    await first.sweep_if_leader(60)
+    await client.post("/api/patients/", json=payloads.patient("H1"), headers=doctor)
+    await db["leases"].update_one(
+        {"name": SWEEP_LEASE}, {"$set": {"expires_at": datetime.utcnow()}}
+    )
+    assert await second.sweep_if_leader(60) == 1
+    lease = await acquire_lease(SWEEP_LEASE, second.holder, timedelta(seconds=60))
+    assert lease["holder"] == second.holder
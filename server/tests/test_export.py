@@ -0,0 +1,65 @@
+import csv
+import gzip
+import io
+import json
+
+from tests import payloads
+
+INTERNAL = {"revision", "revision_id", "search_keys", "dedup_block"}
+
+
+async def seed(client, headers, count: int = 30):
+    for i in range(count):
+        response = await client.post(
+            "/api/patients/", json=payloads.patient(f"H{i:04d}", name=f"Export{i} Patient"), headers=headers
+        )
+        assert response.status_code == 201
+
+
+async def test_ndjson_export_leaves_out_internal_fields(client, doctor):
+    await seed(client, doctor, 3)
+    response = await client.get("/api/patients/export", headers={**doctor, "Accept-Encoding": "identity"})
+    assert response.status_code == 200
+    rows = [json.loads(line) for line in response.text.splitlines()]
+    assert len(rows) == 3
+    assert not INTERNAL & set(rows[0])
+    assert rows[0]["date_of_visit"] == "2024-03-02"
+
+
+async def test_csv_export_columns(client, doctor):
+    await seed(client, doctor, 1)
+    response = await client.get("/api/patients/export", params={"format": "csv"}, headers=doctor)
+    header = next(csv.reader(io.StringIO(response.text)))
+    assert header[:2] == ["_id", "created_at"]
+    assert not INTERNAL & set(header)
+
+
+async def test_gzip_download_is_compressed_once(client, doctor):
+    await seed(client, doctor)
+    response = await client.get(
+        "/api/patients/export", params={"gzip": "true"}, headers={**doctor, "Accept-Encoding": "gzip, br"}
+    )
+    assert response.headers["content-type"] == "application/gzip"
+    assert "content-encoding" not in response.headers
+    assert "patients.ndjson.gz" in response.headers["content-disposition"]
+    lines = gzip.decompress(response.content).decode().splitlines()
+    assert len(lines) == 30
+
+
+async def test_plain_export_is_content_encoded_when_accepted(client, doctor):
+    await seed(client, doctor)
+    response = await client.get("/api/patients/export", headers={**doctor, "Accept-Encoding": "gzip, br"})
+    assert response.headers["content-encoding"] == "gzip"
+    # httpx has undone the content encoding
+    assert len(response.text.splitlines()) == 30
+
+
+async def test_export_honours_refused_encodings(client, doctor):
+    await seed(client, doctor)
+    for refused in ("gzip;q=0", "br, gzip;q=0", "*;q=0", "identity"):
+        response = await client.get("/api/patients/export", headers={**doctor, "Accept-Encoding": refused})
+        assert "content-encoding" not in response.headers, refused
+        assert len(response.text.splitlines()) == 30
+    for accepted in ("gzip;q=0.5", "br;q=1, GZIP ; q=0.1", "*"):
+        response = await client.get("/api/patients/export", headers={**doctor, "Accept-Encoding": accepted})
+        assert response.headers["content-encoding"] == "gzip", accepted
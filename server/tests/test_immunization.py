@@ -0,0 +1,45 @@
+from tests import payloads
+
+
+async def test_update_stores_the_next_dose_with_its_inputs(client, doctor, db):
+    await client.post("/api/immunizations/", json=payloads.immunization("C1"), headers=doctor)
+    stored = await db["Immunization"].find_one({"card_no": "C1"})
+    assert stored["next_vaccine"] == "PENTA1"
+
+    response = await client.put(
+        "/api/immunizations/C1",
+        params={"card_no": "C1"},
+        json={"vaccine_given": ["BCG", "OPV0", "HBV", "PENTA1"], "date_of_vaccination": "2024-02-12"},
+        headers={**doctor, "If-Match": '"0"'},
+    )
+    assert response.status_code == 200, response.text
+    assert response.headers["ETag"] == f'"{response.json()["_id"]}-1"'
+    assert (response.json()["next_vaccine"], response.json()["next_due_date"]) == ("PENTA2", "2024-03-11")
+
+    stored = await db["Immunization"].find_one({"card_no": "C1"})
+    assert stored["next_vaccine"] == "PENTA2"
+    assert stored["revision"] == 1
+
+
+async def test_schedule_update_checks_if_match(client, doctor):
+    await client.post("/api/immunizations/", json=payloads.immunization("C1"), headers=doctor)
+    path, params = "/api/immunizations/C1", {"card_no": "C1"}
+    body = {"DOB": "2023-12-01"}
+    response = await client.put(path, params=params, json=body, headers={**doctor, "If-Match": '"3"'})
+    assert response.status_code == 412
+    response = await client.put(path, params={"card_no": "C404"}, json=body, headers=doctor)
+    assert response.status_code == 404
+    response = await client.put(path, params=params, json=body, headers=doctor)
+    assert response.status_code == 200
+
+
+async def test_defaulters_send_dates_like_the_other_routes(client, doctor):
+    await client.post("/api/immunizations/", json=payloads.immunization("C1"), headers=doctor)
+    response = await client.get(
+        "/api/immunizations/defaulters", params={"as_of": "2024-04-01"}, headers=doctor
+    )
+    assert response.status_code == 200, response.text
+    [row] = response.json()["items"]
+    assert (row["card_no"], row["next_vaccine"]) == ("C1", "PENTA1")
+    assert (row["DOB"], row["date_of_vaccination"], row["next_due_date"]) == ("2024-01-01", "2024-01-02", "2024-02-12")
+    assert row["days_overdue"] == 49
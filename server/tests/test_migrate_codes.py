@@ -0,0 +1,51 @@
+from datetime import datetime
+
+from app.codes import LABELS
+from app.conditional import collection_version
+from app.migrate_codes import migrate
+from app.models import Finance, Immunization, Patient
+
+OLD = datetime(2024, 1, 1)
+VACCINES = LABELS["Vaccine"]
+
+
+async def test_rewrites_labels_as_codes_once(db):
+    await db["Immunization"].insert_many([
+        {
+            "card_no": "C1",
+            "clinic": "Okeila CHC",
+            "vaccine_given": [VACCINES["BCG"], VACCINES["OPV0"], "HBV"],
+            "next_vaccine": VACCINES["PENTA1"],
+            "updated_at": OLD,
+        },
+        # already migrated
+        {"card_no": "C2", "clinic": "IGB", "vaccine_given": ["BCG"], "next_vaccine": "OPV0", "updated_at": OLD},
+    ])
+    await db["Patient"].insert_one(
+        {"hospital_no": "H1", "clinic": ["Igbemo CHC", "STF"], "updated_at": OLD}
+    )
+    await db["Finance"].insert_one(
+        {"record_id": "OKE_2024-03-02_DRF_1", "source": ["Drug Revolving Fund"], "updated_at": OLD}
+    )
+
+    assert await migrate(Immunization, dry_run=True) == 1
+    assert (await db["Immunization"].find_one({"card_no": "C1"}))["clinic"] == "Okeila CHC"
+
+    assert await migrate(Immunization, batch_size=1) == 1
+    assert await migrate(Patient) == 1
+    assert await migrate(Finance) == 1
+
+    card = await db["Immunization"].find_one({"card_no": "C1"})
+    assert (card["clinic"], card["vaccine_given"], card["next_vaccine"]) == ("OKE", ["BCG", "OPV0", "HBV"], "PENTA1")
+    assert card["updated_at"] > OLD
+    assert (await db["Immunization"].find_one({"card_no": "C2"}))["updated_at"] == OLD
+    assert (await db["Patient"].find_one({"hospital_no": "H1"}))["clinic"] == ["IGB", "STF"]
+    assert (await db["Finance"].find_one({}))["source"] == ["DRF"]
+    versions = [await collection_version(name) for name in ("immunizations", "patients", "finances")]
+    assert versions == [1, 1, 1]
+
+    # a second run finds nothing and touches nothing
+    for document in (Immunization, Patient, Finance):
+        assert await migrate(document) == 0
+    assert (await db["Immunization"].find_one({"card_no": "C1"}))["updated_at"] == card["updated_at"]
+    assert [await collection_version(name) for name in ("immunizations", "patients", "finances")] == versions
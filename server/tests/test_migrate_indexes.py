@@ -0,0 +1,46 @@
+from app.migrate_indexes import migrate, resolve_duplicates
+
+
+async def test_drops_text_and_retired_indexes_once(db):
+    users = db["users"]
+    await users.create_index([("username", "text")], unique=True)
+    await users.create_index("reset_token", name="reset_token_1")
+    await db["Patient"].create_index([("name", "text")])
+
+    assert await migrate(db, dry_run=True) == {
+        "users": ["username_text", "reset_token_1"],
+        "Patient": ["name_text"],
+    }
+    assert "username_text" in await users.index_information()
+
+    await migrate(db)
+    assert not {"username_text", "reset_token_1"} & set(await users.index_information())
+    assert await migrate(db) == {}
+
+
+async def test_renames_duplicate_keys_so_unique_indexes_build(db):
+    patients, users = db["Patient"], db["users"]
+    # as stored while the unique indexes were missing
+    await patients.drop_index("hospital_no_1")
+    await users.drop_index("email_1")
+    first = (await patients.insert_one({"hospital_no": "H1", "name": "Ada", "revision": 0})).inserted_id
+    second = (await patients.insert_one({"hospital_no": "H1", "name": "Obi", "revision": 0})).inserted_id
+    await patients.insert_one({"hospital_no": "H2", "name": "Eze", "revision": 0})
+    await users.insert_one({"username": "ada", "email": "ada@example.com"})
+    clone = (await users.insert_one({"username": "ada2", "email": "ada@example.com"})).inserted_id
+
+    expected = {
+        "Patient.hospital_no": [f"H1~dup-{second}"],
+        "users.email": [f"ada+dup-{clone}@example.com"],
+    }
+    assert await resolve_duplicates(db, dry_run=True) == expected
+    assert await patients.count_documents({"hospital_no": "H1"}) == 2
+
+    assert await resolve_duplicates(db) == expected
+    assert (await patients.find_one({"_id": first}))["hospital_no"] == "H1"
+    renamed = await patients.find_one({"_id": second})
+    assert (renamed["hospital_no"], renamed["revision"]) == (f"H1~dup-{second}", 1)
+    assert (await db["collection_versions"].find_one({"collection": "patients"}))["version"] == 1
+    await patients.create_index("hospital_no", unique=True)
+    await users.create_index("email", unique=True)
+    assert await resolve_duplicates(db) == {}
@@ -0,0 +1,107 @@
+import socket
+from datetime import datetime, timedelta
+
+import pytest
+from aiosmtpd.controller import Controller
+
+from app.models import OutboxEmail
+from app.outbox import OutboxDispatcher, enqueue_email
+from app.settings import settings
+
+
+class Handler:
+    """accepts mail, except to defer@ (451) and reject@ (550) addresses"""
+
+    def __init__(self):
+        self.received = []
+
+    async def handle_DATA(self, server, session, envelope):
+        recipient = envelope.rcpt_tos[0]
+        if recipient.startswith("defer@"):
+            return "451 Try again later"
+        if recipient.startswith("reject@"):
+            return "550 No such user"
+        self.received.append(envelope)
+        return "250 Message accepted for delivery"
+
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+@pytest.fixture
+def smtp(monkeypatch):
+    """a local smtp server the dispatcher is pointed at"""
+
+    handler = Handler()
+    controller = Controller(handler, hostname="127.0.0.1", port=free_port())
+    controller.start()
+    monkeypatch.setattr(settings, "SMTP_HOST", controller.hostname)
+    monkeypatch.setattr(settings, "SMTP_PORT", controller.port)
+    monkeypatch.setattr(settings, "SMTP_USE_SSL", False)
+    monkeypatch.setattr(settings, "SMTP_USE_TLS", False)
+    yield handler
+    controller.stop()
+
+
+@pytest.fixture
+async def dispatcher(db, smtp):
+    dispatcher = OutboxDispatcher()
+    yield dispatcher
+    await dispatcher.close()
+
+
+async def test_delivers_pending_mail(dispatcher, smtp):
+    for i in range(3):
+        await enqueue_email(f"Reset {i}", f"user{i}@example.com", "your code")
+
+    assert await dispatcher.dispatch() == 3
+    assert sorted(envelope.rcpt_tos[0] for envelope in smtp.received) == [
+        "user0@example.com", "user1@example.com", "user2@example.com"
+    ]
+    stored = await OutboxEmail.find_all().to_list()
+    assert {email.status for email in stored} == {"sent"}
+    assert all(email.attempts == 1 and email.sent_at for email in stored)
+    # nothing is left to claim
+    assert await dispatcher.dispatch() == 0
+
+
+async def test_transient_failure_is_retried(dispatcher, smtp):
+    email = await enqueue_email("Reset", "defer@example.com", "your code")
+
+    assert await dispatcher.dispatch() == 1
+    email = await OutboxEmail.get(email.id)
+    assert (email.status, email.attempts) == ("pending", 1)
+    assert email.last_error.startswith("SMTPDataError")
+    assert email.next_attempt_at > datetime.utcnow()
+    # not due again until its backoff has passed
+    assert await dispatcher.dispatch() == 0
+
+    await email.set({"next_attempt_at": datetime.utcnow() - timedelta(seconds=1)})
+    assert await dispatcher.dispatch() == 1
+    assert (await OutboxEmail.get(email.id)).attempts == 2
+    assert dispatcher.failed == 0
+
+
+async def test_permanent_failure_is_not_retried(dispatcher, smtp):
+    rejected = await enqueue_email("Reset", "reject@example.com", "your code")
+    delivered = await enqueue_email("Reset", "user@example.com", "your code")
+
+    assert await dispatcher.dispatch() == 2
+    rejected = await OutboxEmail.get(rejected.id)
+    assert (rejected.status, rejected.attempts) == ("failed", 1)
+    assert (await OutboxEmail.get(delivered.id)).status == "sent"
+    assert (dispatcher.sent, dispatcher.failed) == (1, 1)
+
+
+async def test_claim_skips_mail_claimed_by_another_dispatcher(dispatcher):
+    for i in range(3):
+        await enqueue_email("Reset", f"user{i}@example.com", "your code")
+
+    first = await dispatcher.claim(2)
+    second = await OutboxDispatcher().claim(2)
+    assert len(first) == 2 and len(second) == 1
+    assert {email.id for email in first}.isdisjoint(email.id for email in second)
+    assert len({email.claim_token for email in first}) == 1
@@ -0,0 +1,154 @@
+import json
+from datetime import date, datetime
+
+import pytest
+from bson import ObjectId
+from fastapi import HTTPException
+
+from app.models import Clinic, Patient
+from app.pagination import (
+    ListParams,
+    as_datetime,
+    build_filters,
+    build_projection,
+    decode_cursor,
+    encode_cursor,
+)
+from tests import payloads
+
+
+def params(**overrides) -> ListParams:
+    values = dict(
+        cursor=None, limit=50, fields=None, clinic=None,
+        date_from=None, date_to=None, entered_by=None,
+    )
+    return ListParams(**{**values, **overrides})
+
+
+def test_cursor_round_trip():
+    created_at, _id = datetime(2024, 3, 2, 10, 30, 5, 123000), ObjectId()
+    cursor = encode_cursor(created_at, _id)
+    assert "=" not in cursor
+    assert decode_cursor(cursor) == (created_at, _id)
+
+
+@pytest.mark.parametrize("cursor", ["", "not-a-cursor", encode_cursor(datetime(2024, 1, 1), ObjectId())[:-4]])
+def test_bad_cursor_is_a_400(cursor):
+    with pytest.raises(HTTPException) as raised:
+        decode_cursor(cursor)
+    assert raised.value.status_code == 400
+
+
+def test_build_filters():
+    query = build_filters(
+        params(clinic=Clinic("OKE"), entered_by="ada", date_from=date(2024, 1, 1), date_to=date(2024, 1, 31)),
+        "date_of_visit",
+        clinic_field="clinic",
+    )
+    assert query == {
+        "clinic": "OKE",
+        "entered_by": "ada",
+        "date_of_visit": {
+            "$gte": datetime(2024, 1, 1),
+            "$lte": as_datetime(date(2024, 1, 31), end=True),
+        },
+    }
+
+
+def test_clinic_filter_needs_a_clinic_field():
+    with pytest.raises(HTTPException) as raised:
+        build_filters(params(clinic=Clinic("OKE")), "created_at")
+    assert raised.value.status_code == 400
+
+
+def test_build_projection():
+    assert build_projection(Patient, None) == {"revision_id": 0, "search_keys": 0, "dedup_block": 0}
+    assert build_projection(Patient, "name, id") == {"name": 1, "created_at": 1, "_id": 1}
+    with pytest.raises(HTTPException) as raised:
+        build_projection(Patient, "name,password")
+    assert raised.value.status_code == 400
+    with pytest.raises(HTTPException):
+        build_projection(Patient, "name,search_keys")
+
+
+async def test_list_pages_through_every_patient(client, doctor):
+    for i in range(5):
+        response = await client.post(
+            "/api/patients/", json=payloads.patient(f"H{i:04d}", name=f"Patient{i} Test"), headers=doctor
+        )
+        assert response.status_code == 201, response.text
+
+    seen, cursor = [], None
+    while True:
+        query = {"limit": 2, "fields": "hospital_no"}
+        if cursor:
+            query["cursor"] = cursor
+        response = await client.get("/api/patients/", params=query, headers=doctor)
+        assert response.status_code == 200
+        page = response.json()
+        assert all(set(row) == {"_id", "created_at", "hospital_no"} for row in page["items"])
+        seen += [row["hospital_no"] for row in page["items"]]
+        cursor = page["next_cursor"]
+        if cursor is None:
+            break
+    assert seen == [f"H{i:04d}" for i in reversed(range(5))]
+
+
+async def test_list_filters_by_visit_date(client, doctor):
+    await client.post("/api/patients/", json=payloads.patient("H1", date_of_visit="2024-01-10"), headers=doctor)
+    await client.post("/api/patients/", json=payloads.patient("H2", date_of_visit="2024-02-10"), headers=doctor)
+    response = await client.get(
+        "/api/patients/", params={"from": "2024-02-01", "to": "2024-02-29"}, headers=doctor
+    )
+    assert [row["hospital_no"] for row in response.json()["items"]] == ["H2"]
+
+
+async def test_list_needs_the_doctor_role(client, login):
+    from app.models import Roles
+
+    nurse = await login("nurse1", [Roles.NR])
+    response = await client.get("/api/patients/", headers=nurse)
+    assert response.status_code == 403
+
+
+async def test_list_rows_carry_dates_like_the_detail_route(client, doctor):
+    await client.post("/api/patients/", json=payloads.patient("H1"), headers=doctor)
+    listed = (await client.get("/api/patients/", headers=doctor)).json()["items"][0]
+    detail = (await client.get("/api/patients/patient", params={"hospital_no": "H1"}, headers=doctor)).json()
+    assert listed["date_of_visit"] == detail["date_of_visit"] == "2024-03-02"
+
+
+async def test_finances_filter_by_record_date(client, doctor):
+    # entered today, for a day in March
+    await client.post("/api/finances/", json=payloads.finance("OKE_2024-03-02_DRF_1"), headers=doctor)
+    await client.post("/api/finances/", json=payloads.finance("OKE_2024-04-02_DRF_1"), headers=doctor)
+    response = await client.get(
+        "/api/finances/", params={"from": "2024-03-01", "to": "2024-03-31"}, headers=doctor
+    )
+    assert [row["record_id"] for row in response.json()["items"]] == ["OKE_2024-03-02_DRF_1"]
+    assert response.json()["items"][0]["record_date"] == "2024-03-02"
+
+
+async def test_finances_filter_by_clinic(client, doctor):
+    await client.post("/api/finances/", json=payloads.finance("OKE_2024-03-02_DRF_1"), headers=doctor)
+    await client.post("/api/finances/", json=payloads.finance("IGB_2024-03-02_DRF_1"), headers=doctor)
+    response = await client.get("/api/finances/", params={"clinic": "IGB"}, headers=doctor)
+    assert response.status_code == 200, response.text
+    assert [row["record_id"] for row in response.json()["items"]] == ["IGB_2024-03-02_DRF_1"]
+
+    response = await client.get(
+        "/api/finances/export", params={"clinic": "OKE"}, headers={**doctor, "Accept-Encoding": "identity"}
+    )
+    assert response.status_code == 200, response.text
+    assert [json.loads(line)["record_id"] for line in response.text.splitlines()] == ["OKE_2024-03-02_DRF_1"]
+
+
+async def test_empty_immunization_list_is_an_empty_page(client, doctor):
+    response = await client.get("/api/immunizations/", headers=doctor)
+    assert response.status_code == 200
+    assert response.json()["items"] == []
+
+    await client.post("/api/immunizations/", json=payloads.immunization("C1", clinic="OKE"), headers=doctor)
+    response = await client.get("/api/immunizations/", params={"clinic": "IGB"}, headers=doctor)
+    assert response.status_code == 200
+    assert response.json()["items"] == []
@@ -0,0 +1,109 @@
+"""
+routed reads against a real replica set
+
+mongomock has neither read preferences nor sessions, so these run only
+when MONGO_REPLSET_URL points at a replica set, e.g. a one node one:
+``mongod --replSet rs0``, ``rs.initiate()`` in mongosh, then
+MONGO_REPLSET_URL=mongodb://localhost:27017/?replicaSet=rs0. With one node
+every read preference selects the primary, but the preferences, sessions
+and causal reads are the server's own.
+"""
+import os
+
+import pytest
+from pymongo.read_preferences import SecondaryPreferred
+
+from app import database
+from app.analytics import invalidate_coverage
+from app.cache import USER_CACHE
+from app.models import Patient
+from app.readpref import READ_PREFERENCE, ROUTE_READS, read_preference, read_session, reader
+from app.settings import settings
+from tests import payloads
+
+REPLSET_URL = os.environ.get("MONGO_REPLSET_URL")
+
+pytestmark = pytest.mark.skipif(not REPLSET_URL, reason="MONGO_REPLSET_URL is not set")
+
+
+@pytest.fixture
+async def db(monkeypatch):
+    """overrides conftest's: an emptied database on the replica set"""
+
+    monkeypatch.setattr(settings, "DB_NAME", "comclic_test_replset")
+    for group in ROUTE_READS:
+        monkeypatch.setitem(ROUTE_READS, group, read_preference("secondaryPreferred"))
+    await database.init_db(REPLSET_URL)
+    database_ = database.CLIENT[settings.DB_NAME]
+    # emptied rather than dropped, keeping the indexes init_db built
+    for name in await database_.list_collection_names():
+        await database_[name].delete_many({})
+    USER_CACHE.clear()
+    invalidate_coverage()
+    yield database_
+    await database.CLIENT.drop_database(settings.DB_NAME)
+    database.close_db()
+
+
+async def test_reader_uses_the_route_preference(db):
+    await Patient(**payloads.patient("H1"), entered_by="doctor1").insert()
+    token = READ_PREFERENCE.set(ROUTE_READS["list"])
+    try:
+        collection = reader(Patient)
+        assert isinstance(collection.read_preference, SecondaryPreferred)
+        assert collection.read_preference.max_staleness == settings.DB_MAX_STALENESS_SECONDS
+        assert [row["hospital_no"] async for row in collection.find({})] == ["H1"]
+    finally:
+        READ_PREFERENCE.reset(token)
+
+
+async def test_read_session_is_causally_consistent(db):
+    await Patient(**payloads.patient("H1"), entered_by="doctor1").insert()
+    token = READ_PREFERENCE.set(ROUTE_READS["list"])
+    try:
+        async with read_session() as session:
+            assert session is not None
+            assert session.options.causal_consistency
+            rows = await reader(Patient).find({}, session=session).to_list(None)
+            assert [row["hospital_no"] for row in rows] == ["H1"]
+            # later reads in the session wait for this point
+            assert session.operation_time is not None
+    finally:
+        READ_PREFERENCE.reset(token)
+
+
+async def test_list_route_reads_in_a_session(client, doctor, monkeypatch):
+    for i in range(3):
+        await client.post("/api/patients/", json=payloads.patient(f"H{i}"), headers=doctor)
+
+    sessions = []
+    start_session = database.CLIENT.start_session
+
+    async def recording_start_session(**kwargs):
+        session = await start_session(**kwargs)
+        sessions.append(session)
+        return session
+
+    monkeypatch.setattr(database.CLIENT, "start_session", recording_start_session)
+    response = await client.get("/api/patients/", headers=doctor)
+    assert response.status_code == 200, response.text
+    assert [row["hospital_no"] for row in response.json()["items"]] == ["H2", "H1", "H0"]
+    assert len(sessions) == 1 and sessions[0].options.causal_consistency
+
+    response = await client.get(
+        "/api/patients/", headers={**doctor, "If-None-Match": response.headers["ETag"]}
+    )
+    assert response.status_code == 304
+
+
+async def test_search_and_report_routes(client, doctor):
+    await client.post("/api/patients/", json=payloads.patient("H1"), headers=doctor)
+    await client.post("/api/finances/", json=payloads.finance("OKE_2024-03-02_DRF_1"), headers=doctor)
+
+    response = await client.get("/api/search/", params={"q": "adebayo"}, headers=doctor)
+    assert response.status_code == 200, response.text
+    assert "H1" in response.text
+
+    response = await client.get("/api/finances/summary", headers=doctor)
+    assert response.status_code == 200, response.text
+    assert response.json() == [{"key": "OKE", "total": 1500.0, "count": 1}]
@@ -0,0 +1,35 @@
+"""
+no route sends the fields records keep for the server's own queries
+"""
+from app.models import INTERNAL_FIELDS
+from tests import payloads
+
+
+def assert_public(record: dict) -> None:
+    assert record, "no record"
+    assert not set(INTERNAL_FIELDS) & set(record)
+
+
+async def test_record_routes_hide_internal_fields(client, doctor):
+    response = await client.post("/api/patients/", json=payloads.patient("H1"), headers=doctor)
+    assert_public(response.json())
+    response = await client.post("/api/immunizations/", json=payloads.immunization("C1"), headers=doctor)
+    assert_public(response.json())
+
+    response = await client.get("/api/patients/patient", params={"hospital_no": "H1"}, headers=doctor)
+    assert_public(response.json())
+    response = await client.get("/api/immunizations/C1", params={"card_no": "C1"}, headers=doctor)
+    assert_public(response.json())
+    response = await client.put(
+        "/api/immunizations/C1", params={"card_no": "C1"}, json={"name": "Chidi Obi"}, headers=doctor
+    )
+    assert_public(response.json())
+
+    for path in ("/api/patients/", "/api/immunizations/"):
+        for row in (await client.get(path, headers=doctor)).json()["items"]:
+            assert_public(row)
+
+    response = await client.post("/api/immunizations/batch-get", json={"keys": ["C1"]}, headers=doctor)
+    assert_public(response.json()["items"][0]["record"])
+    response = await client.get("/api/patients/", params={"fields": "name,search_keys"}, headers=doctor)
+    assert response.status_code == 400
@@ -0,0 +1,58 @@
+from datetime import datetime, timedelta
+
+from app.models import InvalidatedToken
+from app.revocation import LEGACY_TOKEN_LIFETIME, RevokedTokens, backfill_expiry
+
+
+async def test_logout_revokes_the_token(client, doctor):
+    assert (await client.get("/api/search/", params={"q": "ada"}, headers=doctor)).status_code == 200
+    assert (await client.post("/api/auth/logout", headers=doctor)).status_code == 200
+    # served from the user cache until logout, so this checks the cache too
+    assert (await client.get("/api/search/", params={"q": "ada"}, headers=doctor)).status_code == 401
+
+
+async def test_lookup_forgets_expired_tokens(db):
+    revoked = RevokedTokens()
+    await revoked.revoke("live", datetime.utcnow() + timedelta(minutes=5))
+    revoked.add("expired", datetime.utcnow() - timedelta(seconds=1))
+    assert "live" in revoked
+    assert "expired" not in revoked and "unknown" not in revoked
+    assert len(revoked) == 1
+
+
+async def test_other_workers_pick_up_revocations(db):
+    this, other = RevokedTokens(), RevokedTokens()
+    await this.load()
+    await other.load()
+
+    await this.revoke("jti-1", datetime.utcnow() + timedelta(minutes=5))
+    assert "jti-1" not in other
+    await other.refresh()
+    assert "jti-1" in other
+
+    # a worker started later loads every unexpired revocation
+    late = RevokedTokens()
+    await late.load()
+    assert "jti-1" in late
+
+
+async def test_backfill_gives_legacy_revocations_an_expiry(db):
+    now = datetime.utcnow()
+    collection = InvalidatedToken.get_motor_collection()
+    await collection.insert_many([
+        {"token": "recent", "invalidated_at": now - timedelta(minutes=10)},
+        {"token": "ancient", "invalidated_at": now - LEGACY_TOKEN_LIFETIME - timedelta(minutes=1)},
+        {"token": "current", "invalidated_at": now, "expires_at": now + timedelta(minutes=30)},
+    ])
+    revoked = RevokedTokens()
+    await revoked.load()
+    # without an expiry a revocation was never honoured
+    assert "recent" not in revoked
+
+    assert await backfill_expiry() == {"updated": 1, "deleted": 1}
+    recent = await collection.find_one({"token": "recent"})
+    assert recent["expires_at"] == recent["invalidated_at"] + LEGACY_TOKEN_LIFETIME
+    assert await collection.count_documents({}) == 2
+    await revoked.load()
+    assert "recent" in revoked and "current" in revoked
+    assert await backfill_expiry() == {"updated": 0, "deleted": 0}
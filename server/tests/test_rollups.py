@@ -0,0 +1,79 @@
+from datetime import date, datetime
+
+from app.models import Finance, FinanceDailyRollup
+from app.rollups import UNKNOWN, rebuild_rollups, rollup_key
+from tests import payloads
+
+
+def finance(**overrides) -> Finance:
+    return Finance(**{**payloads.finance(), "entered_by": "bola", **overrides})
+
+
+def test_rollup_key_comes_from_the_record_id():
+    assert rollup_key(finance()) == ("OKE", datetime(2024, 3, 2), "DRF")
+
+
+def test_rollup_key_falls_back():
+    record = finance(record_id="unparsable", source=["SS"])
+    assert rollup_key(record) == (UNKNOWN, datetime.combine(record.created_at.date(), datetime.min.time()), "SS")
+
+
+async def summary(client, headers, **query) -> list[dict]:
+    response = await client.get("/api/finances/summary", params=query, headers=headers)
+    assert response.status_code == 200
+    return response.json()
+
+
+async def test_writes_keep_rollups_current(client, doctor):
+    await client.post("/api/finances/", json=payloads.finance("OKE_2024-03-02_DRF_1"), headers=doctor)
+    await client.post(
+        "/api/finances/", json=payloads.finance("OKE_2024-03-02_SS_1", source=["SS"], day_total_amount=500), headers=doctor
+    )
+    await client.post("/api/finances/", json=payloads.finance("IGB_2024-04-01_DRF_1"), headers=doctor)
+
+    assert await summary(client, doctor) == [
+        {"key": "IGB", "total": 1500.0, "count": 1},
+        {"key": "OKE", "total": 2000.0, "count": 2},
+    ]
+    assert await summary(client, doctor, group_by="month", to="2024-03-31") == [
+        {"key": "2024-03", "total": 2000.0, "count": 2},
+    ]
+
+    response = await client.put(
+        "/api/finances/financial-record",
+        params={"record_id": "OKE_2024-03-02_SS_1"},
+        json={"day_total_amount": 700},
+        headers=doctor,
+    )
+    assert response.status_code == 200
+    response = await client.delete(
+        "/api/finances/financial-record", params={"record_id": "IGB_2024-04-01_DRF_1"}, headers=doctor
+    )
+    assert response.status_code == 204
+
+    expected = [
+        {"key": "DRF", "total": 1500.0, "count": 1},
+        {"key": "SS", "total": 700.0, "count": 1},
+    ]
+    assert await summary(client, doctor, group_by="source") == expected
+
+    # a rebuild from scratch agrees with the incremental updates
+    await FinanceDailyRollup.get_motor_collection().delete_many({})
+    assert await rebuild_rollups() == 2
+    assert await summary(client, doctor, group_by="source") == expected
+
+
+async def test_backfill_record_parts(db):
+    from app.rollups import backfill_record_parts
+
+    collection = Finance.get_motor_collection()
+    written = datetime(2024, 3, 2, 18)
+    await collection.insert_one(
+        {**payloads.finance("IGB_02032024_SS_1"), "entered_by": "bola", "updated_at": written}
+    )
+    assert await backfill_record_parts() == 1
+    row = await collection.find_one({})
+    assert (row["clinic"], row["record_date"], row["source_code"]) == ("IGB", datetime(2024, 3, 2), "SS")
+    # synced clients fetch it again
+    assert row["updated_at"] > written
+    assert await backfill_record_parts() == 0
@@ -0,0 +1,47 @@
+from datetime import date, timedelta
+
+from app.schedule import MIN_INTERVAL, next_due, parse_dob
+
+
+def test_parse_dob_formats():
+    assert parse_dob("2024-01-05") == date(2024, 1, 5)
+    assert parse_dob("05/01/2024") == date(2024, 1, 5)
+    assert parse_dob(" 05-01-2024 ") == date(2024, 1, 5)
+    assert parse_dob("soon") is None
+    assert parse_dob(None) is None
+
+
+def test_newborn_needs_birth_doses():
+    assert next_due("2024-01-01", []) == ("BCG", date(2024, 1, 1))
+
+
+def test_birth_doses_then_penta():
+    given = ["BCG", "OPV0", "HBV"]
+    assert next_due("2024-01-01", given, date(2024, 1, 2)) == (
+        "PENTA1",
+        date(2024, 1, 1) + timedelta(weeks=6),
+    )
+
+
+def test_missed_birth_dose_window_is_skipped():
+    # OPV0 and HBV are only given in the first two weeks
+    vaccine, _ = next_due("2024-01-01", ["BCG"], date(2024, 2, 20))
+    assert vaccine == "PENTA1"
+
+
+def test_series_dose_waits_min_interval():
+    given = ["BCG", "OPV0", "HBV", "PENTA1"]
+    late_visit = date(2024, 3, 1)
+    assert next_due("2024-01-01", given, late_visit) == (
+        "PENTA2",
+        late_visit + MIN_INTERVAL,
+    )
+
+
+def test_complete_schedule_and_unreadable_dob():
+    everything = [
+        "BCG", "OPV0", "HBV", "PENTA1", "PENTA2", "PENTA3", "IPV1",
+        "MEASLES1", "YELLOW_FEVER", "MENA", "IPV2", "MEASLES2",
+    ]
+    assert next_due("2024-01-01", everything, date(2025, 6, 1)) == (None, None)
+    assert next_due("unknown", []) == (None, None)
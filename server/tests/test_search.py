@@ -0,0 +1,63 @@
+import pytest
+
+from app import search as search_module
+from app.models import Immunization, Patient
+from app.search import MemorySearchIndex, MongoSearchIndex, backfill_search_keys
+from app.text import word_key
+from tests import payloads
+
+NAMES = [
+    "Ada Obi", "Adaeze Obi", "Adamu Bello", "Adaobi Nwosu", "Ada Nwosu",
+    "Obiageli Ada", "Adanna Okoro", "Bello Adamu", "Chidi Eze", "Ngozi Eze",
+]
+QUERIES = ["ada", "ada obi", "obi", "bello", "eze", "ad", "nwosu ada", "0803", "zzz"]
+
+
+async def seed() -> tuple[list[Patient], list[Immunization]]:
+    patients, immunizations = [], []
+    for i, name in enumerate(NAMES):
+        patient = Patient(**payloads.patient(f"H{i}", name=name), entered_by="doctor1")
+        immunization = Immunization(
+            **payloads.immunization(f"C{i}", name=name, contact_no=f"+23480312345{i:02d}"),
+            entered_by="doctor1",
+        )
+        await patient.insert()
+        await immunization.insert()
+        patients.append(patient)
+        immunizations.append(immunization)
+    return patients, immunizations
+
+
+@pytest.mark.parametrize("q", QUERIES)
+async def test_memory_backend_matches_mongo(db, monkeypatch, q):
+    patients, immunizations = await seed()
+    memory = MemorySearchIndex()
+    await memory.upsert_many("patient", patients)
+    await memory.upsert_many("immunization", immunizations)
+
+    results = {}
+    for name, index in (("mongo", MongoSearchIndex()), ("memory", memory)):
+        monkeypatch.setattr(search_module, "SEARCH_INDEX", index)
+        results[name] = await search_module.search(q, ["patient", "immunization"], limit=10)
+    assert results["memory"] == results["mongo"]
+
+
+async def test_whole_words_beat_a_crowd_of_prefixes(db, monkeypatch):
+    # more "ada..." prefix matches than the candidate cap
+    monkeypatch.setattr(search_module, "CANDIDATE_FACTOR", 1)
+    for i in range(8):
+        await Patient(**payloads.patient(f"P{i}", name=f"Adaeze{i} Okafor"), entered_by="doctor1").insert()
+    await Patient(**payloads.patient("EXACT", name="Ada Okafor"), entered_by="doctor1").insert()
+
+    results = await search_module.search("ada", ["patient"], limit=3)
+    assert results[0]["key"] == "EXACT"
+
+
+async def test_backfill_adds_whole_word_keys(db):
+    collection = Patient.get_motor_collection()
+    await collection.insert_one({**payloads.patient("OLD"), "entered_by": "doctor1"})
+    await collection.insert_one({**payloads.patient("PREFIX"), "entered_by": "doctor1", "search_keys": ["ad", "ade"]})
+    assert await backfill_search_keys() == 2
+    for row in await collection.find({}).to_list(length=None):
+        assert word_key("adebayo") in row["search_keys"]
+    assert await backfill_search_keys() == 0
@@ -0,0 +1,117 @@
+import base64
+import json
+from datetime import datetime, timedelta
+
+import pytest
+from bson import ObjectId
+from fastapi import HTTPException
+
+from app import sync as sync_module
+from app.models import TOMBSTONE_TTL, Patient, Roles
+from app.sync import Watermark, decode_watermark, encode_watermark
+from tests import payloads
+
+
+def test_watermark_round_trip():
+    positions = {
+        "patients": (datetime(2024, 3, 2, 8, 0, 0, 1000), ObjectId()),
+        "tombstones": (datetime(2024, 3, 3), ObjectId()),
+    }
+    issued_at = datetime(2024, 3, 4)
+    assert decode_watermark(encode_watermark(positions, issued_at, paging=True)) == Watermark(
+        positions, issued_at, True
+    )
+    assert decode_watermark(None) == Watermark({})
+    assert decode_watermark("") == Watermark({})
+
+
+def test_legacy_watermark_is_as_old_as_its_newest_position():
+    positions = {"patients": ["2024-03-02T08:00:00", str(ObjectId())], "finances": ["2024-03-05T00:00:00", str(ObjectId())]}
+    legacy = base64.urlsafe_b64encode(json.dumps(positions).encode()).decode().rstrip("=")
+    mark = decode_watermark(legacy)
+    assert mark.issued_at == datetime(2024, 3, 5)
+    assert not mark.paging
+
+
+@pytest.mark.parametrize("watermark", ["garbage", "W10", encode_watermark({}, datetime(2024, 1, 1))[:-1] + "!"])
+def test_bad_watermark_is_a_400(watermark):
+    with pytest.raises(HTTPException) as raised:
+        decode_watermark(watermark)
+    assert raised.value.status_code == 400
+
+
+async def sync(client, headers, since=None, limit=500) -> dict:
+    query = {"limit": limit}
+    if since:
+        query["since"] = since
+    response = await client.get("/api/sync/", params=query, headers=headers)
+    assert response.status_code == 200, response.text
+    return response.json()
+
+
+async def test_sync_returns_changes_after_the_watermark(client, doctor, monkeypatch):
+    monkeypatch.setattr(sync_module, "OVERLAP", timedelta(0))
+    for i in range(3):
+        await client.post("/api/patients/", json=payloads.patient(f"H{i}", name=f"Sync{i} Test"), headers=doctor)
+
+    first = await sync(client, doctor, limit=2)
+    assert [row["hospital_no"] for row in first["patients"]] == ["H0", "H1"]
+    assert first["has_more"]
+    second = await sync(client, doctor, first["watermark"], limit=2)
+    assert [row["hospital_no"] for row in second["patients"]] == ["H2"]
+    assert not second["has_more"] and not second["full_resync"]
+    assert "search_keys" not in second["patients"][0]
+
+    await client.put(
+        "/api/patients/patient", params={"hospital_no": "H0"}, json={"treatment": "ORS"}, headers=doctor
+    )
+    await client.delete("/api/patients/H1", params={"hospital_no": "H1"}, headers=doctor)
+    third = await sync(client, doctor, second["watermark"])
+    # caught up, so the last row synced is read again at the watermark
+    assert [row["hospital_no"] for row in third["patients"]] == ["H2", "H0"]
+    assert [row["key"] for row in third["deleted"]["patients"]] == ["H1"]
+
+
+async def test_caught_up_sync_rereads_the_overlap(client, doctor):
+    await client.post("/api/patients/", json=payloads.patient("H1"), headers=doctor)
+    caught_up = await sync(client, doctor)
+
+    # committed late, with an updated_at older than the watermark
+    await Patient(
+        **payloads.patient("H2"), entered_by="doctor1",
+        updated_at=datetime.utcnow() - sync_module.OVERLAP / 2,
+    ).insert()
+    again = await sync(client, doctor, caught_up["watermark"])
+    assert {row["hospital_no"] for row in again["patients"]} == {"H1", "H2"}
+
+
+async def test_paging_doesnt_reread(client, doctor):
+    for i in range(4):
+        await client.post("/api/patients/", json=payloads.patient(f"H{i}", name=f"Page{i} Test"), headers=doctor)
+    seen, body = [], await sync(client, doctor, limit=1)
+    seen += [row["hospital_no"] for row in body["patients"]]
+    while body["has_more"]:
+        body = await sync(client, doctor, body["watermark"], limit=1)
+        seen += [row["hospital_no"] for row in body["patients"]]
+    assert seen == ["H0", "H1", "H2", "H3"]
+
+
+async def test_watermark_older_than_tombstones_resyncs(client, doctor):
+    await client.post("/api/patients/", json=payloads.patient("H1"), headers=doctor)
+    stale = encode_watermark(
+        {"patients": (datetime(2020, 1, 1), ObjectId())},
+        datetime.utcnow() - TOMBSTONE_TTL - timedelta(days=1),
+    )
+    body = await sync(client, doctor, stale)
+    assert body["full_resync"]
+    assert [row["hospital_no"] for row in body["patients"]] == ["H1"]
+    assert not (await sync(client, doctor, body["watermark"]))["full_resync"]
+
+
+async def test_sync_only_returns_readable_collections(client, doctor, login):
+    await client.post("/api/patients/", json=payloads.patient("H1"), headers=doctor)
+    await client.post("/api/immunizations/", json=payloads.immunization("C1"), headers=doctor)
+    chew = await login("chewer", [Roles.CH])
+    body = await sync(client, chew)
+    assert body["patients"] == [] and body["finances"] == []
+    assert [row["card_no"] for row in body["immunizations"]] == ["C1"]
@@ -0,0 +1,67 @@
+from app.dedup import jaro_winkler, name_similarity
+from app.text import (
+    dedup_block,
+    edge_ngrams,
+    fold,
+    phone_variants,
+    query_tokens,
+    search_keys,
+    soundex,
+    tokenize,
+)
+
+
+def test_fold_strips_accents_and_case():
+    assert fold("Adébáyọ̀") == "adebayo"
+
+
+def test_tokenize_keeps_alphanumeric_words():
+    assert tokenize("O'Neil, Ada-Obi 2") == ["o", "neil", "ada", "obi", "2"]
+    assert tokenize(None) == []
+
+
+def test_edge_ngrams_are_bounded():
+    assert edge_ngrams("ada") == ["ad", "ada"]
+    assert edge_ngrams("a") == []
+    assert len(edge_ngrams("x" * 40)[-1]) == 15
+
+
+def test_phone_variants_add_local_form():
+    assert phone_variants("+234 803 123 4567") == ["2348031234567", "08031234567"]
+    assert phone_variants("") == []
+
+
+def test_search_keys_fold_names_and_phones():
+    keys = search_keys(["Ádá Obi"], ["+2348031234567"])
+    assert {"ad", "ada", "ob", "obi", "08", "0803"} <= set(keys)
+    assert keys == sorted(set(keys))
+
+
+def test_query_tokens():
+    assert query_tokens("Ada  ada obi") == ["ada", "obi"]
+    assert query_tokens("0803-123 4567") == ["08031234567"]
+    assert query_tokens("a") == []
+
+
+def test_soundex():
+    assert soundex("robert") == soundex("rupert") == "R163"
+    assert soundex("ashcraft") == "A261"
+    assert soundex("lee") == "L000"
+    assert soundex("") == ""
+
+
+def test_dedup_block_ignores_word_order():
+    assert dedup_block("Ada Obi", "female") == dedup_block("Obi Ada", "F")
+    assert dedup_block("", "F") is None
+
+
+def test_jaro_winkler():
+    assert jaro_winkler("martha", "martha") == 1.0
+    assert round(jaro_winkler("martha", "marhta"), 3) == 0.961
+    assert round(jaro_winkler("dwayne", "duane"), 2) == 0.84
+    assert jaro_winkler("abc", "") == 0.0
+
+
+def test_name_similarity_ignores_word_order():
+    assert name_similarity("Okafor Adebayo", "adebayo okafor") == 1.0
+    assert name_similarity("Adebayo Okafor", "Ngozi Eze") < 0.9
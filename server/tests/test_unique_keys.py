@@ -0,0 +1,36 @@
+import pytest
+
+from tests import payloads
+
+RECORDS = [
+    ("/api/patients/", payloads.patient, "hospital_no", "H1"),
+    ("/api/immunizations/", payloads.immunization, "card_no", "C1"),
+    ("/api/finances/", payloads.finance, "record_id", "OKE_2024-03-02_DRF_1"),
+]
+
+
+@pytest.mark.parametrize("path,payload,field,key", RECORDS)
+async def test_second_create_with_the_same_key_conflicts(client, doctor, path, payload, field, key):
+    response = await client.post(path, json=payload(key), headers=doctor)
+    assert response.status_code in (200, 201), response.text
+    response = await client.post(path, json=payload(key), headers=doctor)
+    assert response.status_code == 409
+    assert response.json()["detail"]["field"] == field
+    assert response.json()["detail"]["value"] == key
+
+
+def registration(username: str, email: str) -> dict:
+    return {"username": username, "email": email, "password": "Passw0rd#", "role": ["Nurse"]}
+
+
+@pytest.mark.parametrize("second,field", [
+    (registration("nurse1", "other@example.com"), "username"),
+    (registration("nurse2", "nurse1@example.com"), "email"),
+])
+async def test_register_rejects_a_taken_username_or_email(client, db, second, field):
+    response = await client.post("/api/auth/register", json=registration("nurse1", "nurse1@example.com"))
+    assert response.status_code == 201, response.text
+    response = await client.post("/api/auth/register", json=second)
+    assert response.status_code == 409
+    assert response.json()["detail"]["field"] == field
+    assert await db["users"].count_documents({}) == 1
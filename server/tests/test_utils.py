@@ -0,0 +1,32 @@
+from passlib.hash import bcrypt
+
+from app.settings import settings
+from app.utils import HASHER, create_passwd_hash, verify_and_update_passwd_async
+
+PASSWORD = "Passw0rd#"
+
+
+def cost(passwd_hash: str) -> int:
+    return int(passwd_hash.split("$")[2])
+
+
+async def test_current_hash_is_kept():
+    verified, new_hash = await verify_and_update_passwd_async(PASSWORD, create_passwd_hash(PASSWORD))
+    assert verified and new_hash is None
+
+
+async def test_hash_of_another_cost_is_replaced():
+    old_hash = bcrypt.using(rounds=settings.BCRYPT_ROUNDS + 1).hash(PASSWORD)
+    verified, new_hash = await verify_and_update_passwd_async(PASSWORD, old_hash)
+    assert verified
+    assert cost(new_hash) == settings.BCRYPT_ROUNDS
+
+
+def test_hashes_below_the_cost_are_outdated():
+    # the login rehash after BCRYPT_ROUNDS goes up relies on this bound
+    assert HASHER.to_dict()["bcrypt__min_rounds"] == settings.BCRYPT_ROUNDS
+
+
+async def test_wrong_password():
+    verified, new_hash = await verify_and_update_passwd_async("nope", create_passwd_hash(PASSWORD))
+    assert not verified and new_hash is None